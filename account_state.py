@@ -0,0 +1,218 @@
+# account_state.py
+# 通知用の口座状態キャッシュ (残高・ポジション・USD/JPY)
+#  - 取引ループが毎サイクル取得した fetch_balance() / fetch_positions() の結果をそのまま流し込む
+#  - 通知の描画はキャッシュを読むだけでネットワークに出ない。古くなっていたら (ACCOUNT_STATE_TTL_SEC 超)
+#    手元の値で描画し、登録された取得関数でバックグラウンド更新を1本だけ走らせる
+#  - USD/JPY は変化が遅いので長い TTL (FX_RATE_TTL_SEC) で保持し、切れたらバックグラウンドで取り直す。
+#    EXCHANGE_MODE=sim では固定レート (SIM_USD_JPY) を返し、ネットワークに出ない
+#  - 取引ループが流し込まないプロセス (telegram_notifier) は refresh() / FxRateCache.get_fresh() で
+#    描画の前に同期的に取り直す (ACCOUNT_STATE_SYNC_TIMEOUT_SEC まで待つ)
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from exchange_registry import EXCHANGE_MODE
+
+ACCOUNT_STATE_TTL_SEC = float(os.getenv("ACCOUNT_STATE_TTL_SEC", "90"))
+FX_RATE_TTL_SEC = float(os.getenv("FX_RATE_TTL_SEC", "21600"))  # 6時間
+FX_RATE_RETRY_SEC = 300  # 取得に失敗したときの再試行間隔
+ACCOUNT_STATE_SYNC_TIMEOUT_SEC = float(os.getenv("ACCOUNT_STATE_SYNC_TIMEOUT_SEC", "5"))
+USDJPY_URL = "https://query1.finance.yahoo.com/v7/finance/quote?symbols=USDJPY=X"
+SIM_USD_JPY = float(os.getenv("SIM_USD_JPY", "150"))
+
+
+def usdt_total(balance):
+    """ccxt の fetch_balance() の結果から USDT の合計を取り出す"""
+    if not balance:
+        return None
+    total = (balance.get("total") or {}).get("USDT")
+    if total is None:
+        total = (balance.get("USDT") or {}).get("total")
+    return float(total) if total is not None else None
+
+
+def open_positions(positions):
+    """ccxt の fetch_positions() の結果から建玉のあるものだけを (symbol, entry, upnl) で返す"""
+    rows = []
+    for pos in positions or []:
+        try:
+            if float(pos.get("contracts") or 0) > 0:
+                rows.append((pos["symbol"], float(pos.get("entryPrice") or 0), float(pos.get("unrealizedPnl") or 0)))
+        except (TypeError, ValueError, KeyError):
+            continue
+    return rows
+
+
+def _run_once(lock, target, name):
+    """lock が取れたときだけ target をバックグラウンドで実行する (同時に1本まで)"""
+    if not lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            target()
+        except Exception as e:
+            logging.warning(f"{name} refresh failed: {e}")
+        finally:
+            lock.release()
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return True
+
+
+class AccountStateCache:
+    """残高とポジションの最新値。update_* で取引ループから更新し、snapshot() で通知側が読む"""
+
+    def __init__(self, ttl_sec=ACCOUNT_STATE_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self.balance = None
+        self.positions = []
+        self.balance_at = 0.0
+        self.positions_at = 0.0
+        self._refresher = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self.stats = {"updates": 0, "reads": 0, "stale_reads": 0, "refreshes": 0}
+
+    def set_refresher(self, refresher):
+        """取引ループが止まっている間に使う取得関数 () -> (balance, positions) を登録する"""
+        self._refresher = refresher
+
+    def update_balance(self, balance):
+        total = usdt_total(balance)
+        if total is None:
+            return
+        with self._lock:
+            self.balance = total
+            self.balance_at = time.time()
+            self.stats["updates"] += 1
+
+    def update_positions(self, positions):
+        if positions is None:
+            return
+        rows = open_positions(positions)
+        with self._lock:
+            self.positions = rows
+            self.positions_at = time.time()
+
+    def update(self, balance, positions):
+        self.update_balance(balance)
+        self.update_positions(positions)
+
+    def age_sec(self):
+        with self._lock:
+            oldest = min(self.balance_at, self.positions_at)
+        return time.time() - oldest if oldest else None
+
+    def stale(self):
+        age = self.age_sec()
+        return age is None or age > self.ttl_sec
+
+    def snapshot(self):
+        """
+        (残高 USDT, 含み損益合計, ポジション行のリスト, 経過秒数) を返す。ネットワークには出ない。
+        まだ一度も取得していなければ残高は None。古ければバックグラウンド更新を依頼する。
+        """
+        with self._lock:
+            balance, positions = self.balance, list(self.positions)
+            self.stats["reads"] += 1
+        age = self.age_sec()
+        if self.stale():
+            self.stats["stale_reads"] += 1
+            self.refresh_in_background()
+        unrealized = sum(upnl for _, _, upnl in positions)
+        pos_list = [f"{symbol} | EP: {entry:.2f} | PnL: {upnl:+.2f} USDT" for symbol, entry, upnl in positions]
+        return balance, unrealized, pos_list, age
+
+    def refresh_in_background(self):
+        if self._refresher is None:
+            return False
+
+        def refresh():
+            balance, positions = self._refresher()
+            self.update(balance, positions)
+            self.stats["refreshes"] += 1
+
+        return _run_once(self._refreshing, refresh, "account-state")
+
+    def refresh(self, timeout=ACCOUNT_STATE_SYNC_TIMEOUT_SEC):
+        """
+        取得関数で取り直し、終わるまで最大 timeout 秒待つ (実行中の更新があればそれを待つ)。
+        この呼び出しの後の値が入ったら True。取得関数が無い・失敗・時間切れなら False
+        """
+        if self._refresher is None:
+            return False
+        started = time.time()
+        self.refresh_in_background()
+        deadline = started + timeout
+        while time.time() < deadline and self._refreshing.locked():
+            time.sleep(0.05)
+        with self._lock:
+            return min(self.balance_at, self.positions_at) >= started
+
+
+class FxRateCache:
+    """USD/JPY を長い TTL で保持する。get() は手元の値を返すだけで、期限切れならバックグラウンドで取り直す"""
+
+    def __init__(self, ttl_sec=FX_RATE_TTL_SEC, url=USDJPY_URL, fixed_rate=None):
+        self.ttl_sec = ttl_sec
+        self.url = url
+        self.fixed_rate = fixed_rate  # 指定すると取得せずにこの値を使う (シミュレーター用)
+        self.rate = None
+        self.fetched_at = 0.0
+        self.next_try_at = 0.0
+        self._refreshing = threading.Lock()
+
+    def fetch(self):
+        if self.fixed_rate is not None:
+            return float(self.fixed_rate)
+        r = requests.get(self.url, timeout=ACCOUNT_STATE_SYNC_TIMEOUT_SEC).json()
+        return float(r["quoteResponse"]["result"][0]["regularMarketPrice"])
+
+    def refresh(self):
+        """同期的に取り直す (取引ループなど、待ってもよい側から呼ぶ)"""
+        self.next_try_at = time.time() + FX_RATE_RETRY_SEC
+        self.rate = self.fetch()
+        self.fetched_at = time.time()
+        return self.rate
+
+    def expired(self):
+        return self.rate is None or time.time() - self.fetched_at > self.ttl_sec
+
+    def get(self):
+        if self.expired() and time.time() >= self.next_try_at:
+            _run_once(self._refreshing, self.refresh, "fx-rate")
+        return self.rate
+
+    def get_fresh(self):
+        """期限切れならその場で取り直してから返す (失敗したら手元の値、無ければ None)。通知プロセス用"""
+        if self.expired() and time.time() >= self.next_try_at:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"fx-rate refresh failed: {e}")
+        return self.rate
+
+
+_account_cache = None
+_fx_cache = None
+_singleton_lock = threading.Lock()
+
+
+def get_account_cache():
+    global _account_cache
+    with _singleton_lock:
+        if _account_cache is None:
+            _account_cache = AccountStateCache()
+        return _account_cache
+
+
+def get_fx_cache():
+    global _fx_cache
+    with _singleton_lock:
+        if _fx_cache is None:
+            _fx_cache = FxRateCache(fixed_rate=SIM_USD_JPY if EXCHANGE_MODE == "sim" else None)
+        return _fx_cache
@@ -1,34 +1,169 @@
 # simple rule-based analyzer per your spec
+# Rules from config.py are compiled once into vectorized predicates over a columnar universe table.
+# A rule is {"name", "conditions", "rank_by", "descending", "top_k", "reason"}; each condition maps a
+# config key (or column name) to a threshold. A bare number means ">=", or "<=" when it is negative
+# (so SHORT_RULE's -8/-3 keep their meaning); a string like "< 2.5" or a [op, value] pair sets the operator.
 import logging
-from config import LONG_RULE, SHORT_RULE, SPIKE_RULE, CANDIDATE_POOL_SIZE
+import operator
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import LONG_RULE, SHORT_RULE, SPIKE_RULE, CANDIDATE_POOL_SIZE, ANALYSIS_EXTRA_RULES
+from utils import top_k_positions
+
+# config key -> universe column
+FIELD_ALIASES = {"volume_pct": "vol_pct", "15m_volume_mult": "vol_15m_mult"}
+# value used when a token dict has no such key (same defaults as the original loop)
+COLUMN_DEFAULTS = {"24h": 0.0, "1h": 0.0, "vol_pct": 0.0, "vol_15m_mult": 1.0}
+OPERATORS = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt, "==": operator.eq, "!=": operator.ne}
+OUTPUT_COLUMNS = ("24h", "1h", "vol_pct")
+
+DEFAULT_RULES = [
+    {"name": "long", "conditions": LONG_RULE, "rank_by": "24h", "descending": True, "top_k": 3,
+     "reason": "24h+ & 1h+ & vol surge"},
+    {"name": "short", "conditions": SHORT_RULE, "rank_by": "24h", "descending": False, "top_k": 3,
+     "reason": "24h- & 1h- & vol surge"},
+    {"name": "spike", "conditions": SPIKE_RULE, "rank_by": "1h", "descending": True, "top_k": 4,
+     "reason": "1h spike + 15m vol x"},
+]
+
+
+def _parse_condition(key, spec):
+    column = FIELD_ALIASES.get(key, key)
+    if isinstance(spec, str):
+        op, _, value = spec.strip().partition(" ")
+        return column, op, float(value)
+    if isinstance(spec, (list, tuple)):
+        return column, spec[0], float(spec[1])
+    return column, "<=" if spec < 0 else ">=", float(spec)
+
+
+class CompiledRule:
+    """A rule turned into (column, comparison, threshold) triples evaluated on whole columns at once."""
+
+    def __init__(self, spec):
+        self.name = spec["name"]
+        self.conditions = [_parse_condition(k, v) for k, v in spec["conditions"].items()]
+        for _, op, _ in self.conditions:
+            if op not in OPERATORS:
+                raise ValueError(f"Unknown operator {op!r} in rule {self.name}")
+        self.rank_by = FIELD_ALIASES.get(spec.get("rank_by", "24h"), spec.get("rank_by", "24h"))
+        self.descending = spec.get("descending", True)
+        self.top_k = spec.get("top_k", 3)
+        self.reason = spec.get("reason", self.name)
+
+    @property
+    def columns(self):
+        return {c for c, _, _ in self.conditions} | {self.rank_by}
+
+    def mask(self, table):
+        hit = np.ones(len(table), dtype=bool)
+        for column, op, threshold in self.conditions:
+            hit &= OPERATORS[op](table.column(column), threshold)  # NaN (missing/non-numeric) never matches
+        return hit
+
+    def rank(self, table, hits, k):
+        key = table.column(self.rank_by)[hits]
+        return top_k_positions(hits, -key if self.descending else key, k)
+
+
+class UniverseTable:
+    """Columnar view of the universe: one float64 array per referenced column, built once per cycle."""
+
+    def __init__(self, records):
+        if isinstance(records, pd.DataFrame):
+            self._frame, self._records = records.reset_index(drop=True), None
+        else:
+            self._frame, self._records = None, list(records)
+        self._columns = {}
+
+    def __len__(self):
+        return len(self._frame) if self._frame is not None else len(self._records)
+
+    @property
+    def symbols(self):
+        if "symbol" not in self._columns:
+            if self._frame is not None:
+                values = self._frame["symbol"].tolist() if "symbol" in self._frame else [None] * len(self)
+            else:
+                values = [t.get("symbol") for t in self._records]
+            self._columns["symbol"] = values
+        return self._columns["symbol"]
+
+    def column(self, name):
+        values = self._columns.get(name)
+        if values is None:
+            default = COLUMN_DEFAULTS.get(name, np.nan)
+            if self._frame is not None:
+                raw = self._frame[name] if name in self._frame else pd.Series(default, index=self._frame.index)
+                values = pd.to_numeric(raw, errors="coerce").fillna(default).to_numpy(np.float64)
+            else:
+                raw = [t.get(name, default) for t in self._records]
+                try:
+                    values = np.array(raw, dtype=np.float64)
+                except (TypeError, ValueError):
+                    values = pd.to_numeric(pd.Series(raw, dtype=object), errors="coerce").to_numpy(np.float64)
+            self._columns[name] = values
+        return values
+
+    def rows(self, positions, reason):
+        symbols = self.symbols
+        cols = {c: self.column(c) for c in OUTPUT_COLUMNS}
+        return [{"symbol": symbols[i], "24h": float(cols["24h"][i]), "1h": float(cols["1h"][i]),
+                 "vol_pct": float(cols["vol_pct"][i]), "reason": reason} for i in positions]
+
 
 class AnalysisEngine:
-    def __init__(self):
-        pass
+    def __init__(self, rules=None, pool_size=CANDIDATE_POOL_SIZE):
+        specs = rules if rules is not None else DEFAULT_RULES + list(ANALYSIS_EXTRA_RULES)
+        self.rules = []
+        for spec in specs:
+            # a bad rule (e.g. from ANALYSIS_EXTRA_RULES) is skipped instead of failing the whole engine
+            try:
+                self.rules.append(CompiledRule(spec))
+            except (KeyError, ValueError, TypeError, AttributeError, IndexError) as e:
+                logging.error(f"Skipping invalid analysis rule {spec!r}: {e!r}")
+        self.pool_size = pool_size
+        self.pools = {}  # rule name -> ranked candidate pool (up to pool_size dicts)
+        self.stats = {r.name: {"evaluations": 0, "hits": 0, "last_hits": 0, "eval_ms": 0.0, "last_eval_ms": 0.0}
+                      for r in self.rules}
+
+    def evaluate(self, market_df_list):
+        """
+        Run every rule over the universe. returns {rule name: top_k candidates}; the ranked pool of up to
+        CANDIDATE_POOL_SIZE hits per rule is kept in self.pools for downstream screening.
+        """
+        table = UniverseTable(market_df_list)
+        results = {}
+        for rule in self.rules:
+            started = time.perf_counter()
+            hits = np.flatnonzero(rule.mask(table)) if len(table) else np.empty(0, dtype=np.int64)
+            pool = rule.rank(table, hits, max(self.pool_size, rule.top_k))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            stats = self.stats[rule.name]
+            stats["evaluations"] += 1
+            stats["hits"] += len(hits)
+            stats["last_hits"] = len(hits)
+            stats["eval_ms"] += elapsed_ms
+            stats["last_eval_ms"] = elapsed_ms
+            self.pools[rule.name] = table.rows(pool, rule.reason)
+            results[rule.name] = self.pools[rule.name][:rule.top_k]
+        logging.debug(f"Rule evaluation over {len(table)} tokens: "
+                      + ", ".join(f"{n}={s['last_hits']} hits/{s['last_eval_ms']:.2f}ms" for n, s in self.stats.items()))
+        return results
 
     def analyze_universe(self, market_df_list):
         """
-        input: list of dict per token:
-          { "symbol": "ETH/USDT", "24h": float, "1h": float, "vol_24h_pct": float, "vol_15m_mult": float }
+        input: list of dict per token (or a DataFrame with the same columns):
+          { "symbol": "ETH/USDT", "24h": float, "1h": float, "vol_pct": float, "vol_15m_mult": float }
         returns: long_candidates (sorted), short_candidates, spikes
         Each element: dict with keys symbol, 24h, 1h, vol_pct, reason
         """
-        long_candidates, short_candidates, spikes = [], [], []
-        for t in market_df_list:
-            s = t.get("symbol")
-            v24 = t.get("24h", 0.0); v1 = t.get("1h", 0.0); vol_pct = t.get("vol_pct", 0.0)
-            vol15_mult = t.get("vol_15m_mult", 1.0)
-            # LONG rule
-            if v24 >= LONG_RULE["24h"] and v1 >= LONG_RULE["1h"] and vol_pct >= LONG_RULE["volume_pct"]:
-                long_candidates.append({"symbol": s, "24h": v24, "1h": v1, "vol_pct": vol_pct, "reason": "24h+ & 1h+ & vol surge"})
-            # SHORT rule
-            if v24 <= SHORT_RULE["24h"] and v1 <= SHORT_RULE["1h"] and vol_pct >= SHORT_RULE["volume_pct"]:
-                short_candidates.append({"symbol": s, "24h": v24, "1h": v1, "vol_pct": vol_pct, "reason": "24h- & 1h- & vol surge"})
-            # spike rule
-            if v1 >= SPIKE_RULE["1h"] and vol15_mult >= SPIKE_RULE["15m_volume_mult"]:
-                spikes.append({"symbol": s, "24h": v24, "1h": v1, "vol_pct": vol_pct, "reason": "1h spike + 15m vol x"})
-        # sort by priority (e.g., 24h desc for long, asc for short)
-        long_candidates = sorted(long_candidates, key=lambda x: x["24h"], reverse=True)[:3]
-        short_candidates = sorted(short_candidates, key=lambda x: x["24h"])[:3]
-        spikes = sorted(spikes, key=lambda x: x["1h"], reverse=True)[:4]
-        return long_candidates, short_candidates, spikes
+        results = self.evaluate(market_df_list)
+        return results.get("long", []), results.get("short", []), results.get("spike", [])
+
+    def rule_stats(self):
+        return {name: dict(s) for name, s in self.stats.items()}
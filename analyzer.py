@@ -1,65 +1,83 @@
+import numpy as np
 import pandas as pd
 import logging
 import sqlite3
 
 # 関連モジュールから必要な関数をインポート
-from database import check_if_recently_notified, record_notification
-from ml_model import load_model, predict_surge_probability
+from database import recently_notified_addresses, record_notifications
+from ml_model import load_model, predict_surge_probabilities
+from utils import top_k_positions
+
+# 検知ルールのしきい値
+LONG_MIN_H24, LONG_MIN_H1, LONG_MIN_SURGE_PROB = 12, 5, 0.6
+SHORT_MAX_H24, SHORT_MAX_H1 = -8, -3
+MIN_VOLUME_H24 = 100000
+TOP_K = 3
+
+def _numeric(values):
+    """JSON から取り出した値を数値列にする (数値化できない値・欠損は 0)"""
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').fillna(0).to_numpy()
 
 def analyze_and_detect_signals(all_pairs_data, db_conn):
     """
     データ分析とシグナル検知のコアロジック。
     この関数が main.py から呼び出される。
+    JSON は1回だけ数値列に展開し、ルールはブール配列、クールダウン確認と AI 推論はまとめて1回で行う。
     """
     model = load_model()
-    long_candidates, short_candidates = [], []
 
     if not all_pairs_data:
         return [], [], [], {}
         
     df = pd.DataFrame(all_pairs_data)
     
-    # データクレンジング
+    # データクレンジング (ネストした JSON を1回の走査で展開)
+    price_change = df['priceChange'].tolist()
     for col in ['h1', 'h24']:
-        df[col] = pd.to_numeric(df['priceChange'].apply(lambda x: x.get(col) if isinstance(x, dict) else 0), errors='coerce').fillna(0)
-    df['volume_h24'] = pd.to_numeric(df['volume'].apply(lambda x: x.get('h24') if isinstance(x, dict) else 0), errors='coerce').fillna(0)
+        df[col] = _numeric([x.get(col) if isinstance(x, dict) else 0 for x in price_change])
+    df['volume_h24'] = _numeric([x.get('h24') if isinstance(x, dict) else 0 for x in df['volume'].tolist()])
+    h1, h24, volume_h24 = df['h1'].to_numpy(), df['h24'].to_numpy(), df['volume_h24'].to_numpy()
     
     total_monitored = len(df)
-    
-    for _, token in df.iterrows():
-        token_addr = token['baseToken']['address']
-        
-        # 最近通知済みかチェック
-        if check_if_recently_notified(db_conn, token_addr):
-            continue
 
-        # MLモデルで急騰確率を予測
-        surge_prob = predict_surge_probability(model, token.to_dict())
-        token['surge_probability'] = surge_prob
-        
-        # --- 検知ロジック ---
-        # LONG候補
-        if token['h24'] >= 12 and token['h1'] >= 5 and token['volume_h24'] > 100000 and surge_prob > 0.6:
-            long_candidates.append(token)
-            
-        # SHORT候補
-        if token['h24'] <= -8 and token['h1'] <= -3 and token['volume_h24'] > 100000:
-            short_candidates.append(token)
+    # 最近通知済みのトークンを1回のクエリで取得して除外する
+    recent = recently_notified_addresses(db_conn)
+    fresh = np.fromiter((token['address'] not in recent for token in df['baseToken']), dtype=bool, count=len(df))
+
+    # --- 検知ロジック ---
+    liquid = fresh & (volume_h24 > MIN_VOLUME_H24)
+    long_rule = liquid & (h24 >= LONG_MIN_H24) & (h1 >= LONG_MIN_H1)
+    short_mask = liquid & (h24 <= SHORT_MAX_H24) & (h1 <= SHORT_MAX_H1)
+
+    # AI 推論は候補になり得る行だけをまとめて1回で行う
+    scored = np.flatnonzero(long_rule | short_mask)
+    surge_probability = np.zeros(len(df))
+    if len(scored):
+        surge_probability[scored] = predict_surge_probabilities(model, df.iloc[scored])
+    long_mask = long_rule & (surge_probability > LONG_MIN_SURGE_PROB)
+
+    # 上位を選出 (LONG は急騰確率の高い順、SHORT は1時間変化率の低い順)
+    long_positions = np.flatnonzero(long_mask)
+    short_positions = np.flatnonzero(short_mask)
+    long_positions = top_k_positions(long_positions, -surge_probability[long_positions], TOP_K)
+    short_positions = top_k_positions(short_positions, h1[short_positions], TOP_K)
+
+    def rows(positions):
+        picked = df.iloc[positions].copy()
+        picked['surge_probability'] = surge_probability[positions]
+        return [token for _, token in picked.iterrows()]
 
-    # 上位を選出
-    long_candidates = sorted(long_candidates, key=lambda x: x['surge_probability'], reverse=True)[:3]
-    short_candidates = sorted(short_candidates, key=lambda x: x['h1'])[:3]
+    long_candidates, short_candidates = rows(long_positions), rows(short_positions)
     
     # 通知したトークンをDBに記録
     with db_conn:
-        for token in long_candidates + short_candidates:
-            record_notification(db_conn, token['baseToken']['address'])
+        record_notifications(db_conn, [token['baseToken']['address'] for token in long_candidates + short_candidates])
     
     # 市場概況
     market_overview = {
         '監視銘柄数': total_monitored,
-        '上昇': len(df[df['h24'] > 0]),
-        '下落': len(df[df['h24'] < 0]),
+        '上昇': int((h24 > 0).sum()),
+        '下落': int((h24 < 0).sum()),
     }
     
     return long_candidates, short_candidates, [], market_overview
@@ -1,25 +1,31 @@
 import asyncio
-import aiohttp
 import logging
 import random
 from datetime import datetime, timedelta
 from config import PROXY_URL, MORALIS_API_KEY
 from features import calculate_technical_indicators
+from http_client import AsyncHttpClient, chunked
+from response_cache import get_response_cache
 
-async def fetch_dexscreener_data(session, chain, pair_addresses):
+DEXSCREENER_MAX_PAIRS_PER_REQUEST = 30  # /latest/dex/pairs は1リクエスト30アドレスまで
+
+async def fetch_dexscreener_data(client, chain, pair_addresses):
+    """ペアアドレスを API の上限ごとに分割して取得する (分割分は並列、流量は client が制限)"""
     if not pair_addresses: return []
-    url = f"https://api.dexscreener.com/latest/dex/pairs/{chain}/{','.join(pair_addresses)}"
-    proxy = PROXY_URL if PROXY_URL else None
-    try:
-        async with session.get(url, timeout=20, proxy=proxy) as response:
-            response.raise_for_status()
-            data = await response.json()
-            return data.get('pairs', [])
-    except Exception as e:
-        logging.error(f"DEX Screener API failed for {chain}: {e}.")
-        return []
 
-async def fetch_ohlcv_data(session, pair_address, timeframe='h1'):
+    async def fetch_chunk(chunk):
+        url = f"https://api.dexscreener.com/latest/dex/pairs/{chain}/{','.join(chunk)}"
+        try:
+            data = await client.get_json(url, timeout=20)
+            return (data or {}).get('pairs') or []
+        except Exception as e:
+            logging.error(f"DEX Screener API failed for {chain} ({len(chunk)} pairs): {e}.")
+            return []
+
+    results = await asyncio.gather(*[fetch_chunk(c) for c in chunked(pair_addresses, DEXSCREENER_MAX_PAIRS_PER_REQUEST)])
+    return [pair for pairs in results for pair in pairs]
+
+async def fetch_ohlcv_data(client, pair_address, timeframe='h1'):
     """指定された時間軸のOHLCVデータを取得する (h1: 1時間足, d1: 日足)"""
     if not pair_address: return []
     
@@ -28,28 +34,26 @@ async def fetch_ohlcv_data(session, pair_address, timeframe='h1'):
     res = resolution_map.get(timeframe, '60')
     
     url = f"https://api.dexscreener.com/latest/dex/ohlcv/pairs/{pair_address}?res={res}&limit=30"
-    proxy = PROXY_URL if PROXY_URL else None
     try:
-        async with session.get(url, timeout=15, proxy=proxy) as response:
-            response.raise_for_status()
-            data = await response.json()
-            return data.get('ohlcv', [])
+        data = await client.get_json(url, timeout=15)
+        return (data or {}).get('ohlcv', [])
     except Exception as e:
         logging.warning(f"Failed to fetch OHLCV data for {pair_address} ({timeframe}): {e}")
         return []
 
-async def fetch_social_data(session, token_symbol):
+async def fetch_social_data(client, token_symbol):
     # (変更なし)
     pass
 
-async def fetch_moralis_data(session, chain_name, token_address):
+async def fetch_moralis_data(client, chain_name, token_address):
     # (変更なし)
     pass
 
 async def fetch_all_data_concurrently(target_pairs):
-    """全データを並列取得し、複数時間軸のテクニカル指標を追加する"""
-    async with aiohttp.ClientSession() as session:
-        market_tasks = [fetch_dexscreener_data(session, chain, pairs) for chain, pairs in target_pairs.items() if pairs]
+    """全データを並列取得し、複数時間軸のテクニカル指標を追加する (同時接続数とレートはホストごとに client が制限)"""
+    cache = get_response_cache()
+    async with AsyncHttpClient(proxy=PROXY_URL, cache=cache) as client:
+        market_tasks = [fetch_dexscreener_data(client, chain, pairs) for chain, pairs in target_pairs.items() if pairs]
         market_results = await asyncio.gather(*market_tasks)
         
         all_pairs = [pair for result in market_results if result for pair in result]
@@ -58,10 +62,10 @@ async def fetch_all_data_concurrently(target_pairs):
         async def fetch_additional_data_for_pair(pair):
             """単一ペアの追加データをまとめて取得する"""
             # ✅ 修正点: 1時間足と日足のデータを両方取得
-            ohlcv_h1_task = fetch_ohlcv_data(session, pair['pairAddress'], timeframe='h1')
-            ohlcv_d1_task = fetch_ohlcv_data(session, pair['pairAddress'], timeframe='d1')
-            social_task = fetch_social_data(session, pair['baseToken']['symbol'])
-            onchain_task = fetch_moralis_data(session, pair['chainId'], pair['baseToken']['address'])
+            ohlcv_h1_task = fetch_ohlcv_data(client, pair['pairAddress'], timeframe='h1')
+            ohlcv_d1_task = fetch_ohlcv_data(client, pair['pairAddress'], timeframe='d1')
+            social_task = fetch_social_data(client, pair['baseToken']['symbol'])
+            onchain_task = fetch_moralis_data(client, pair['chainId'], pair['baseToken']['address'])
             
             ohlcv_h1, ohlcv_d1, social_data, onchain_data = await asyncio.gather(
                 ohlcv_h1_task, ohlcv_d1_task, social_task, onchain_task
@@ -75,6 +79,8 @@ async def fetch_all_data_concurrently(target_pairs):
 
         additional_data_tasks = [fetch_additional_data_for_pair(pair) for pair in all_pairs]
         updated_pairs = await asyncio.gather(*additional_data_tasks)
-        
+        logging.info(f"Fetched data for {len(all_pairs)} pairs: {client.stats}")
+        cache.log_stats()
+
         return [p for p in updated_pairs if p is not None]
 
@@ -0,0 +1,208 @@
+# bars.py
+# ベース足 (細かい足) から上位足を組み立てる
+#  - バケット境界は取引所と同じく epoch (UTC) の整数倍に揃える。日足は UTC 0時 (BAR_DAY_OFFSET_HOURS で変更可)、週足は月曜始まり
+#  - BarSeries はベース足を保持し、新しい足が届いたら影響するバケットだけを作り直す
+#  - 入出力は ccxt の fetch_ohlcv と同じ [timestamp(ms), open, high, low, close, volume] の行
+#  - 最後のバケットは取引所の足と同じく未確定 (形成中) の足として含める
+import os
+import threading
+import time
+
+import numpy as np
+
+BAR_DAY_OFFSET_HOURS = float(os.getenv("BAR_DAY_OFFSET_HOURS", "0"))
+BAR_MAX_BASE_BARS = int(os.getenv("BAR_MAX_BASE_BARS", "5000"))
+BAR_MIN_REFRESH_SEC = float(os.getenv("BAR_MIN_REFRESH_SEC", "20"))  # この間隔内の再取得は省略 (同じサイクル内の重複取得を防ぐ)
+BAR_BASE_TIMEFRAMES = ("1m", "1h")  # REST で取得するベース足。上位足は最も粗い割り切れるベース足から作る
+BAR_FETCH_LIMIT = 1000
+
+_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+_EMPTY = np.empty((0, 6))
+
+
+def timeframe_ms(timeframe):
+    return int(timeframe[:-1]) * _UNIT_MS[timeframe[-1]]
+
+
+def bucket_offset_ms(timeframe):
+    """バケット境界のずれ。日足以上は取引所の日付境界、週足は月曜 (1970-01-01 は木曜なので +4日)"""
+    unit = timeframe[-1]
+    day_offset = int(BAR_DAY_OFFSET_HOURS * _UNIT_MS["h"])
+    if unit == "w":
+        return 4 * _UNIT_MS["d"] + day_offset
+    if unit == "d":
+        return day_offset
+    return 0
+
+
+def bucket_start(ts, timeframe):
+    tf, off = timeframe_ms(timeframe), bucket_offset_ms(timeframe)
+    return (ts - off) // tf * tf + off
+
+
+def aggregate(bars, timeframe):
+    """時刻昇順のベース足 (n, 6) を timeframe の足にまとめる"""
+    bars = np.asarray(bars, dtype=np.float64).reshape(-1, 6)
+    if len(bars) == 0:
+        return _EMPTY
+    buckets = bucket_start(bars[:, 0].astype(np.int64), timeframe)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+    out = np.empty((len(starts), 6))
+    out[:, 0] = buckets[starts]
+    out[:, 1] = bars[starts, 1]
+    out[:, 2] = np.maximum.reduceat(bars[:, 2], starts)
+    out[:, 3] = np.minimum.reduceat(bars[:, 3], starts)
+    out[:, 4] = bars[ends, 4]
+    out[:, 5] = np.add.reduceat(bars[:, 5], starts)
+    return out
+
+
+def volume_bars(bars, threshold, dollar=False):
+    """
+    出来高 (dollar=True なら売買代金 close*volume) が threshold に達するごとに区切った足。
+    ベース足の単位で区切るため、閾値をまたぐ足はその足が始まったグループに入る。最後の足は未完成。
+    """
+    bars = np.asarray(bars, dtype=np.float64).reshape(-1, 6)
+    if len(bars) == 0:
+        return _EMPTY
+    size = bars[:, 5] * bars[:, 4] if dollar else bars[:, 5]
+    group = (np.cumsum(size) - size) // threshold
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+    out = np.empty((len(starts), 6))
+    out[:, 0] = bars[starts, 0]
+    out[:, 1] = bars[starts, 1]
+    out[:, 2] = np.maximum.reduceat(bars[:, 2], starts)
+    out[:, 3] = np.minimum.reduceat(bars[:, 3], starts)
+    out[:, 4] = bars[ends, 4]
+    out[:, 5] = np.add.reduceat(bars[:, 5], starts)
+    return out
+
+
+def _as_rows(arr):
+    return [[int(r[0]), r[1], r[2], r[3], r[4], r[5]] for r in arr.tolist()]
+
+
+class BarSeries:
+    """1シンボル・1ベース足の系列。上位足はキャッシュし、更新されたバケットからだけ作り直す"""
+
+    def __init__(self, base_timeframe, max_bars=BAR_MAX_BASE_BARS):
+        self.base_timeframe = base_timeframe
+        self.max_bars = max_bars
+        self.bars = _EMPTY
+        self.fetched_at = 0.0
+        self.requested = 0  # 全体取得で要求した最大本数 (取引所の上限で少なく返っても再取得し続けない)
+        self._derived = {}  # timeframe -> np.ndarray
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.bars)
+
+    @property
+    def last_ts(self):
+        return int(self.bars[-1, 0]) if len(self.bars) else None
+
+    def update(self, rows):
+        """ベース足をマージする。同じ時刻の足は新しい値で置き換える (未確定だった最後の足の更新)"""
+        new = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+        if len(new) == 0:
+            return
+        new = new[np.argsort(new[:, 0], kind="stable")]
+        new = new[np.r_[new[1:, 0] != new[:-1, 0], True]]  # 同じ時刻は後勝ち
+        first = new[0, 0]
+
+        with self._lock:
+            old = self.bars
+            cut = np.searchsorted(old[:, 0], first)
+            tail = old[cut:]
+            if len(tail):
+                tail = tail[~np.isin(tail[:, 0], new[:, 0])]
+                new = np.vstack([tail, new])
+                new = new[np.argsort(new[:, 0], kind="stable")]
+            bars = np.vstack([old[:cut], new])[-self.max_bars:]
+            self.bars = bars
+
+            for timeframe in list(self._derived):
+                if cut == 0:
+                    # 保持している足より古い履歴が来たときは作り直す
+                    del self._derived[timeframe]
+                    continue
+                start = bucket_start(int(first), timeframe)
+                derived = self._derived[timeframe]
+                keep = derived[(derived[:, 0] < start) & (derived[:, 0] >= bars[0, 0])]  # 切り捨てで欠けたバケットも除く
+                fresh = aggregate(bars[np.searchsorted(bars[:, 0], start):], timeframe)
+                if len(fresh) and fresh[0, 0] < bars[0, 0]:
+                    fresh = fresh[1:]
+                self._derived[timeframe] = np.vstack([keep, fresh])
+
+    def ohlcv(self, timeframe=None, limit=None):
+        """timeframe の足を ccxt と同じ形のリストで返す"""
+        timeframe = timeframe or self.base_timeframe
+        with self._lock:
+            if timeframe == self.base_timeframe:
+                arr = self.bars
+            else:
+                arr = self._derived.get(timeframe)
+                if arr is None:
+                    arr = aggregate(self.bars, timeframe)
+                    # 保持範囲の先頭にかかるバケットはベース足が欠けているので除く
+                    if len(arr) and arr[0, 0] < self.bars[0, 0]:
+                        arr = arr[1:]
+                    self._derived[timeframe] = arr
+        return _as_rows(arr[-limit:] if limit else arr)
+
+
+class BarCache:
+    """
+    シンボルごとの BarSeries を保持し、REST 取得はベース足の差分だけにする。
+    fetch(symbol, timeframe, since, limit) は ccxt の fetch_ohlcv と同じ行を返す関数。
+    """
+
+    def __init__(self, fetch, base_timeframes=BAR_BASE_TIMEFRAMES, max_bars=BAR_MAX_BASE_BARS):
+        self.fetch = fetch
+        self.base_timeframes = base_timeframes
+        self.max_bars = max_bars
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def base_for(self, timeframe):
+        """timeframe を割り切れる最も粗いベース足"""
+        tf = timeframe_ms(timeframe)
+        candidates = [b for b in self.base_timeframes if tf % timeframe_ms(b) == 0]
+        if not candidates:
+            raise ValueError(f"No base timeframe divides {timeframe}")
+        return max(candidates, key=timeframe_ms)
+
+    def series(self, symbol, base_timeframe):
+        key = (symbol, base_timeframe)
+        with self._lock:
+            if key not in self._series:
+                self._series[key] = BarSeries(base_timeframe, self.max_bars)
+            return self._series[key]
+
+    def refresh(self, symbol, base_timeframe, min_bars):
+        """ベース足を最新にする。足りなければ min_bars 本を取得し、あれば最後の足以降だけを取得する"""
+        series = self.series(symbol, base_timeframe)
+        enough = len(series) > 0 and max(len(series), series.requested) >= min_bars
+        if enough and time.time() - series.fetched_at < BAR_MIN_REFRESH_SEC:
+            return series
+        base_ms = timeframe_ms(base_timeframe)
+        missing = int((time.time() * 1000 - series.last_ts) // base_ms) + 2 if enough else None
+        if enough and missing <= BAR_FETCH_LIMIT:
+            rows = self.fetch(symbol, base_timeframe, series.last_ts, missing)
+        else:
+            limit = min(max(min_bars, missing or 0), self.max_bars)
+            rows = self.fetch(symbol, base_timeframe, None, limit)
+            series.requested = max(series.requested, limit) if rows else series.requested
+        if rows:
+            series.update(rows)
+            series.fetched_at = time.time()
+        return series
+
+    def ohlcv(self, symbol, timeframe, limit):
+        """timeframe の足を limit 本返す。上位足はベース足からローカルで組み立てる"""
+        base = self.base_for(timeframe)
+        ratio = timeframe_ms(timeframe) // timeframe_ms(base)
+        series = self.refresh(symbol, base, (limit + 1) * ratio)
+        return series.ohlcv(timeframe, limit)
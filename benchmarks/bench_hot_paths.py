@@ -0,0 +1,357 @@
+# benchmarks/bench_hot_paths.py
+# ホットパスのベンチマーク (オフライン、取引所シミュレーターの合成データか market_recorder の記録を使う)
+#   python benchmarks/bench_hot_paths.py                          # 全ケースを測って benchmarks/results/ に JSON で保存
+#   python benchmarks/bench_hot_paths.py --case backtester --case scoring --repeat 10
+#   python benchmarks/bench_hot_paths.py --replay market_records/ --symbols 30   # 記録した市場データで測る
+#   python benchmarks/compare_results.py                          # 直近2回の結果を比べて劣化を報告する
+# ケース:
+#   run_cycle       main.run_cycle を EXCHANGE_MODE=sim で丸ごと (1銘柄ごとの 0.05s の待ちを含む)
+#   backtest        main.run_backtest_for_symbol (足はキャッシュ済み、バックテストのループが主)
+#   backtester      backtester.Backtester.run_rule_backtest
+#   scoring         scoring_engine.ScoringEngine.generate_score_and_analysis (pandas_ta が無い環境では skipped として記録する)
+#   analyzer        analyzer.analyze_and_detect_signals (一時DB、学習済みモデルをレジストリに登録して推論まで通す)
+#   save_state      state_manager.StateManager.save_state (大きな取引履歴)
+#   db_insert       database.insert_market_data_batch (履歴が溜まったテーブルへ)
+#   db_labels       database.update_future_growth_labels
+#   db_notify       database.record_notifications + recently_notified_addresses
+# 各ケースは1回空回ししてから repeat 回測り、最小・中央値・最大 (ms) を記録する。
+# state.json / DB / モデルは一時ディレクトリに書くので、作業ツリーの状態は変わらない。
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+PRODUCTION_TOP_N = 30  # main.MONITORED_TOP_N の既定値
+
+
+# --- 計測 ---
+def measure(fn, repeat, prepare=None):
+    """prepare (計測外) -> fn を repeat 回。1回目の前に空回しする。各回の ms のリストを返す"""
+    if prepare:
+        prepare()
+    fn()
+    times = []
+    for _ in range(repeat):
+        if prepare:
+            prepare()
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def summarize(times, params):
+    return {
+        "min_ms": round(min(times), 3), "median_ms": round(statistics.median(times), 3),
+        "max_ms": round(max(times), 3), "repeat": len(times), "params": params,
+    }
+
+
+# --- フィクスチャ ---
+def fixture_symbols(feed, n):
+    """出来高の多い順に n 銘柄 (BTC/USDT:USDT -> BTC)"""
+    symbols = sorted(feed.symbols(), key=feed.volume_usd, reverse=True)[:n]
+    return [s.split("/")[0] for s in symbols]
+
+
+def make_pairs(n, seed=0):
+    """analyzer / database に渡す DEX ペア形式の市場データ (一部はシグナル条件に当たるように散らす)"""
+    import numpy as np
+    from ml_model import MODEL_FEATURES
+
+    rng = np.random.default_rng(seed)
+    h1 = rng.normal(0, 4, n)
+    h24 = h1 * 2 + rng.normal(0, 8, n)
+    volume = 10 ** rng.uniform(4, 7, n)
+    price = 10 ** rng.uniform(-4, 2, n)
+    features = rng.normal(size=(n, len(MODEL_FEATURES)))
+    pairs = []
+    for i in range(n):
+        pair = {
+            "baseToken": {"address": f"0x{i:040x}", "symbol": f"TK{i}"},
+            "priceUsd": f"{price[i]:.8g}",
+            "priceChange": {"h1": round(float(h1[i]), 2), "h24": round(float(h24[i]), 2)},
+            "volume": {"h24": round(float(volume[i]), 2)},
+        }
+        pair.update(zip(MODEL_FEATURES, features[i].tolist()))
+        pairs.append(pair)
+    return pairs
+
+
+def open_db(path):
+    import sqlite3
+    from database import ensure_schema
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    ensure_schema(conn)
+    return conn
+
+
+def install_model(seed=42):
+    """小さなフォレストを一時DBに保存し、モデルレジストリに載せる (analyzer の推論経路を通すため)"""
+    import numpy as np
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    from ml_model import MODEL_FEATURES, get_model_registry, save_model_to_db
+
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(3000, len(MODEL_FEATURES))), columns=MODEL_FEATURES)
+    y = (X["Close"] + rng.normal(scale=0.5, size=len(X)) > 0).astype(int)
+    model = RandomForestClassifier(n_estimators=50, random_state=seed).fit(X, y)
+    save_model_to_db(model, get_model_registry().engine, 0.5)
+
+
+class BookExchange:
+    """ScoringEngine が使う fetch_l2_order_book だけを持つ取引所 (板はフィードから、銘柄は BTC/USDT 形式で来る)"""
+
+    def __init__(self, feed):
+        self.feed = feed
+
+    def fetch_l2_order_book(self, symbol, limit=None):
+        from exchange_simulator import market_symbol
+        return self.feed.order_book(market_symbol(symbol.split("/")[0]), limit=limit)
+
+
+# --- ケース (それぞれ (fn, prepare, params) を返す。測れないときは fn=None で params に skipped の理由) ---
+def case_run_cycle(ctx):
+    import main as bot
+    return bot.run_cycle, None, {"symbols": bot.MONITORED_TOP_N}
+
+
+def case_backtest(ctx):
+    import main as bot
+    base = ctx["symbols"][0]
+    return lambda: bot.run_backtest_for_symbol(base, timeframe="1h", lookback=1000), None, {"symbol": base, "lookback": 1000}
+
+
+def case_backtester(ctx):
+    from backtester import Backtester
+    from exchange_simulator import market_symbol
+
+    series = []
+    for base in ctx["symbols"][:10]:
+        rows = ctx["feed"].ohlcv(market_symbol(base), "1h", limit=1000)
+        series.append([{"time": r[0], "open": r[1], "high": r[2], "low": r[3], "close": r[4], "volume": r[5]} for r in rows])
+    rule = {"price_change_threshold_pct": 1.0, "atr_period": 14, "tp_atr_mult": 2.0, "sl_atr_mult": 1.0}
+    bt = Backtester()
+    return lambda: [bt.run_rule_backtest(s, rule) for s in series], None, {"series": len(series), "bars": 1000}
+
+
+def case_scoring(ctx):
+    if not _has_module("pandas_ta"):
+        return None, None, {"skipped": "pandas_ta is not installed (indicators would only hit the error path)"}
+    import pandas as pd
+    from exchange_simulator import market_symbol
+    from scoring_engine import ScoringEngine
+
+    engine = ScoringEngine(BookExchange(ctx["feed"]))
+    frames = {}
+    for base in ctx["symbols"][:10]:
+        rows = ctx["feed"].ohlcv(market_symbol(base), "1h", limit=250)
+        frames[base] = pd.DataFrame(rows, columns=["ts", "open", "high", "low", "close", "volume"])
+    fng = {"value": 35, "sentiment": "Fear"}
+    inputs = []
+
+    def prepare():
+        # 指標の列を series に追加するので毎回コピーを渡す
+        inputs[:] = [({"symbol": base, "price_change_1h": 3.0}, df.copy()) for base, df in frames.items()]
+
+    def run():
+        for token, series in inputs:
+            engine.generate_score_and_analysis(token, series, fng, "LONG")
+
+    return run, prepare, {"series": len(frames), "bars": 250}
+
+
+def case_analyzer(ctx):
+    from analyzer import analyze_and_detect_signals
+    from database import record_notifications
+
+    install_model()
+    pairs = make_pairs(ctx["pairs"])
+    conn = open_db(os.path.join(ctx["tmp"], "analyzer.db"))
+    cooling = [p["baseToken"]["address"] for p in pairs[::10]]  # 1割はクールダウン中
+
+    def prepare():
+        # 前回の実行で通知済みになった分を戻す
+        with conn:
+            conn.execute("DELETE FROM notification_history")
+            record_notifications(conn, cooling)
+
+    return lambda: analyze_and_detect_signals(pairs, conn), prepare, {"pairs": len(pairs)}
+
+
+def case_save_state(ctx):
+    from state_manager import StateManager
+
+    n = ctx["history"]
+    sm = StateManager(state_file=os.path.join(ctx["tmp"], "bench_state.json"))
+    sm.trade_history = [{"token_id": f"SIM{i % 300:03d}", "side": "long" if i % 2 else "short", "amount": 1.5,
+                         "entry_price": 100.0 + i % 97, "exit_price": 101.0 + i % 89, "pnl": (i % 21 - 10) * 0.37,
+                         "reason": "TP", "closed_at": "2026-01-01T00:00:00+09:00"} for i in range(n)]
+    sm.realized_pnl = [{"timestamp": "2026-01-01T00:00:00+09:00", "pnl": (i % 21 - 10) * 0.37} for i in range(n)]
+    sm.notified_tokens = {f"0x{i:040x}": 1767225600 + i for i in range(n // 4)}
+    sm.positions = {f"SIM{i:03d}": {"in_position": True, "details": {
+        "side": "long", "amount": 1.0, "entry_price": 100.0, "take_profit": 110.0, "stop_loss": 95.0,
+        "leverage": 5, "opened_at": "2026-01-01T00:00:00+09:00"}} for i in range(300)}
+    sm.exit_count = sm.entry_count = n
+    return sm.save_state, None, {"trade_history": n, "positions": len(sm.positions)}
+
+
+def _seed_history(conn, pairs, hours, now):
+    """hours 時間分の履歴を5分おきに入れる (最新は now の1時間前 = ラベル付けの対象窓)"""
+    from database import ML_LABEL_LOOKBACK_HOURS
+
+    last = now - ML_LABEL_LOOKBACK_HOURS * 3_600_000
+    rows = []
+    for step in range(hours * 12):
+        ts = last - step * 300_000
+        rows += [(ts, p["baseToken"]["address"], float(p["priceUsd"]), p["volume"]["h24"],
+                  p["priceChange"]["h1"], p["priceChange"]["h24"], None) for p in pairs]
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO market_data_history (timestamp, token_address, price_usd, volume_h24, "
+                         "price_change_h1, price_change_h24, social_mentions) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def case_db_insert(ctx):
+    from database import insert_market_data_batch, now_ms
+
+    pairs = make_pairs(ctx["pairs"], seed=1)
+    conn = open_db(os.path.join(ctx["tmp"], "insert.db"))
+    rows = _seed_history(conn, pairs, ctx["db_hours"], now_ms())
+
+    def run():
+        insert_market_data_batch(conn, pairs)
+        time.sleep(0.002)  # 主キーは (ms, address)。次の回が同じ ms にならないように
+
+    return run, None, {"pairs": len(pairs), "history_rows": rows}
+
+
+def case_db_labels(ctx):
+    from database import update_future_growth_labels, now_ms
+
+    pairs = make_pairs(ctx["pairs"], seed=2)
+    conn = open_db(os.path.join(ctx["tmp"], "labels.db"))
+    rows = _seed_history(conn, pairs, ctx["db_hours"], now_ms())
+
+    def prepare():
+        with conn:
+            conn.execute("UPDATE market_data_history SET future_price_grew = NULL WHERE future_price_grew IS NOT NULL")
+
+    return lambda: update_future_growth_labels(conn, pairs), prepare, {"pairs": len(pairs), "history_rows": rows}
+
+
+def case_db_notify(ctx):
+    from database import record_notifications, recently_notified_addresses
+
+    addresses = [p["baseToken"]["address"] for p in make_pairs(ctx["pairs"], seed=3)]
+    conn = open_db(os.path.join(ctx["tmp"], "notify.db"))
+
+    def run():
+        with conn:
+            record_notifications(conn, addresses)
+        recently_notified_addresses(conn)
+
+    return run, None, {"addresses": len(addresses)}
+
+
+CASES = {
+    "run_cycle": case_run_cycle, "backtest": case_backtest, "backtester": case_backtester, "scoring": case_scoring,
+    "analyzer": case_analyzer, "save_state": case_save_state, "db_insert": case_db_insert,
+    "db_labels": case_db_labels, "db_notify": case_db_notify,
+}
+SLOW_CASES = {"run_cycle": 3}  # 1回が秒単位のケースは回数を抑える
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _has_module(name):
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--case", action="append", choices=list(CASES), help="測るケース (複数指定可、既定: 全部)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--symbols", type=int, default=PRODUCTION_TOP_N, help="run_cycle が回す銘柄数")
+    parser.add_argument("--pairs", type=int, default=2000, help="analyzer / DB ケースの銘柄数")
+    parser.add_argument("--history", type=int, default=20000, help="save_state の取引履歴の件数")
+    parser.add_argument("--db-hours", type=int, default=24, help="DB ケースで事前に入れておく履歴の時間数 (5分おき)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="合成データの代わりに market_recorder の記録 (ファイルかディレクトリ) を使う")
+    parser.add_argument("--output", help="結果の JSON (既定: benchmarks/results/hot_paths_<日時>.json)")
+    parser.add_argument("--verbose", action="store_true", help="ボットのログを INFO のまま出す")
+    args = parser.parse_args()
+
+    # main を import する前に設定する (設定はモジュール読み込み時に読まれる)
+    os.environ.update({
+        "EXCHANGE_MODE": "sim", "SIM_SYMBOLS": str(max(args.symbols, 10)), "MONITORED_TOP_N": str(args.symbols),
+        "SIM_SEED": str(args.seed), "SIM_LATENCY_MS": "0", "SIM_RATE_LIMIT_PER_SEC": "1000000",
+        "PROXY_URL": "http://127.0.0.1:9/", "TELEGRAM_TOKEN": "", "TELEGRAM_CHAT_ID": "", "MARKET_RECORD_DIR": "",
+    })
+    if args.replay:
+        # 記録の時刻で止めて再生する (何回測っても同じデータ)
+        os.environ.update({"SIM_REPLAY_PATH": os.path.abspath(args.replay), "SIM_REPLAY_SPEED": "0"})
+    output = os.path.abspath(args.output) if args.output else os.path.join(
+        RESULTS_DIR, f"hot_paths_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    sys.path.insert(0, ROOT)
+    tmp = tempfile.mkdtemp(prefix="bench_hot_paths_")
+    os.chdir(tmp)
+
+    import main as bot  # noqa: F401  (run_cycle / backtest のケースと同じ設定で全体を読み込んでおく)
+    from exchange_simulator import get_simulator
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    feed = get_simulator().feed
+    ctx = {"feed": feed, "symbols": fixture_symbols(feed, max(args.symbols, 10)), "pairs": args.pairs,
+           "history": args.history, "db_hours": args.db_hours, "tmp": tmp}
+
+    results = {}
+    print(f"{'case':<14}{'min (ms)':>12}{'median (ms)':>14}{'max (ms)':>12}  params")
+    for name in args.case or list(CASES):
+        fn, prepare, params = CASES[name](ctx)
+        if fn is None:
+            results[name] = params
+            print(f"{name:<14}{'skipped':>12}  {params['skipped']}")
+            continue
+        times = measure(fn, min(args.repeat, SLOW_CASES.get(name, args.repeat)), prepare)
+        results[name] = summarize(times, params)
+        r = results[name]
+        print(f"{name:<14}{r['min_ms']:>12.2f}{r['median_ms']:>14.2f}{r['max_ms']:>12.2f}  {json.dumps(params)}")
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"), "commit": _git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "fixture": f"replay:{args.replay}" if args.replay else f"synthetic:seed={args.seed}",
+            "optional_deps": {"pandas_ta": _has_module("pandas_ta")},
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# benchmarks/bench_import_time.py
+# エントリーポイントの import 時間を `python -X importtime` で測り、表にして予算と比べる
+#   python benchmarks/bench_import_time.py [--module main] [--repeat 5] [--top 25]
+#   python benchmarks/bench_import_time.py --save-baseline      # 現在の計測値を基準として保存
+#   python benchmarks/bench_import_time.py --check              # 予算・基準を超えたら終了コード 1
+# 予算 (import_time_budget.json) はモジュールごとに
+#   max_ms: 合計 import 時間の上限 / forbidden: 起動時に読み込まれてはいけない重い依存 (遅延 import のはず)
+# 計測は毎回新しいプロセスで行い、モジュールごとに repeat 回の最小値を使う (ディスクキャッシュ等の揺らぎを除く)。
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_time_budget.json")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_time_baseline.json")
+REGRESSION_TOLERANCE = 0.25  # 基準より 25% 以上遅くなったモジュールを報告する
+REGRESSION_MIN_MS = 20.0     # ただし 20ms 未満の差は揺らぎとして無視する
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力を [(module, self_ms, cumulative_ms, depth)] にする (読み込まれた順)"""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)) / 1000, int(m.group(2)) / 1000, (len(m.group(3)) - 1) // 2))
+    return rows
+
+
+def measure(module, repeat=5):
+    """module を repeat 回 import し、モジュールごとの最小時間を返す: {name: (self_ms, cumulative_ms, depth)}"""
+    best = {}
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+        for name, self_ms, cum_ms, depth in parse_importtime(proc.stderr):
+            if name not in best or cum_ms < best[name][1]:
+                best[name] = (self_ms, cum_ms, depth)
+    return best
+
+
+def print_table(module, timings, top):
+    total = timings[module][1]
+    print(f"\nimport {module}: {total:.1f}ms total, {len(timings)} modules")
+    print(f"{'module':<48}{'self (ms)':>11}{'cumul. (ms)':>13}{'share':>8}")
+    for name, (self_ms, cum_ms, depth) in sorted(timings.items(), key=lambda kv: -kv[1][1])[:top]:
+        label = ("  " * min(depth, 4) + name)[:47]
+        print(f"{label:<48}{self_ms:>11.1f}{cum_ms:>13.1f}{cum_ms / total:>8.1%}")
+
+
+def check(module, timings, budget, baseline):
+    """予算・基準と比べて問題のリストを返す"""
+    problems = []
+    total = timings[module][1]
+    rules = budget.get(module, {})
+    if rules.get("max_ms") and total > rules["max_ms"]:
+        problems.append(f"{module}: import took {total:.0f}ms, budget is {rules['max_ms']:.0f}ms")
+    for name in rules.get("forbidden", []):
+        if name in timings:
+            problems.append(f"{module}: {name} is imported at startup ({timings[name][1]:.0f}ms), it should be imported lazily")
+    base = baseline.get(module, {})
+    for name, cum_ms in base.items():
+        if name in timings:
+            now = timings[name][1]
+            if now - cum_ms > REGRESSION_MIN_MS and now > cum_ms * (1 + REGRESSION_TOLERANCE):
+                problems.append(f"{module}: {name} {cum_ms:.0f}ms -> {now:.0f}ms")
+    new_heavy = [(n, t[1]) for n, t in timings.items() if base and n not in base and t[2] <= 1 and t[1] > REGRESSION_MIN_MS]
+    for name, cum_ms in new_heavy:
+        problems.append(f"{module}: new startup import {name} ({cum_ms:.0f}ms)")
+    return problems
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", action="append", help="計測するモジュール (複数指定可、既定: 予算ファイルの全モジュール)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--check", action="store_true", help="予算・基準を超えたら終了コード 1")
+    parser.add_argument("--save-baseline", action="store_true", help="直下の依存の時間を基準として保存する")
+    args = parser.parse_args()
+
+    budget, baseline = _load_json(BUDGET_PATH), _load_json(BASELINE_PATH)
+    problems = []
+    for module in args.module or list(budget):
+        timings = measure(module, args.repeat)
+        print_table(module, timings, args.top)
+        if args.save_baseline:
+            # 直下 (depth <= 1) の依存だけを保存する。深いモジュールは環境で出入りしやすい
+            baseline[module] = {n: round(t[1], 1) for n, t in timings.items() if t[2] <= 1}
+        if args.check:
+            problems += check(module, timings, budget, baseline)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {BASELINE_PATH}")
+    if args.check:
+        print("\n" + ("\n".join(f"REGRESSION {p}" for p in problems) if problems else "import time within budget"))
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# benchmarks/bench_inference.py
+# 急騰確率推論: 1行ずつ predict_surge_probability vs 一括 predict_surge_probabilities
+#   python benchmarks/bench_inference.py [--sizes 100 1000 10000]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ml_model import MODEL_FEATURES, predict_surge_probabilities, predict_surge_probability
+
+# 1行ずつの経路はこの行数まで実測し、それ以上は線形に外挿する
+PER_ROW_SAMPLE = 300
+
+
+def make_model(seed=42):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(5000, len(MODEL_FEATURES))), columns=MODEL_FEATURES)
+    y = (X['Close'] + rng.normal(scale=0.5, size=len(X)) > 0).astype(int)
+    return RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1).fit(X, y)
+
+
+def make_tokens(n, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(size=(n, len(MODEL_FEATURES))), columns=MODEL_FEATURES)
+    # 欠損値と欠損列の扱いも経路に含める
+    df.loc[df.sample(frac=0.05, random_state=seed).index, 'RSI_14'] = np.nan
+    df = df.drop(columns=['BBU_20_2.0'])
+    df['baseToken'] = [{'address': f'0x{i:040x}'} for i in range(n)]
+    return df
+
+
+def run(sizes):
+    model = make_model()
+    predict_surge_probabilities(model, make_tokens(10))  # warm-up
+    print(f"{'tokens':>8}{'per-row (s)':>14}{'batch (s)':>12}{'speedup':>10}")
+    for n in sizes:
+        df = make_tokens(n)
+
+        sample = df.head(min(n, PER_ROW_SAMPLE))
+        started = time.perf_counter()
+        per_row = [predict_surge_probability(model, row.to_dict()) for _, row in sample.iterrows()]
+        per_row_sec = (time.perf_counter() - started) * n / len(sample)
+
+        started = time.perf_counter()
+        batch = predict_surge_probabilities(model, df)
+        batch_sec = time.perf_counter() - started
+
+        assert np.allclose(per_row, batch[:len(sample)]), "batch and per-row results differ"
+        extrapolated = "*" if n > len(sample) else " "
+        print(f"{n:>8}{per_row_sec:>13.3f}{extrapolated}{batch_sec:>12.4f}{per_row_sec / batch_sec:>9.0f}x")
+    print(f"* per-row time measured on {PER_ROW_SAMPLE} rows and extrapolated")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    run(parser.parse_args().sizes)
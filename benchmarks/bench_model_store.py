@@ -0,0 +1,91 @@
+# benchmarks/bench_model_store.py
+# ウォッチリスト分のモデル読み込み: pickle (unpickle してヒープへ) vs model_store (mmap)
+#   python benchmarks/bench_model_store.py [--symbols 50] [--workers 4] [--trees 100]
+# 各ワーカーは spawn した新しいプロセスで全シンボルのモデルを読み、1回ずつ推論する。
+# RssAnon はプロセス固有のメモリ、RssFile は mmap したファイルのページ (ワーカー間で共有される)。
+import argparse
+import multiprocessing as mp
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_store import ModelArtifactStore
+
+N_FEATURES = 10
+
+
+def _rss_mb():
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon", "RssFile")):
+                key, kb = line.split()[:2]
+                values[key.rstrip(":")] = int(kb) / 1024
+    return values
+
+
+def _worker(args):
+    kind, root, symbols = args
+    X = np.random.default_rng(0).normal(size=(32, N_FEATURES))
+    before = _rss_mb()
+    started = time.perf_counter()
+    if kind == "pickle":
+        models = []
+        for s in symbols:
+            with open(os.path.join(root, f"{s}.pkl"), "rb") as f:
+                models.append(pickle.load(f))
+    else:
+        store = ModelArtifactStore(root)
+        models = [store.load(s) for s in symbols]
+    load_sec = time.perf_counter() - started
+    checksum = sum(float(m.predict_proba(X)[:, 1].sum()) for m in models)
+    after = _rss_mb()
+    return load_sec, after["RssAnon"] - before["RssAnon"], after["RssFile"] - before["RssFile"], checksum
+
+
+def build(root, n_symbols, trees):
+    symbols = [f"SYM{i:02d}USDT" for i in range(n_symbols)]
+    store = ModelArtifactStore(root)
+    for i, s in enumerate(symbols):
+        rng = np.random.default_rng(i)
+        X = rng.normal(size=(5000, N_FEATURES))
+        y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(scale=0.5, size=len(X)) > 0).astype(int)
+        model = RandomForestClassifier(n_estimators=trees, random_state=i, n_jobs=-1).fit(X, y)
+        model.set_params(n_jobs=1)  # ワーカー内の推論は単一スレッドで比べる
+        with open(os.path.join(root, f"{s}.pkl"), "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        store.save(s, model)
+    return symbols
+
+
+def run(n_symbols, workers, trees):
+    with tempfile.TemporaryDirectory() as root:
+        symbols = build(root, n_symbols, trees)
+        size_mb = sum(os.path.getsize(os.path.join(root, f"{s}.pkl")) for s in symbols) / 1e6
+        print(f"symbols={n_symbols}  trees={trees}  workers={workers}  pickles={size_mb:.0f}MB")
+        print(f"{'format':<8}{'load (s)':>10}{'RssAnon/worker (MB)':>22}{'RssFile/worker (MB)':>22}")
+        ctx = mp.get_context("spawn")
+        checksums = {}
+        for kind in ("pickle", "mmap"):
+            with ctx.Pool(workers) as pool:
+                results = pool.map(_worker, [(kind, root, symbols)] * workers)
+            load, anon, file_, check = (np.mean([r[i] for r in results]) for i in range(4))
+            checksums[kind] = check
+            print(f"{kind:<8}{load:>10.3f}{anon:>22.1f}{file_:>22.1f}")
+        assert np.isclose(checksums["pickle"], checksums["mmap"]), "pickle and mmap predictions differ"
+        print("RssFile pages are shared page cache: N workers map the same physical pages once.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--trees", type=int, default=100)
+    args = parser.parse_args()
+    run(args.symbols, args.workers, args.trees)
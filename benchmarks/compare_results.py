@@ -0,0 +1,91 @@
+# benchmarks/compare_results.py
+# bench_hot_paths.py の結果 (JSON) を2つ比べ、遅くなったケースを報告する
+#   python benchmarks/compare_results.py                                   # benchmarks/results/ の直近2回を比べる
+#   python benchmarks/compare_results.py BASE.json NEW.json [--metric median_ms] [--tolerance 0.15]
+# 劣化があれば終了コード 1。パラメータ (銘柄数など) が違うケースや skipped のケースは比べずに表示だけする。
+# 既定の指標は min_ms (共有マシンでの揺らぎに一番強い)。
+import argparse
+import glob
+import json
+import os
+import sys
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+REGRESSION_TOLERANCE = 0.15  # 基準より 15% 以上遅くなったケースを報告する
+REGRESSION_MIN_MS = 2.0      # ただし 2ms 未満の差は揺らぎとして無視する
+
+
+def latest_results(n=2):
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, "hot_paths_*.json")))
+    if len(paths) < n:
+        raise SystemExit(f"need {n} result files in {RESULTS_DIR}, found {len(paths)}")
+    return paths[-n:]
+
+
+def compare(base, new, metric="min_ms", tolerance=REGRESSION_TOLERANCE, min_ms=REGRESSION_MIN_MS):
+    """[(case, base_ms, new_ms, status)] を返す。status は ok / faster / REGRESSION / 比べられない理由"""
+    rows = []
+    base_results, new_results = base["results"], new["results"]
+    for name in list(base_results) + [n for n in new_results if n not in base_results]:
+        b, n = base_results.get(name), new_results.get(name)
+        if b is None or n is None:
+            rows.append((name, None, None, "only in base" if n is None else "new case"))
+        elif "skipped" in b or "skipped" in n:
+            rows.append((name, None, None, f"skipped ({(n if 'skipped' in n else b)['skipped']})"))
+        elif b.get("params") != n.get("params"):
+            rows.append((name, b[metric], n[metric], "params differ"))
+        else:
+            before, after = b[metric], n[metric]
+            if after - before > min_ms and after > before * (1 + tolerance):
+                status = "REGRESSION"
+            elif before - after > min_ms and before > after * (1 + tolerance):
+                status = "faster"
+            else:
+                status = "ok"
+            rows.append((name, before, after, status))
+    return rows
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base", nargs="?", help="基準の結果 (既定: results/ の直近2回のうち古い方)")
+    parser.add_argument("new", nargs="?", help="比べる結果 (既定: results/ の最新)")
+    parser.add_argument("--metric", default="min_ms", choices=["min_ms", "median_ms", "max_ms"])
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="許容する遅れの割合")
+    parser.add_argument("--min-ms", type=float, default=REGRESSION_MIN_MS, help="これ未満の差は無視する")
+    args = parser.parse_args()
+
+    if args.base and args.new:
+        base_path, new_path = args.base, args.new
+    elif args.base:
+        base_path, new_path = args.base, latest_results(1)[0]
+    else:
+        base_path, new_path = latest_results(2)
+    base, new = _load(base_path), _load(new_path)
+
+    print(f"base: {base_path} (commit {base['meta'].get('commit')}, {base['meta'].get('created_at')})")
+    print(f"new:  {new_path} (commit {new['meta'].get('commit')}, {new['meta'].get('created_at')})")
+    for key in ("python", "platform", "cpus", "fixture", "optional_deps"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            print(f"warning: {key} differs ({base['meta'].get(key)} -> {new['meta'].get(key)}), timings may not be comparable")
+
+    rows = compare(base, new, args.metric, args.tolerance, args.min_ms)
+    print(f"\n{'case':<14}{'base (ms)':>12}{'new (ms)':>12}{'change':>9}  status")
+    for name, before, after, status in rows:
+        if before is None:
+            print(f"{name:<14}{'-':>12}{'-':>12}{'-':>9}  {status}")
+        else:
+            print(f"{name:<14}{before:>12.2f}{after:>12.2f}{after / max(before, 1e-9) - 1:>+9.1%}  {status}")
+
+    regressions = [r for r in rows if r[3] == "REGRESSION"]
+    print("\n" + (f"{len(regressions)} regression(s) in {args.metric}" if regressions else f"no regressions in {args.metric}"))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# benchmarks/sim_cycle_load.py
+# 取引所シミュレーター (EXCHANGE_MODE=sim) に対して main.run_cycle をオフラインで回す負荷試験
+#   python benchmarks/sim_cycle_load.py                      # 本番の10倍 (MONITORED_TOP_N の既定 30 x 10 = 300銘柄)
+#   python benchmarks/sim_cycle_load.py --symbols 600 --cycles 3 --latency-ms 80 --rate 20
+#   python benchmarks/sim_cycle_load.py --replay market_records/ --speed 60 --symbols 30   # 記録の再生 (60倍速)
+# 市場データ・注文・口座はすべてシミュレーターから出る (Fear & Greed は接続できない URL に向けて既定値にする)。
+# state.json などは一時ディレクトリに書くので、作業ツリーの状態は変わらない。
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRODUCTION_TOP_N = 30  # main.MONITORED_TOP_N の既定値
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=PRODUCTION_TOP_N * 10, help="監視する銘柄数 (既定: 本番の10倍)")
+    parser.add_argument("--cycles", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="1リクエストあたりの遅延")
+    parser.add_argument("--rate", type=float, default=None, help="公開 API の上限 (回/秒、既定: SIM_RATE_LIMIT_PER_SEC)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="合成データの代わりに market_recorder の記録 (ファイルかディレクトリ) を再生する")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度 (--replay のとき)")
+    parser.add_argument("--check-positions", action="store_true", help="各サイクルの後に TP/SL 判定も回す")
+    args = parser.parse_args()
+
+    # main を import する前に設定する (設定はモジュール読み込み時に読まれる)
+    os.environ.update({
+        "EXCHANGE_MODE": "sim", "SIM_SYMBOLS": str(args.symbols), "MONITORED_TOP_N": str(args.symbols),
+        "SIM_SEED": str(args.seed), "SIM_LATENCY_MS": str(args.latency_ms),
+        "PROXY_URL": "http://127.0.0.1:9/", "TELEGRAM_TOKEN": "", "TELEGRAM_CHAT_ID": "",
+    })
+    if args.rate:
+        os.environ["SIM_RATE_LIMIT_PER_SEC"] = str(args.rate)
+    if args.replay:
+        os.environ.update({"SIM_REPLAY_PATH": os.path.abspath(args.replay), "SIM_REPLAY_SPEED": str(args.speed)})
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="sim_cycle_"))
+
+    import main as bot
+    from exchange_simulator import get_simulator
+
+    durations = []
+    for n in range(args.cycles):
+        started = time.perf_counter()
+        bot.run_cycle()
+        if args.check_positions:
+            bot.check_positions_and_manage()
+        durations.append(time.perf_counter() - started)
+        print(f"cycle {n + 1}: {durations[-1]:.1f}s")
+
+    sim = get_simulator()
+    summary = sim.summary()
+    report = {
+        "symbols": args.symbols, "cycles": args.cycles, "latency_ms": args.latency_ms,
+        "cycle_sec": [round(d, 2) for d in durations],
+        "sec_per_symbol": round(sum(durations) / args.cycles / args.symbols, 4),
+        "exchange_calls": summary["calls"], "throttled_sec": round(summary["throttled_sec"], 2),
+        "orders": summary["orders"], "open_positions": summary["positions"],
+        "equity": round(summary["equity"], 2), "fees": round(summary["fees"], 4),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
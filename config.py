@@ -1,3 +1,5 @@
+import json
+import logging
 import os
 
 # Trading / infrastructure
@@ -15,6 +17,8 @@ TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY")  # for English news (optional)
 COVALENT_API_KEY = os.getenv("COVALENT_API_KEY")  # on-chain (optional)
 FNG_URL = os.getenv("ALTERNATIVE_FNG_API_URL", "https://api.alternative.me/fng/")
+MORALIS_API_KEY = os.getenv("MORALIS_API_KEY")  # on-chain (optional)
+PROXY_URL = os.getenv("PROXY_URL")  # outbound HTTP proxy for API scans (optional)
 
 # Bot params
 MONITORED_CHAINS = os.getenv("MONITORED_CHAINS", "ethereum,solana,base,bnb,arbitrum,optimism,polygon,avalanche").split(",")
@@ -27,6 +31,16 @@ CANDIDATE_POOL_SIZE = int(os.getenv("CANDIDATE_POOL_SIZE", "50"))
 LONG_RULE = {"24h": 12.0, "1h": 5.0, "volume_pct": 150.0}
 SHORT_RULE = {"24h": -8.0, "1h": -3.0, "volume_pct": 200.0}
 SPIKE_RULE = {"1h": 8.0, "15m_volume_mult": 3.0}
+# Extra screening rules (JSON list), e.g. [{"name": "dip", "conditions": {"24h": -15, "1h": ">= 2"}, "rank_by": "1h", "top_k": 3}]
+# 値が壊れていても起動は止めず、追加ルールなしで動かす
+try:
+    ANALYSIS_EXTRA_RULES = json.loads(os.getenv("ANALYSIS_EXTRA_RULES", "[]"))
+    if not isinstance(ANALYSIS_EXTRA_RULES, list):
+        raise ValueError(f"expected a JSON list, got {type(ANALYSIS_EXTRA_RULES).__name__}")
+except ValueError as e:
+    # logging.error() だと import 時に basicConfig が走り、main.py のログ設定が効かなくなる
+    logging.getLogger(__name__).error(f"Ignoring invalid ANALYSIS_EXTRA_RULES: {e}")
+    ANALYSIS_EXTRA_RULES = []
 
 # Persistence
 STATE_FILE = os.getenv("STATE_FILE", "bot_state.json")
@@ -1,27 +1,123 @@
+import asyncio
+import logging
 import requests
 import datetime
+import time
+import numpy as np
 import pandas as pd
-import random
+
+from http_client import AsyncHttpClient
+from response_cache import cached_get, get_response_cache
+
+PRICE_HISTORY_POINTS = 1000  # シンボルごとに保持する価格の本数 (従来の「最新1000本」)
+BITGET_DEPTH_URL = "https://api.bitget.com/api/spot/v1/market/depth"
+FEAR_GREED_URL = "https://api.alternative.me/fng/"
+
+# スナップショットの各シンボルの状態
+STATUS_OK = "ok"            # 今回の取得に成功
+STATUS_STALE = "stale"      # 今回は失敗したが、前回までのバッファがある (last_ts で古さが分かる)
+STATUS_MISSING = "missing"  # データなし
+
+
+class PriceHistoryBuffer:
+    """1シンボルの価格履歴 (epoch ms, USD)。新しい点だけを追記し、末尾 PRICE_HISTORY_POINTS 本を保持する"""
+
+    def __init__(self, capacity=PRICE_HISTORY_POINTS):
+        self.capacity = capacity
+        self.ts = np.empty(0, dtype=np.int64)
+        self.price = np.empty(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ts)
+
+    @property
+    def last_ts(self):
+        return int(self.ts[-1]) if len(self.ts) else None
+
+    def extend(self, points):
+        """CoinGecko の [[ms, price], ...] を追記する。既にある時刻以前の点は捨てる。戻り値: 追加した本数"""
+        if not points:
+            return 0
+        arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        ts = arr[:, 0].astype(np.int64)
+        keep = ts > (self.last_ts if self.last_ts is not None else -1)
+        if not keep.any():
+            return 0
+        self.ts = np.concatenate([self.ts, ts[keep]])[-self.capacity:]
+        self.price = np.concatenate([self.price, arr[keep, 1]])[-self.capacity:]
+        return int(keep.sum())
+
+
+class MarketSnapshot:
+    """
+    列指向のマーケットスナップショット。シンボルごとの値は symbols と同じ順の配列で持つ。
+    欠損は乱数で埋めず、status / NaN / None で明示する。
+    snapshot[sym] は価格配列 (欠損なら None)、snapshot["fear_greed"] / snapshot["orderbook"] も従来の dict 形式と同じキーで読める。
+    """
+
+    def __init__(self, symbols, histories, status, last_ts, fear_greed, orderbook, built_at, latency_ms):
+        self.symbols = list(symbols)
+        self.histories = histories                      # sym -> np.ndarray (float64, 古い順)
+        self.status = np.asarray(status, dtype=object)
+        self.last_price = np.array([h[-1] if h is not None and len(h) else np.nan for h in (histories.get(s) for s in self.symbols)], dtype=np.float64)
+        self.points = np.array([len(histories.get(s)) if histories.get(s) is not None else 0 for s in self.symbols], dtype=np.int32)
+        self.last_ts = np.asarray(last_ts, dtype=np.int64)   # 0 = データなし
+        self.fear_greed = fear_greed                    # int または None (欠損)
+        self.orderbook = orderbook                      # {"bids": float, "asks": float} または None (欠損)
+        self.built_at = built_at
+        self.latency_ms = latency_ms
+
+    @property
+    def missing(self):
+        missing = [s for s, st in zip(self.symbols, self.status) if st == STATUS_MISSING]
+        if self.fear_greed is None:
+            missing.append("fear_greed")
+        if self.orderbook is None:
+            missing.append("orderbook")
+        return missing
+
+    @property
+    def complete(self):
+        return not self.missing and all(st == STATUS_OK for st in self.status)
+
+    def __getitem__(self, key):
+        if key == "fear_greed":
+            return self.fear_greed
+        if key == "orderbook":
+            return self.orderbook
+        return self.histories.get(key)
+
+    def __contains__(self, key):
+        return key in ("fear_greed", "orderbook") or key in self.histories
+
+    def to_frame(self):
+        return pd.DataFrame({
+            "symbol": self.symbols, "status": self.status, "last_price": self.last_price,
+            "last_ts": self.last_ts, "points": self.points,
+        })
+
 
 class DataAggregator:
     def __init__(self):
         self.base_url = "https://api.coingecko.com/api/v3"
+        self.history = {}  # sym -> PriceHistoryBuffer
 
     def fetch_price_history(self, symbol="bitcoin", days=1, interval="minute"):
         """CoinGeckoから履歴価格取得"""
         try:
             url = f"{self.base_url}/coins/{symbol}/market_chart"
             params = {"vs_currency": "usd", "days": days, "interval": "minutely"}
-            res = requests.get(url, params=params, timeout=10)
+            res = cached_get(url, params=params, timeout=10)
             data = res.json()
             prices = [p[1] for p in data["prices"]]
             return prices[-1000:]  # 最新1000本
-        except Exception:
-            return [random.uniform(20000, 30000) for _ in range(1000)]
+        except Exception as e:
+            logging.warning(f"Price history fetch failed for {symbol}: {e}")
+            return []
 
     def fetch_fear_greed(self):
         try:
-            res = requests.get("https://api.alternative.me/fng/", timeout=10)
+            res = cached_get(FEAR_GREED_URL, timeout=10)
             j = res.json()
             return j["data"][0]["value"]
         except Exception:
@@ -30,32 +126,102 @@ class DataAggregator:
     def fetch_orderbook_depth(self, symbol="BTCUSDT"):
         """Bitget orderbook 取得（デモ: 実際にはAPIキー不要）"""
         try:
-            url = "https://api.bitget.com/api/spot/v1/market/depth"
             params = {"symbol": symbol, "limit": 50}
-            res = requests.get(url, params=params, timeout=10)
+            res = requests.get(BITGET_DEPTH_URL, params=params, timeout=10)
             j = res.json()
             bids = sum([float(x[1]) for x in j["data"]["bids"]])
             asks = sum([float(x[1]) for x in j["data"]["asks"]])
             return {"bids": bids, "asks": asks}
-        except Exception:
-            return {"bids": random.uniform(100, 200), "asks": random.uniform(100, 200)}
+        except Exception as e:
+            logging.warning(f"Orderbook depth fetch failed for {symbol}: {e}")
+            return None
 
     def fetch_trending_coins(self):
         try:
-            res = requests.get(f"{self.base_url}/search/trending", timeout=10)
+            res = cached_get(f"{self.base_url}/search/trending", timeout=10)
             j = res.json()
             return [c["item"]["id"] for c in j["coins"]][:7]
         except Exception:
             return ["bitcoin", "ethereum", "solana"]
 
-    def build_market_snapshot(self, symbols=None):
-        snapshot = {}
-        if not symbols:
-            symbols = ["bitcoin"] + self.fetch_trending_coins()
+    def get_historical_data_for_training(self, start_ms=None, end_ms=None, validation_fraction=None, max_rows=None):
+        """
+        market_data_history のラベル付き行をチャンク単位で読み込み、特徴量化した TrainingDataset を返す。
+        テーブル全体を1つの DataFrame にはしない (training_data.load_training_dataset を参照)。
+        """
+        import training_data
+        return training_data.load_training_dataset(
+            start_ms=start_ms, end_ms=end_ms,
+            validation_fraction=training_data.TRAINING_VALIDATION_FRACTION if validation_fraction is None else validation_fraction,
+            max_rows=training_data.TRAINING_MAX_ROWS if max_rows is None else max_rows,
+        )
 
-        for sym in symbols:
-            snapshot[sym] = self.fetch_price_history(sym)
+    async def _update_history(self, client, sym):
+        """sym のバッファを最新にする。初回は1日分、以降は最後の点より後だけを range で取得する"""
+        buffer = self.history.setdefault(sym, PriceHistoryBuffer())
+        if buffer.last_ts is None:
+            url = f"{self.base_url}/coins/{sym}/market_chart"
+            params = {"vs_currency": "usd", "days": 1, "interval": "minutely"}
+        else:
+            url = f"{self.base_url}/coins/{sym}/market_chart/range"
+            params = {"vs_currency": "usd", "from": buffer.last_ts // 1000 + 1, "to": int(time.time())}
+        try:
+            data = await client.get_json(url, params=params, timeout=10)
+            buffer.extend(data["prices"])
+            return STATUS_OK if len(buffer) else STATUS_MISSING
+        except Exception as e:
+            logging.warning(f"Price history update failed for {sym}: {e}")
+            return STATUS_STALE if len(buffer) else STATUS_MISSING
 
-        snapshot["fear_greed"] = self.fetch_fear_greed()
-        snapshot["orderbook"] = self.fetch_orderbook_depth()
+    async def _fetch_fear_greed(self, client):
+        try:
+            data = await client.get_json(FEAR_GREED_URL, timeout=10)
+            return int(data["data"][0]["value"])
+        except Exception as e:
+            logging.warning(f"Fear & Greed fetch failed: {e}")
+            return None
+
+    async def _fetch_orderbook(self, client, symbol="BTCUSDT"):
+        try:
+            data = await client.get_json(BITGET_DEPTH_URL, params={"symbol": symbol, "limit": 50}, timeout=10)
+            return {"bids": sum(float(x[1]) for x in data["data"]["bids"]),
+                    "asks": sum(float(x[1]) for x in data["data"]["asks"])}
+        except Exception as e:
+            logging.warning(f"Orderbook depth fetch failed for {symbol}: {e}")
+            return None
+
+    async def _fetch_trending(self, client):
+        try:
+            data = await client.get_json(f"{self.base_url}/search/trending", timeout=10)
+            return [c["item"]["id"] for c in data["coins"]][:7]
+        except Exception as e:
+            logging.warning(f"Trending coins fetch failed: {e}")
+            return ["bitcoin", "ethereum", "solana"]
+
+    async def build_market_snapshot_async(self, symbols=None):
+        """
+        全シンボルの価格履歴・F&G・板をまとめて並列に取得し、MarketSnapshot を返す。
+        所要時間は各リクエストの合計ではなく最大 (流量は AsyncHttpClient がホストごとに制限)。
+        """
+        started = time.perf_counter()
+        async with AsyncHttpClient(cache=get_response_cache()) as client:
+            if not symbols:
+                symbols = ["bitcoin"] + await self._fetch_trending(client)
+            symbols = list(dict.fromkeys(symbols))
+            *status, fear_greed, orderbook = await asyncio.gather(
+                *[self._update_history(client, sym) for sym in symbols],
+                self._fetch_fear_greed(client),
+                self._fetch_orderbook(client),
+            )
+
+        histories = {sym: self.history[sym].price.copy() if len(self.history[sym]) else None for sym in symbols}
+        last_ts = [self.history[sym].last_ts or 0 for sym in symbols]
+        snapshot = MarketSnapshot(symbols, histories, status, last_ts, fear_greed, orderbook,
+                                  built_at=int(time.time() * 1000), latency_ms=(time.perf_counter() - started) * 1000)
+        if snapshot.missing:
+            logging.warning(f"Market snapshot missing data: {snapshot.missing}")
         return snapshot
+
+    def build_market_snapshot(self, symbols=None):
+        """同期版 (イベントループの外から呼ぶ)"""
+        return asyncio.run(self.build_market_snapshot_async(symbols))
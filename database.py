@@ -1,6 +1,7 @@
 import sqlite3
 import logging
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 
 # config.pyからインポートすることを想定
 # from config import DB_FILE, NOTIFICATION_COOLDOWN_HOURS, ML_LABEL_LOOKBACK_HOURS
@@ -8,96 +9,281 @@ from datetime import datetime, timedelta
 DB_FILE = "sentinel_data.db"
 NOTIFICATION_COOLDOWN_HOURS = 6
 ML_LABEL_LOOKBACK_HOURS = 1
+ML_LABEL_GROWTH_THRESHOLD = 0.10
 
 
-def init_db():
-    """データベースとテーブルを初期化する"""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        
-        # 通知履歴テーブル
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS notification_history (
-            token_address TEXT PRIMARY KEY, 
-            last_notified TEXT NOT NULL
-        )""")
-        
-        # ML用データ履歴テーブル
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS market_data_history (
-            timestamp TEXT, 
-            token_address TEXT, 
-            price_usd REAL, 
+# epoch-ms (INTEGER) で時刻を保持するスキーマのバージョン
+SCHEMA_VERSION = 2
+
+# 集計テーブル共通の定義 (bucket_start はバケット開始時刻の epoch ms)
+_AGGREGATE_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket_start INTEGER NOT NULL,
+            token_address TEXT NOT NULL,
+            first_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume_h24_avg REAL,
+            price_change_h1_avg REAL,
+            price_change_h24_avg REAL,
+            social_mentions_avg REAL,
+            samples INTEGER NOT NULL,
+            labeled INTEGER NOT NULL DEFAULT 0,
+            grew INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket_start, token_address)
+        )"""
+
+# テーブル定義 ({table} は移行時に作業用テーブル名へ差し替える)
+TABLE_SCHEMAS = {
+    # 通知履歴テーブル
+    "notification_history": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            token_address TEXT PRIMARY KEY,
+            last_notified INTEGER NOT NULL -- epoch ms (UTC)
+        )""",
+    # ML用データ履歴テーブル
+    "market_data_history": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            timestamp INTEGER, -- epoch ms (UTC)
+            token_address TEXT,
+            price_usd REAL,
             volume_h24 REAL,
-            price_change_h1 REAL, 
-            price_change_h24 REAL, 
+            price_change_h1 REAL,
+            price_change_h24 REAL,
             social_mentions INTEGER,
-            future_price_grew INTEGER, 
+            future_price_grew INTEGER,
             PRIMARY KEY (timestamp, token_address)
-        )""")
-
-        # 現在開いているポジションを管理するテーブル
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS open_positions (
+        )""",
+    # 現在開いているポジションを管理するテーブル
+    "open_positions": """
+        CREATE TABLE IF NOT EXISTS {table} (
             symbol TEXT PRIMARY KEY,
             side TEXT NOT NULL,
             entry_price REAL NOT NULL,
             amount REAL NOT NULL,
-            opened_at TEXT NOT NULL
-        )""")
-        
-        # 全ての取引履歴を記録するテーブル
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS trade_history (
+            opened_at INTEGER NOT NULL -- epoch ms (UTC)
+        )""",
+    # 全ての取引履歴を記録するテーブル
+    "trade_history": """
+        CREATE TABLE IF NOT EXISTS {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             symbol TEXT NOT NULL,
             side TEXT NOT NULL,
             status TEXT NOT NULL, -- 'OPEN' or 'CLOSE'
             price REAL NOT NULL,
             amount REAL NOT NULL,
-            timestamp TEXT NOT NULL
-        )""")
-        
-        # 分析シグナルの最終決定を記録するテーブル
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS signal_decisions (
+            timestamp INTEGER NOT NULL -- epoch ms (UTC)
+        )""",
+    # 分析シグナルの最終決定を記録するテーブル
+    "signal_decisions": """
+        CREATE TABLE IF NOT EXISTS {table} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
+            timestamp INTEGER NOT NULL, -- epoch ms (UTC)
             symbol TEXT NOT NULL,
             signal_type TEXT NOT NULL, -- 'LONG' or 'SHORT'
             decision TEXT NOT NULL, -- 'ENTER', 'PASS', 'CLOSE'など
             reason TEXT
+        )""",
+    # market_data_history の時間足/日足集計 (retention.py がロールアップする)
+    "market_data_hourly": _AGGREGATE_SCHEMA,
+    "market_data_daily": _AGGREGATE_SCHEMA,
+    # 取得済みニュース (URL のハッシュで重複排除)
+    "news_articles": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            url_hash TEXT PRIMARY KEY,
+            url TEXT,
+            source TEXT,
+            lang TEXT,
+            title TEXT,
+            title_ja TEXT,
+            published_at TEXT,
+            first_seen INTEGER NOT NULL -- epoch ms (UTC)
+        )""",
+    # 見出しの翻訳キャッシュ (原文・言語のハッシュ -> 訳文)
+    "translation_cache": """
+        CREATE TABLE IF NOT EXISTS {table} (
+            text_hash TEXT PRIMARY KEY,
+            translated TEXT NOT NULL,
+            created_at INTEGER NOT NULL -- epoch ms (UTC)
+        )""",
+}
+
+# 各テーブルの時刻カラム
+TIMESTAMP_COLUMNS = {
+    "notification_history": "last_notified",
+    "market_data_history": "timestamp",
+    "open_positions": "opened_at",
+    "trade_history": "timestamp",
+    "signal_decisions": "timestamp",
+}
+
+INDEXES = [
+    # ラベル未確定行だけを対象にした部分インデックス (ラベル付けの時間窓検索用)
+    """CREATE INDEX IF NOT EXISTS idx_mdh_unlabeled_timestamp
+        ON market_data_history (timestamp)
+        WHERE future_price_grew IS NULL""",
+    # トークン別の時系列検索用
+    """CREATE INDEX IF NOT EXISTS idx_mdh_token_timestamp
+        ON market_data_history (token_address, timestamp)""",
+    "CREATE INDEX IF NOT EXISTS idx_trade_history_timestamp ON trade_history (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_signal_decisions_timestamp ON signal_decisions (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_news_articles_source_first_seen ON news_articles (source, first_seen)",
+]
+
+
+def now_ms():
+    """現在時刻を epoch ms (UTC) で返す"""
+    return int(time.time() * 1000)
+
+
+def to_epoch_ms(value):
+    """
+    旧スキーマの時刻値 (ISO-8601文字列 / datetime / 数値) を epoch ms に変換する。
+    タイムゾーンなしの値は datetime.now() で書かれたローカル時刻として扱う。
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        dt = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).strip())
+        return int(round(dt.timestamp() * 1000))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_schema_version(conn):
+    """適用済みのスキーマバージョンを返す (未作成なら0)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at INTEGER NOT NULL
         )""")
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def _column_type(conn, table, column):
+    for _, name, col_type, *_ in conn.execute(f"PRAGMA table_info({table})"):
+        if name == column:
+            return (col_type or "").upper()
+    return None
+
+
+def migrate_to_epoch_ms(conn):
+    """
+    TEXT(ISO-8601) で時刻を保持している旧テーブルを INTEGER epoch ms へその場で移行する。
+    テーブルごとに作業用テーブルへ変換コピーして入れ替える。全テーブルを1トランザクションで行う。
+    戻り値: {テーブル名: 移行行数}
+    """
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return {}
+
+    conn.create_function("to_epoch_ms", 1, to_epoch_ms, deterministic=True)
+    migrated = {}
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, ts_col in TIMESTAMP_COLUMNS.items():
+            if _column_type(conn, table, ts_col) in (None, "INTEGER"):
+                continue
+
+            started = time.perf_counter()
+            work_table = f"{table}__v{SCHEMA_VERSION}"
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            select_cols = ", ".join(f"to_epoch_ms({c})" if c == ts_col else c for c in columns)
+
+            conn.execute(f"DROP TABLE IF EXISTS {work_table}")
+            conn.execute(TABLE_SCHEMAS[table].format(table=work_table))
+            copied = conn.execute(
+                f"INSERT OR IGNORE INTO {work_table} ({', '.join(columns)}) SELECT {select_cols} FROM {table} "
+                f"WHERE to_epoch_ms({ts_col}) IS NOT NULL"
+            ).rowcount
+            total = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {work_table} RENAME TO {table}")
+
+            migrated[table] = copied
+            if copied < total:
+                logging.warning(f"Dropped {total - copied} rows with unparseable timestamps from {table}.")
+            logging.info(f"Migrated {table}.{ts_col} to epoch ms: {copied} rows in {time.perf_counter() - started:.2f}s.")
+
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_version (version, applied_at) VALUES (?, ?)",
+            (SCHEMA_VERSION, now_ms())
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return migrated
+
+
+def ensure_schema(conn):
+    """
+    テーブルとインデックスを作成する (既存なら何もしない)。
+    旧スキーマ (TEXT の時刻) のDBなら先に epoch ms へ移行する。移行済みならバージョンを見るだけ
+    """
+    migrate_to_epoch_ms(conn)
+    with conn:
+        for table, ddl in TABLE_SCHEMAS.items():
+            conn.execute(ddl.format(table=table))
+        for ddl in INDEXES:
+            conn.execute(ddl)
+
+
+def init_db():
+    """データベースとテーブルを初期化し、旧スキーマであれば epoch ms スキーマへ移行する"""
+    with sqlite3.connect(DB_FILE) as conn:
+        # 新規DBのみ有効 (既存DBは retention.py --enable-incremental-vacuum で切り替える)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        ensure_schema(conn)
 
     logging.info("Database initialized successfully.")
 
 def check_if_recently_notified(conn, token_address):
     """指定されたトークンが最近通知されたかチェックする"""
-    cursor = conn.cursor()
-    cursor.execute("SELECT last_notified FROM notification_history WHERE token_address = ?", (token_address,))
-    result = cursor.fetchone()
-    if result and result[0]:
-        last_notified = datetime.fromisoformat(result[0])
-        if (datetime.now() - last_notified).total_seconds() < NOTIFICATION_COOLDOWN_HOURS * 3600:
-            return True
-    return False
+    cutoff = now_ms() - NOTIFICATION_COOLDOWN_HOURS * 3600 * 1000
+    cursor = conn.execute(
+        "SELECT 1 FROM notification_history WHERE token_address = ? AND last_notified > ?",
+        (token_address, cutoff)
+    )
+    return cursor.fetchone() is not None
 
 def record_notification(conn, token_address):
     """通知をDBに記録する"""
     conn.execute(
         "INSERT OR REPLACE INTO notification_history (token_address, last_notified) VALUES (?, ?)",
-        (token_address, datetime.now().isoformat())
+        (token_address, now_ms())
+    )
+
+def recently_notified_addresses(conn):
+    """クールダウン中のトークンアドレスの集合 (1回のクエリで取得)"""
+    cutoff = now_ms() - NOTIFICATION_COOLDOWN_HOURS * 3600 * 1000
+    cursor = conn.execute("SELECT token_address FROM notification_history WHERE last_notified > ?", (cutoff,))
+    return {row[0] for row in cursor}
+
+def record_notifications(conn, token_addresses):
+    """複数トークンの通知をまとめてDBに記録する"""
+    now = now_ms()
+    conn.executemany(
+        "INSERT OR REPLACE INTO notification_history (token_address, last_notified) VALUES (?, ?)",
+        [(address, now) for address in token_addresses]
     )
 
 def insert_market_data_batch(conn, market_data_list):
     """現在の市場データ群を履歴テーブルに一括挿入する"""
     records_to_insert = []
-    now_iso = datetime.now().isoformat()
+    now = now_ms()
     for token in market_data_list:
         try:
             if not token.get('priceUsd') or not token.get('baseToken'): continue
             records_to_insert.append((
-                now_iso,
+                now,
                 token['baseToken']['address'],
                 float(token['priceUsd']),
                 token.get('volume', {}).get('h24'),
@@ -119,37 +305,56 @@ def insert_market_data_batch(conn, market_data_list):
             logging.info(f"Logged {cursor.rowcount} new records to market_data_history.")
 
 def update_future_growth_labels(conn, current_market_data):
-    """現在の価格を使い、過去のデータにML用の結果ラベルを書き込む"""
-    current_price_map = {
-        token['baseToken']['address']: float(token['priceUsd'])
-        for token in current_market_data if token.get('priceUsd') and token.get('baseToken')
-    }
-    if not current_price_map: return
+    """
+    現在の価格を使い、過去のデータにML用の結果ラベルを書き込む。
+    現在価格を一時テーブルに流し込み、ラベル付けは1本の UPDATE ... FROM で行う。
+    戻り値: 更新した行数
+    """
+    current_prices = []
+    for token in current_market_data:
+        if not token.get('priceUsd') or not token.get('baseToken'): continue
+        try:
+            current_prices.append((token['baseToken']['address'], float(token['priceUsd'])))
+        except (TypeError, KeyError, ValueError):
+            continue
+    if not current_prices: return 0
 
-    target_time = datetime.now() - timedelta(hours=ML_LABEL_LOOKBACK_HOURS)
-    time_window_start = (target_time - timedelta(minutes=5)).isoformat()
-    time_window_end = (target_time + timedelta(minutes=5)).isoformat()
+    target_time = now_ms() - ML_LABEL_LOOKBACK_HOURS * 3600 * 1000
+    time_window_start = target_time - 5 * 60 * 1000
+    time_window_end = target_time + 5 * 60 * 1000
 
+    started = time.perf_counter()
     with conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT timestamp, token_address, price_usd FROM market_data_history
-            WHERE future_price_grew IS NULL AND timestamp BETWEEN ? AND ?
-        """, (time_window_start, time_window_end))
-        records_to_update = cursor.fetchall()
-
-        updates_for_db = []
-        for timestamp, token_address, old_price in records_to_update:
-            if token_address in current_price_map and old_price and old_price > 0:
-                current_price = current_price_map[token_address]
-                price_growth = (current_price - old_price) / old_price
-                future_price_grew = 1 if price_growth > 0.10 else 0
-                updates_for_db.append((future_price_grew, timestamp, token_address))
-
-        if updates_for_db:
-            cursor.executemany("UPDATE market_data_history SET future_price_grew = ? WHERE timestamp = ? AND token_address = ?", updates_for_db)
-            if cursor.rowcount > 0:
-                logging.info(f"Updated {cursor.rowcount} ML labels in history table.")
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS current_prices (
+                token_address TEXT PRIMARY KEY,
+                price_usd REAL NOT NULL
+            )""")
+        conn.execute("DELETE FROM temp.current_prices")
+        conn.executemany(
+            "INSERT OR REPLACE INTO temp.current_prices (token_address, price_usd) VALUES (?, ?)",
+            current_prices
+        )
+        cursor = conn.execute("""
+            UPDATE market_data_history AS h
+            SET future_price_grew = CASE
+                WHEN (cp.price_usd - h.price_usd) / h.price_usd > ? THEN 1 ELSE 0
+            END
+            FROM temp.current_prices AS cp
+            WHERE h.future_price_grew IS NULL
+              AND h.timestamp BETWEEN ? AND ?
+              AND h.token_address = cp.token_address
+              AND h.price_usd > 0
+        """, (ML_LABEL_GROWTH_THRESHOLD, time_window_start, time_window_end))
+        updated = cursor.rowcount
+    elapsed = time.perf_counter() - started
+
+    if updated > 0:
+        logging.info(
+            f"Updated {updated} ML labels in history table "
+            f"in {elapsed:.3f}s ({updated / max(elapsed, 1e-9):,.0f} rows/s)."
+        )
+    return updated
 
 def get_open_position(conn, symbol):
     """指定されたシンボルのオープンポジションを取得する"""
@@ -163,7 +368,7 @@ def get_open_position(conn, symbol):
 
 def log_trade_open(conn, symbol, side, price, amount):
     """ポジションを開いたことをDBに記録する"""
-    timestamp = datetime.now().isoformat()
+    timestamp = now_ms()
     with conn:
         conn.execute(
             "INSERT INTO open_positions (symbol, side, entry_price, amount, opened_at) VALUES (?, ?, ?, ?, ?)",
@@ -177,7 +382,7 @@ def log_trade_open(conn, symbol, side, price, amount):
 
 def log_trade_close(conn, symbol, price, amount):
     """ポジションを閉じたことをDBに記録する"""
-    timestamp = datetime.now().isoformat()
+    timestamp = now_ms()
     with conn:
         position = get_open_position(conn, symbol)
         if not position:
@@ -194,7 +399,7 @@ def log_trade_close(conn, symbol, price, amount):
 
 def log_signal_decision(conn, symbol, signal_type, decision, reason=""):
     """分析シグナルの最終決定をDBに記録する"""
-    timestamp = datetime.now().isoformat()
+    timestamp = now_ms()
     with conn:
         conn.execute(
             "INSERT INTO signal_decisions (timestamp, symbol, signal_type, decision, reason) VALUES (?, ?, ?, ?, ?)",
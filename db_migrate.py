@@ -0,0 +1,163 @@
+# db_migrate.py
+# sentinel_data.db の時刻カラムを TEXT(ISO-8601) から INTEGER epoch ms へ移行するツール
+#
+#   python db_migrate.py                    # DB_FILE をその場で移行 (事前に .bak を作成)
+#   python db_migrate.py --db other.db --no-backup
+#   python db_migrate.py --benchmark 200000 # 移行前後のクエリ時間を比較
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+
+
+def backup_database(path):
+    """オンラインバックアップAPIで <path>.bak を作成する"""
+    backup_path = f"{path}.bak"
+    with sqlite3.connect(path) as src, sqlite3.connect(backup_path) as dst:
+        src.backup(dst)
+    logging.info(f"Backup written to {backup_path}")
+    return backup_path
+
+
+def migrate(path, backup=True):
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if backup:
+        backup_database(path)
+    with sqlite3.connect(path) as conn:
+        before = database.get_schema_version(conn)
+        migrated = database.migrate_to_epoch_ms(conn)
+        database.ensure_schema(conn)
+        after = database.get_schema_version(conn)
+    logging.info(f"Schema version {before} -> {after}. Migrated tables: {migrated or 'none'}")
+    return migrated
+
+
+# ---------------------------
+# benchmark
+# ---------------------------
+def _build_legacy_db(path, rows, tokens=200):
+    """旧スキーマ (TEXT時刻) の検証用DBを作る"""
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+        CREATE TABLE market_data_history (
+            timestamp TEXT, token_address TEXT, price_usd REAL, volume_h24 REAL,
+            price_change_h1 REAL, price_change_h24 REAL, social_mentions INTEGER,
+            future_price_grew INTEGER, PRIMARY KEY (timestamp, token_address)
+        )""")
+        conn.execute("CREATE TABLE notification_history (token_address TEXT PRIMARY KEY, last_notified TEXT NOT NULL)")
+        conn.execute("CREATE INDEX idx_mdh_token_timestamp ON market_data_history (token_address, timestamp)")
+
+        now = datetime.now()
+        cycles = max(1, rows // tokens)
+        batch = []
+        for c in range(cycles):
+            ts = (now - timedelta(minutes=c)).isoformat()
+            for t in range(tokens):
+                batch.append((ts, f"token{t}", random.uniform(0.5, 2.0), random.uniform(1e4, 1e6)))
+            if len(batch) >= 50000:
+                conn.executemany(
+                    "INSERT INTO market_data_history (timestamp, token_address, price_usd, volume_h24) VALUES (?, ?, ?, ?)", batch)
+                batch = []
+        if batch:
+            conn.executemany(
+                "INSERT INTO market_data_history (timestamp, token_address, price_usd, volume_h24) VALUES (?, ?, ?, ?)", batch)
+        conn.executemany(
+            "INSERT INTO notification_history (token_address, last_notified) VALUES (?, ?)",
+            [(f"token{t}", (now - timedelta(hours=random.uniform(0, 12))).isoformat()) for t in range(tokens)]
+        )
+    return tokens
+
+
+def _time(fn, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _legacy_queries(conn, tokens):
+    now = datetime.now()
+    start, end = (now - timedelta(hours=2)).isoformat(), (now - timedelta(hours=1)).isoformat()
+
+    def range_all():
+        conn.execute("SELECT COUNT(*), AVG(price_usd) FROM market_data_history WHERE timestamp BETWEEN ? AND ?",
+                     (start, end)).fetchone()
+
+    def range_token():
+        for t in range(0, tokens, 10):
+            conn.execute("SELECT price_usd FROM market_data_history WHERE token_address = ? AND timestamp BETWEEN ? AND ?",
+                         (f"token{t}", start, end)).fetchall()
+
+    def notified():
+        for t in range(tokens):
+            row = conn.execute("SELECT last_notified FROM notification_history WHERE token_address = ?",
+                               (f"token{t}",)).fetchone()
+            if row and row[0]:
+                (datetime.now() - datetime.fromisoformat(row[0])).total_seconds() < database.NOTIFICATION_COOLDOWN_HOURS * 3600
+
+    return {"range_all_tokens": range_all, "range_per_token": range_token, "recently_notified": notified}
+
+
+def _epoch_queries(conn, tokens):
+    now = database.now_ms()
+    start, end = now - 2 * 3600 * 1000, now - 3600 * 1000
+
+    def range_all():
+        conn.execute("SELECT COUNT(*), AVG(price_usd) FROM market_data_history WHERE timestamp BETWEEN ? AND ?",
+                     (start, end)).fetchone()
+
+    def range_token():
+        for t in range(0, tokens, 10):
+            conn.execute("SELECT price_usd FROM market_data_history WHERE token_address = ? AND timestamp BETWEEN ? AND ?",
+                         (f"token{t}", start, end)).fetchall()
+
+    def notified():
+        for t in range(tokens):
+            database.check_if_recently_notified(conn, f"token{t}")
+
+    return {"range_all_tokens": range_all, "range_per_token": range_token, "recently_notified": notified}
+
+
+def run_benchmark(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        tokens = _build_legacy_db(path, rows)
+
+        with sqlite3.connect(path) as conn:
+            before = {name: _time(fn) for name, fn in _legacy_queries(conn, tokens).items()}
+            started = time.perf_counter()
+            database.migrate_to_epoch_ms(conn)
+            database.ensure_schema(conn)
+            migrate_sec = time.perf_counter() - started
+            after = {name: _time(fn) for name, fn in _epoch_queries(conn, tokens).items()}
+            size_mb = os.path.getsize(path) / 1e6
+
+    print(f"rows={rows:,}  migration={migrate_sec:.2f}s  db={size_mb:.1f}MB")
+    print(f"{'query':<20}{'TEXT (ms)':>12}{'INTEGER (ms)':>14}{'speedup':>10}")
+    for name in before:
+        b, a = before[name] * 1000, after[name] * 1000
+        print(f"{name:<20}{b:>12.2f}{a:>14.2f}{b / max(a, 1e-9):>9.1f}x")
+    return before, after
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Migrate sentinel_data.db timestamps to INTEGER epoch ms.")
+    parser.add_argument("--db", default=database.DB_FILE)
+    parser.add_argument("--no-backup", action="store_true")
+    parser.add_argument("--benchmark", type=int, metavar="ROWS", help="run a before/after query benchmark instead")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+    else:
+        migrate(args.db, backup=not args.no_backup)
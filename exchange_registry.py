@@ -0,0 +1,292 @@
+# exchange_registry.py
+# ccxt クライアントの共有レジストリ
+#  - (アカウント, 市場タイプ) ごとに ccxt クライアントを1つだけ作り、全モジュールで使い回す
+#    (enableRateLimit の待ち合わせもクライアント単位なので、同じ API キーの呼び出しが1か所で調整される)
+#  - マーケット情報 (load_markets) は取引所ごとに1回だけ取得し、全クライアントに set_markets で配る。
+#    取得結果はディスクにスナップショットし、再起動時はそれを読み込んで即座に使える状態にする。
+#    MARKETS_REFRESH_SEC より古くなったらバックグラウンドで1本だけ取り直す
+#  - シンボルごとの数量・価格の刻みと最小値を MarketInfo の表にしておき、注文サイズの丸めは辞書を1回引くだけにする
+#  - EXCHANGE_MODE が paper なら注文・口座のクライアントを exchange_simulator に差し替え (市場データは本物)、
+#    sim なら公開データも含めてすべてシミュレーターにする (ネットワークに出ない)
+#  - MARKET_RECORD_DIR が設定されていれば、本物のクライアントを market_recorder で包んで市場データの応答を記録する
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+MARKETS_SNAPSHOT_DIR = os.getenv("MARKETS_SNAPSHOT_DIR", "market_cache")
+MARKETS_REFRESH_SEC = float(os.getenv("MARKETS_REFRESH_SEC", "21600"))  # 6時間
+MARKETS_RETRY_SEC = 300  # 取得に失敗したときの再試行間隔
+# live: 本物の取引所 / paper: 注文・口座だけシミュレーター / sim: すべてシミュレーター。未指定なら PAPER_TRADING に従う
+EXCHANGE_MODE = os.getenv("EXCHANGE_MODE") or ("paper" if os.getenv("PAPER_TRADING", "1") != "0" else "live")
+
+# アカウント名 -> (API キー, シークレット, パスフレーズ) の環境変数名。None は公開データ用 (キーなし)
+ACCOUNTS = {
+    "futures": ("BITGET_API_KEY_FUTURES", "BITGET_API_SECRET_FUTURES", "BITGET_API_PASSPHRASE_FUTURES"),
+    "spot": ("BITGET_API_KEY_SPOT", "BITGET_API_SECRET_SPOT", "BITGET_API_PASSPHRASE_SPOT"),
+    "notifier": ("BITGET_API_KEY", "BITGET_API_SECRET", "BITGET_API_PASSWORD"),
+    "public": None,
+}
+_DECIMAL_PLACES = 2  # ccxt.DECIMAL_PLACES (それ以外の取引所は TICK_SIZE: precision が刻み幅そのもの)
+
+
+def _step(precision, precision_mode):
+    if precision is None:
+        return None
+    precision = float(precision)
+    return 10 ** -precision if precision_mode == _DECIMAL_PLACES else precision
+
+
+def _decimals(step):
+    return max(0, -math.floor(math.log10(step))) if step else 0
+
+
+class MarketInfo:
+    """1シンボルの数量・価格の刻みと最小値 (注文サイズの計算用に前計算したもの)"""
+
+    __slots__ = ("symbol", "amount_step", "amount_min", "price_step", "min_cost", "contract_size", "_amount_decimals",
+                 "_price_decimals")
+
+    def __init__(self, market, precision_mode):
+        precision = market.get("precision") or {}
+        limits = market.get("limits") or {}
+        self.symbol = market["symbol"]
+        self.amount_min = (limits.get("amount") or {}).get("min")
+        self.min_cost = (limits.get("cost") or {}).get("min")
+        # 数量の刻みが無いときは従来どおり最小数量を刻みとして使う
+        self.amount_step = _step(precision.get("amount"), precision_mode) or self.amount_min
+        self.price_step = _step(precision.get("price"), precision_mode)
+        self.contract_size = market.get("contractSize") or 1
+        self._amount_decimals = _decimals(self.amount_step)
+        self._price_decimals = _decimals(self.price_step)
+
+    def round_amount(self, amount):
+        """数量を刻みに切り捨てる (刻みが不明なら小数6桁)"""
+        if not self.amount_step:
+            return round(amount, 6)
+        return round(math.floor(amount / self.amount_step + 1e-9) * self.amount_step, self._amount_decimals)
+
+    def round_price(self, price):
+        if not self.price_step:
+            return price
+        return round(round(price / self.price_step) * self.price_step, self._price_decimals)
+
+
+def _run_once(lock, target, name):
+    """lock が取れたときだけ target をバックグラウンドで実行する (同時に1本まで)"""
+    if not lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            target()
+        except Exception as e:
+            logging.warning(f"{name} failed: {e}")
+        finally:
+            lock.release()
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return True
+
+
+class MarketMetadata:
+    """1取引所分のマーケット情報。スナップショットから起動し、古ければ裏で取り直して全クライアントに配る"""
+
+    def __init__(self, exchange_id, fetcher, snapshot_dir=MARKETS_SNAPSHOT_DIR, refresh_sec=MARKETS_REFRESH_SEC):
+        self.exchange_id = exchange_id
+        self.fetcher = fetcher  # () -> (markets, currencies, precision_mode)
+        self.path = os.path.join(snapshot_dir, f"{exchange_id}_markets.json") if snapshot_dir else None
+        self.refresh_sec = refresh_sec
+        self.markets = None
+        self.currencies = None
+        self.table = {}
+        self.loaded_at = 0.0
+        self.next_try_at = 0.0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def subscribe(self, client):
+        """client に現在のマーケット情報を入れ、以後の更新も配る"""
+        with self._lock:
+            self._listeners.append(client)
+            markets, currencies = self.markets, self.currencies
+        if markets:
+            client.set_markets(markets, currencies)
+
+    def _install(self, markets, currencies, precision_mode, loaded_at):
+        table = {}
+        for symbol, market in markets.items():
+            try:
+                table[symbol] = MarketInfo(market, precision_mode)
+            except (TypeError, ValueError, KeyError):
+                continue
+        with self._lock:
+            self.markets, self.currencies, self.table, self.loaded_at = markets, currencies, table, loaded_at
+            listeners = list(self._listeners)
+        for client in listeners:
+            client.set_markets(markets, currencies)
+
+    def load_snapshot(self):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                snap = json.load(f)
+            self._install(snap["markets"], snap.get("currencies"), snap.get("precision_mode"), snap["loaded_at"])
+            logging.info(f"Loaded {len(self.table)} {self.exchange_id} markets from snapshot "
+                         f"({(time.time() - self.loaded_at) / 3600:.1f}h old).")
+            return True
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable markets snapshot {self.path}: {e}")
+            return False
+
+    def save_snapshot(self, precision_mode):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"loaded_at": self.loaded_at, "precision_mode": precision_mode,
+                           "markets": self.markets, "currencies": self.currencies}, f, default=str)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Failed to save markets snapshot: {e}")
+
+    def refresh(self):
+        """取引所から取り直して全クライアントに配り、スナップショットを更新する"""
+        self.next_try_at = time.time() + MARKETS_RETRY_SEC
+        started = time.perf_counter()
+        markets, currencies, precision_mode = self.fetcher()
+        self._install(markets, currencies, precision_mode, time.time())
+        self.save_snapshot(precision_mode)
+        logging.info(f"Refreshed {len(self.table)} {self.exchange_id} markets in {time.perf_counter() - started:.1f}s.")
+
+    def ensure_loaded(self):
+        """未読み込みならスナップショット (無ければ同期取得) から読み込み、古ければ裏で更新を始める"""
+        if self.markets is None:
+            if time.time() < self.next_try_at:
+                return  # 直前の取得に失敗した (ccxt の遅延読み込みに任せる)
+            with self._refreshing:
+                if self.markets is None and not self.load_snapshot():
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        logging.error(f"Failed to load {self.exchange_id} markets: {e}")
+                        return
+        if time.time() - self.loaded_at > self.refresh_sec and time.time() >= self.next_try_at:
+            _run_once(self._refreshing, self.refresh, f"{self.exchange_id}-markets")
+
+
+class ExchangeRegistry:
+    """(アカウント, 市場タイプ) ごとの共有 ccxt クライアントを返す。クライアントの生成はスレッドセーフ"""
+
+    def __init__(self, exchange_id="bitget", snapshot_dir=MARKETS_SNAPSHOT_DIR, refresh_sec=MARKETS_REFRESH_SEC,
+                 mode=EXCHANGE_MODE):
+        if mode not in ("live", "paper", "sim"):
+            raise ValueError(f"Unknown EXCHANGE_MODE {mode!r}")
+        self.exchange_id = exchange_id
+        self.mode = mode
+        self._clients = {}
+        self._lock = threading.RLock()
+        # シミュレーターの合成マーケットで本物のスナップショットを上書きしない
+        self.metadata = MarketMetadata(exchange_id, self._fetch_markets, None if mode == "sim" else snapshot_dir,
+                                       refresh_sec)
+
+    def simulated(self, account):
+        """account のクライアントがシミュレーターか"""
+        return self.mode == "sim" or (self.mode == "paper" and account != "public")
+
+    def _simulator(self):
+        from exchange_simulator import LiveFeed, get_simulator
+        if self.mode == "paper":
+            return get_simulator(lambda: LiveFeed(self._client("public", "swap")))
+        return get_simulator()
+
+    def _config(self, account, market_type):
+        config = {"enableRateLimit": True, "options": {"defaultType": market_type}}
+        names = ACCOUNTS.get(account)
+        if names:
+            key, secret, password = (os.getenv(n) for n in names)
+            config.update({"apiKey": key, "secret": secret, "password": password})
+        return config
+
+    def _create(self, account, market_type):
+        if self.simulated(account):
+            logging.info(f"Using the exchange simulator for {account}/{market_type} (EXCHANGE_MODE={self.mode}).")
+            return self._simulator()
+        import ccxt  # 起動時には読み込まない (初回のクライアント生成時)
+        client = getattr(ccxt, self.exchange_id)(self._config(account, market_type))
+        logging.info(f"Initialized ccxt.{self.exchange_id} for {account}/{market_type}.")
+        from market_recorder import RecordingExchange, get_recorder
+        recorder = get_recorder()
+        if recorder is not None:
+            client = RecordingExchange(client, recorder)  # 市場データの応答を MARKET_RECORD_DIR に記録する
+        return client
+
+    def create_async_client(self, account, market_type, **overrides):
+        """
+        ccxt.async_support のクライアントを作る (呼び出したイベントループに結びつくので共有はしない)。
+        マーケット情報は同期クライアントと同じものを配る。
+        """
+        if account not in ACCOUNTS:
+            raise ValueError(f"Unknown exchange account {account!r}")
+        self.metadata.ensure_loaded()
+        if self.simulated(account):
+            from exchange_simulator import AsyncSimulatedExchange
+            client = AsyncSimulatedExchange(self._simulator())
+            self.metadata.subscribe(client)
+            return client
+        import ccxt.async_support as ccxt_async
+        client = getattr(ccxt_async, self.exchange_id)({**self._config(account, market_type), **overrides})
+        self.metadata.subscribe(client)
+        logging.info(f"Initialized async ccxt.{self.exchange_id} for {account}/{market_type}.")
+        return client
+
+    def _client(self, account, market_type):
+        key = (account, market_type)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = self._create(account, market_type)
+                self.metadata.subscribe(client)
+        return client
+
+    def _fetch_markets(self):
+        # マーケット情報は公開 API なのでキーなしのクライアントで取得する
+        client = self._client("public", "swap")
+        markets = client.load_markets(reload=True)
+        return markets, client.currencies, client.precisionMode
+
+    def get(self, account="public", market_type="swap"):
+        """共有クライアントを返す。マーケット情報は読み込み済み (load_markets() はネットワークに出ない)"""
+        if account not in ACCOUNTS:
+            raise ValueError(f"Unknown exchange account {account!r}")
+        client = self._client(account, market_type)
+        self.metadata.ensure_loaded()
+        return client
+
+    def market_info(self, symbol):
+        """シンボルの MarketInfo (無ければ None)。辞書を1回引くだけ"""
+        if self.metadata.markets is None:
+            self.metadata.ensure_loaded()
+        return self.metadata.table.get(symbol)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_exchange_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ExchangeRegistry()
+        return _registry
+
+
+def get_exchange(account="public", market_type="swap"):
+    return get_exchange_registry().get(account, market_type)
@@ -0,0 +1,762 @@
+# exchange_simulator.py
+# Bitget (USDT-M 無期限) 互換のローカル取引所シミュレーター
+#  - ccxt と同じメソッド名・戻り値の形 (fetch_ticker(s) / fetch_ohlcv / fetch_order_book / create_order(s) /
+#    fetch_order / fetch_balance / fetch_positions / set_leverage / load_markets) をプロセス内で実装する
+#  - 価格は差し替え可能なフィード (SyntheticFeed: 乱数で作る決定的な価格 / LiveFeed: 本物の公開 API /
+#    RecordedFeed: market_recorder の記録を等速または早回しで再生) から取る。
+#    フィードは symbols() / now_ms() / ohlcv() / last_price() / order_book() を持つ
+#  - 成行注文は板を上から食って約定し (VWAP)、指値は板に当たる分だけ即約定、残りは価格が届いたら maker で約定する
+#  - 手数料 (taker / maker)、1リクエストごとの遅延、レート制限 (ccxt と同じく待つか、enableRateLimit=False なら
+#    超過を ccxt.RateLimitExceeded にする) を設定できる
+#  - ポジションは銘柄ごとのネット (one-way)。reduceOnly は建玉を超えない。証拠金が足りなければ InsufficientFunds
+#  - exchange_registry が EXCHANGE_MODE=paper/sim のときにこのクライアントを配るので、ペーパートレードも
+#    ライブと同じ注文経路 (order_router) を通る。sim では市場データもすべてここから出るのでオフラインで回る
+import asyncio
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import bars
+
+SIM_FEE_TAKER = float(os.getenv("SIM_FEE_TAKER", "0.0006"))  # Bitget 先物の標準手数料
+SIM_FEE_MAKER = float(os.getenv("SIM_FEE_MAKER", "0.0002"))
+SIM_LATENCY_MS = float(os.getenv("SIM_LATENCY_MS", "0"))  # 片道ではなく1リクエストあたりの往復
+SIM_LATENCY_JITTER_MS = float(os.getenv("SIM_LATENCY_JITTER_MS", "0"))
+SIM_RATE_LIMIT_PER_SEC = float(os.getenv("SIM_RATE_LIMIT_PER_SEC", "20"))  # 公開 API (IP 単位)
+SIM_ORDER_RATE_PER_SEC = float(os.getenv("SIM_ORDER_RATE_PER_SEC", "10"))  # 注文 API (UID 単位)
+SIM_START_BALANCE = float(os.getenv("SIM_START_BALANCE", "10000"))
+SIM_DEFAULT_LEVERAGE = 10
+SIM_SYMBOLS = int(os.getenv("SIM_SYMBOLS", "300"))
+SIM_SEED = int(os.getenv("SIM_SEED", "0"))
+SIM_REPLAY_PATH = os.getenv("SIM_REPLAY_PATH", "")  # market_recorder の記録 (ファイルかディレクトリ) を再生する
+SIM_REPLAY_SPEED = float(os.getenv("SIM_REPLAY_SPEED", "1"))
+SIM_SPREAD_BPS = 2.0       # 合成板の最良気配のスプレッド
+SIM_BOOK_STEP_BPS = 1.0    # 合成板の価格の刻み
+SIM_LEVEL_USD = 5000.0     # 合成板の1段あたりの厚さ (USDT)
+
+_MINUTE_MS = 60_000
+_HOUR_MS = 3_600_000
+_CHUNK_HOURS = 1024
+_MAJORS = ["BTC", "ETH", "SOL", "BNB", "XRP", "ADA", "DOGE", "DOT", "AVAX", "LINK", "LTC", "TRX"]
+
+
+def market_symbol(base):
+    return f"{base}/USDT:USDT"
+
+
+def _decimals(price):
+    """合成マーケットの (価格の小数桁, 数量の小数桁)。価格は有効5桁、数量は1刻みが 5 USDT 以下になる程度"""
+    return 4 - math.floor(math.log10(price)), max(0, -math.floor(math.log10(5 / price)))
+
+
+def _market(base, price, volume_usd):
+    """ccxt の load_markets() と同じ形のマーケット (TICK_SIZE: precision は刻み幅)"""
+    price_dp, amount_dp = _decimals(price)
+    price_step, amount_step = 10.0 ** -price_dp, 10.0 ** -amount_dp
+    symbol = market_symbol(base)
+    return {
+        "id": f"{base}USDT", "symbol": symbol, "base": base, "quote": "USDT", "settle": "USDT",
+        "baseId": base, "quoteId": "USDT", "settleId": "USDT", "type": "swap", "spot": False, "margin": False,
+        "swap": True, "future": False, "option": False, "active": True, "contract": True, "linear": True,
+        "inverse": False, "contractSize": 1, "taker": SIM_FEE_TAKER, "maker": SIM_FEE_MAKER,
+        "precision": {"amount": amount_step, "price": price_step},
+        "limits": {"amount": {"min": amount_step, "max": None}, "price": {"min": price_step, "max": None},
+                   "cost": {"min": 5, "max": None}, "leverage": {"min": 1, "max": 125}},
+        "info": {"symbol": f"{base}USDT", "volumeUsd24h": str(volume_usd)},
+    }
+
+
+class SyntheticFeed:
+    """
+    乱数で作る決定的な価格。同じ seed なら同じ時刻に同じ足を返す。
+    時間足の終値はランダムウォークで作り、1分足はその間をブラウン橋でつなぐ (日ごとの seed で必要な分だけ生成)。
+    now_ms() は起動時刻から speed 倍で進む (オフラインで時間を早回しできる)。
+    """
+
+    def __init__(self, n_symbols=SIM_SYMBOLS, seed=SIM_SEED, history_hours=1500, minute_vol=0.0006, speed=1.0):
+        self.seed = seed
+        self.minute_vol = minute_vol
+        self.speed = speed
+        self._t0_wall = time.time()
+        self._t0 = int(self._t0_wall * 1000)
+        rng = np.random.default_rng(seed)
+        names = _MAJORS[:n_symbols] + [f"SIM{i:03d}" for i in range(max(0, n_symbols - len(_MAJORS)))]
+        self._names = names
+        self._index = {market_symbol(b): i for i, b in enumerate(names)}
+        self._p0 = 10 ** rng.uniform(-3, 4.5, len(names))
+        self._volume = np.sort(10 ** rng.uniform(6, 9.5, len(names)))[::-1]  # 先頭ほど出来高が多い
+        self._vol = minute_vol * 10 ** rng.uniform(-0.3, 0.5, len(names))   # 銘柄ごとの1分あたりのボラティリティ
+        self._dp = [_decimals(p) for p in self._p0]  # 出力は取引所と同じく価格・数量の刻みに丸める
+        self._origin_hour = self._t0 // _HOUR_MS - history_hours
+        self._log_hour = {}   # i -> 時間足の対数終値 (origin_hour から)
+        self._hour_bars = {}  # (i, hour) -> [ts, open, high, low, close, volume]
+        self._day_cache = {}  # i -> (day, 1分足) 最後に作った日
+        self._lock = threading.Lock()
+
+    def now_ms(self):
+        return self._t0 + int((time.time() - self._t0_wall) * 1000 * self.speed)
+
+    def symbols(self):
+        return [market_symbol(b) for b in self._names]
+
+    def markets(self):
+        return {market_symbol(b): _market(b, self._p0[i], self._volume[i]) for i, b in enumerate(self._names)}
+
+    def _i(self, symbol):
+        if symbol not in self._index:
+            import ccxt
+            raise ccxt.BadSymbol(f"bitget does not have market symbol {symbol}")
+        return self._index[symbol]
+
+    def _hour_log_close(self, i, hour):
+        """時間 hour の終わりの対数価格。_CHUNK_HOURS 本ずつ固定の seed で伸ばす (読む順番に依らず同じ値)"""
+        k = max(hour - self._origin_hour, 0)
+        with self._lock:
+            path = self._log_hour.get(i)
+            while path is None or len(path) <= k:
+                chunk = 0 if path is None else len(path) // _CHUNK_HOURS
+                steps = np.random.default_rng((self.seed, i, chunk)).normal(0, self._vol[i] * math.sqrt(60), _CHUNK_HOURS)
+                tail = (math.log(self._p0[i]) if path is None else path[-1]) + np.cumsum(steps)
+                path = self._log_hour[i] = tail if path is None else np.concatenate([path, tail])
+        return path[k]
+
+    def _day_minutes(self, i, day):
+        """UTC の日 day の1440本の1分足 (n, 6)。各時間の始値と終値が時間足と一致するブラウン橋 (日ごとの seed で一括生成)"""
+        cached = self._day_cache.get(i)
+        if cached is not None and cached[0] == day:
+            return cached[1]
+        hours = day * 24 + np.arange(24)
+        logs = np.array([self._hour_log_close(i, h) for h in range(day * 24 - 1, day * 24 + 24)])
+        a, b = logs[:-1, None], logs[1:, None]
+        rng = np.random.default_rng((self.seed, i, day, 1))
+        walk = np.cumsum(rng.normal(0, self._vol[i], (24, 60)), axis=1)
+        closes = np.exp(a + walk - np.arange(1, 61) / 60 * (walk[:, -1:] - (b - a))).ravel()
+        opens = np.r_[math.exp(logs[0]), closes[:-1]]
+        wick = np.abs(rng.normal(0, self._vol[i] / 2, (2, 1440)))
+        rows = np.empty((1440, 6))
+        rows[:, 0] = (hours[:, None] * _HOUR_MS + np.arange(60) * _MINUTE_MS).ravel()
+        rows[:, 1] = opens
+        rows[:, 2] = np.maximum(opens, closes) * (1 + wick[0])
+        rows[:, 3] = np.minimum(opens, closes) * (1 - wick[1])
+        rows[:, 4] = closes
+        rows[:, 5] = self._volume[i] / 1440 / closes * rng.lognormal(0, 0.5, 1440)
+        self._day_cache[i] = (day, rows)
+        return rows
+
+    def _hour_bar(self, i, hour):
+        bar = self._hour_bars.get((i, hour))
+        if bar is None:
+            # 1日分まとめて作って表に入れる
+            day = hour // 24
+            m = self._day_minutes(i, day).reshape(24, 60, 6)
+            hourly = np.column_stack([m[:, 0, 0], m[:, 0, 1], m[:, :, 2].max(axis=1), m[:, :, 3].min(axis=1),
+                                      m[:, -1, 4], m[:, :, 5].sum(axis=1)])
+            for h, row in enumerate(hourly.tolist()):
+                self._hour_bars[(i, day * 24 + h)] = row
+            bar = self._hour_bars[(i, hour)]
+        return bar
+
+    def _rows(self, i, base, start, end):
+        """base ('1m' / '1h') の足を [start, end] の範囲で返す (未来の足は返さない)"""
+        if base == "1h":
+            now = self.now_ms()
+            hours = range(start // _HOUR_MS, end // _HOUR_MS + 1)
+            rows = np.array([self._hour_bar(i, h) for h in hours if (h + 1) * _HOUR_MS <= now]).reshape(-1, 6)
+            if (hours[-1] + 1) * _HOUR_MS > now:
+                # 形成中の時間足は現在の分までの1分足から組み立てる (先の値動きを含めない)
+                rows = np.concatenate([rows, bars.aggregate(self._rows(i, "1m", hours[-1] * _HOUR_MS, now), "1h")])
+            return rows
+        day_ms = 24 * _HOUR_MS
+        rows = np.concatenate([self._day_minutes(i, d) for d in range(start // day_ms, end // day_ms + 1)])
+        return rows[(rows[:, 0] >= start) & (rows[:, 0] <= end)]
+
+    def ohlcv(self, symbol, timeframe="1m", since=None, limit=100):
+        i = self._i(symbol)
+        limit = limit or 100
+        tf = bars.timeframe_ms(timeframe)
+        base = "1h" if tf % _HOUR_MS == 0 else "1m"
+        now = self.now_ms()
+        earliest = (self._origin_hour + 1) * _HOUR_MS
+        start = max(since if since is not None else now - (limit + 1) * tf, earliest)
+        end = now if since is None else min(now, start + limit * tf)
+        rows = self._rows(i, base, start - start % bars.timeframe_ms(base), end - end % bars.timeframe_ms(base))
+        if base != timeframe:
+            rows = bars.aggregate(rows, timeframe)
+        rows = rows[rows[:, 0] >= start - start % tf] if since is not None else rows
+        rows = rows[:limit] if since is not None else rows[-limit:]
+        price_dp, amount_dp = self._dp[i]
+        return [[int(r[0])] + np.round(r[1:5], price_dp).tolist() + [round(float(r[5]), amount_dp)] for r in rows]
+
+    def last_price(self, symbol):
+        now = self.now_ms()
+        rows = self._rows(self._i(symbol), "1m", now - now % _MINUTE_MS, now - now % _MINUTE_MS)
+        return round(float(rows[-1, 4]), self._dp[self._i(symbol)][0])
+
+    def volume_usd(self, symbol):
+        return float(self._volume[self._i(symbol)])
+
+    def order_book(self, symbol, limit=50):
+        """最良気配から SIM_BOOK_STEP_BPS 刻みに並べた合成板。厚さは SIM_LEVEL_USD 前後で、買いと売りの偏りは分ごとに変わる"""
+        i = self._i(symbol)
+        mid = self.last_price(symbol)
+        now = self.now_ms()
+        skew = math.exp(np.random.default_rng((self.seed, i, now // _MINUTE_MS, 2)).normal(0, 0.3))
+        levels = np.arange(limit or 50)
+        half = SIM_SPREAD_BPS / 2e4
+        size = SIM_LEVEL_USD * (1 + 0.1 * levels)
+        bid_px = mid * (1 - half - levels * SIM_BOOK_STEP_BPS / 1e4)
+        ask_px = mid * (1 + half + levels * SIM_BOOK_STEP_BPS / 1e4)
+        price_dp, amount_dp = self._dp[i]
+        return {"symbol": symbol,
+                "bids": np.column_stack([np.round(bid_px, price_dp), np.round(size * skew / bid_px, amount_dp)]).tolist(),
+                "asks": np.column_stack([np.round(ask_px, price_dp), np.round(size / skew / ask_px, amount_dp)]).tolist(),
+                "timestamp": now, "nonce": None}
+
+
+class LiveFeed:
+    """本物の取引所の公開 API から価格と板を取る (ペーパートレード用)。client は ccxt の同期クライアント"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def now_ms(self):
+        return int(time.time() * 1000)
+
+    def symbols(self):
+        return [s for s, m in self.markets().items() if m.get("swap") and m.get("quote") == "USDT"]
+
+    def markets(self):
+        return self.client.load_markets()
+
+    def ohlcv(self, symbol, timeframe="1m", since=None, limit=100):
+        return self.client.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit)
+
+    def ticker(self, symbol):
+        return self.client.fetch_ticker(symbol)
+
+    def last_price(self, symbol):
+        return float(self.ticker(symbol)["last"])
+
+    def volume_usd(self, symbol):
+        info = (self.markets().get(symbol) or {}).get("info") or {}
+        return float(info.get("volumeUsd24h") or 0)
+
+    def order_book(self, symbol, limit=50):
+        return self.client.fetch_order_book(symbol, limit=limit)
+
+
+class RecordedFeed:
+    """
+    market_recorder の記録を再生する。now_ms() は記録の開始時刻から speed 倍で進み、
+    各応答はその時刻までに最後に観測された値を返す (足は同じ時刻の足を最後の観測で上書きしてつなぐ)
+    """
+
+    def __init__(self, log, speed=1.0, start_ms=None):
+        self.log = log
+        self.speed = speed
+        self._start = start_ms or log.start_ms or int(time.time() * 1000)
+        self._wall0 = time.time()
+
+    def now_ms(self):
+        return self._start + int((time.time() - self._wall0) * 1000 * self.speed)
+
+    def finished(self):
+        return self.log.end_ms is None or self.now_ms() > self.log.end_ms
+
+    def symbols(self):
+        return self.log.symbols()
+
+    def markets(self):
+        if self.log.markets:
+            return self.log.markets
+        return {s: _market(s.split("/")[0], self.last_price(s), self.volume_usd(s)) for s in self.symbols()}
+
+    def _latest(self, index, key):
+        """key の観測のうち現在時刻以前で最後のもの (記録開始前なら最初のもの)"""
+        entry = index.get(key)
+        if not entry:
+            return None
+        times, values = entry
+        return values[max(int(np.searchsorted(times, self.now_ms(), side="right")) - 1, 0)]
+
+    def _bars(self, symbol, timeframe):
+        entry = self.log.bars.get((symbol, timeframe))
+        if entry is None:
+            return None
+        observed, rows = entry
+        visible = observed <= max(self.now_ms(), observed[0])
+        rows, observed = rows[visible], observed[visible]
+        order = np.lexsort((observed, rows[:, 0]))
+        rows = rows[order]
+        return rows[np.r_[rows[1:, 0] != rows[:-1, 0], True]]
+
+    def ohlcv(self, symbol, timeframe="1m", since=None, limit=100):
+        rows = self._bars(symbol, timeframe)
+        if rows is None:
+            # 記録された足のうち割り切れる最も粗いものから組み立てる
+            tf = bars.timeframe_ms(timeframe)
+            bases = [t for s, t in self.log.bars if s == symbol and tf % bars.timeframe_ms(t) == 0]
+            if not bases:
+                import ccxt
+                raise ccxt.BadSymbol(f"no recorded {timeframe} bars for {symbol}")
+            rows = bars.aggregate(self._bars(symbol, max(bases, key=bars.timeframe_ms)), timeframe)
+        if since is not None:
+            rows = rows[rows[:, 0] >= since][:limit or 100]
+        else:
+            rows = rows[-(limit or 100):]
+        return [[int(r[0])] + r[1:].tolist() for r in rows]
+
+    def ticker(self, symbol):
+        ticker = self._latest(self.log.tickers, symbol)
+        if ticker is None:
+            last = self.last_price(symbol)
+            return {"symbol": symbol, "timestamp": self.now_ms(), "last": last, "close": last}
+        return {**ticker, "close": ticker.get("last")}
+
+    def last_price(self, symbol):
+        ticker = self._latest(self.log.tickers, symbol)
+        if ticker and ticker.get("last") is not None:
+            return ticker["last"]
+        return self.ohlcv(symbol, "1m", limit=1)[-1][4]
+
+    def volume_usd(self, symbol):
+        info = ((self.log.markets or {}).get(symbol) or {}).get("info") or {}
+        if info.get("volumeUsd24h"):
+            return float(info["volumeUsd24h"])
+        ticker = self._latest(self.log.tickers, symbol) or {}
+        return float(ticker.get("quoteVolume") or 0)
+
+    def order_book(self, symbol, limit=50):
+        book = self._latest(self.log.books, symbol)
+        if book is None:
+            import ccxt
+            raise ccxt.BadSymbol(f"no recorded order book for {symbol}")
+        bids, asks, ts = book
+        return {"symbol": symbol, "bids": bids[:limit].tolist(), "asks": asks[:limit].tolist(),
+                "timestamp": ts, "nonce": None}
+
+
+def default_feed():
+    """SIM_REPLAY_PATH があれば記録の再生 (SIM_REPLAY_SPEED 倍速)、無ければ合成データ"""
+    if SIM_REPLAY_PATH:
+        from market_recorder import MarketLog
+        log = MarketLog.load(SIM_REPLAY_PATH)
+        logging.info(f"Replaying {log.calls} recorded responses from {SIM_REPLAY_PATH} at {SIM_REPLAY_SPEED:g}x.")
+        return RecordedFeed(log, speed=SIM_REPLAY_SPEED)
+    return SyntheticFeed()
+
+
+class _TokenBucket:
+    """1秒あたり rate 回。先に予約して、足りない分は待ち時間 (秒) として返す"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def cancel(self):
+        self.tokens += 1
+
+
+# API メソッド名 -> レート制限の種類
+API_METHODS = {
+    "fetch_markets": "public", "fetch_ticker": "public", "fetch_tickers": "public", "fetch_ohlcv": "public",
+    "fetch_order_book": "public", "fetch_balance": "private", "fetch_positions": "private",
+    "fetch_order": "private", "fetch_open_orders": "private", "set_leverage": "private",
+    "create_order": "order", "create_orders": "order", "cancel_order": "order",
+}
+
+
+class SimulatedExchange:
+    """ccxt の同期クライアントとして振る舞うシミュレーター。スレッドセーフ"""
+
+    id = "bitget"
+    precisionMode = 4  # ccxt.TICK_SIZE
+    rateLimit = 50
+
+    def __init__(self, feed, balance=SIM_START_BALANCE, fee_taker=SIM_FEE_TAKER, fee_maker=SIM_FEE_MAKER,
+                 latency_ms=SIM_LATENCY_MS, jitter_ms=SIM_LATENCY_JITTER_MS, rate_limit=SIM_RATE_LIMIT_PER_SEC,
+                 order_rate=SIM_ORDER_RATE_PER_SEC):
+        self.feed = feed
+        self.fee_taker = fee_taker
+        self.fee_maker = fee_maker
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # True なら ccxt の enableRateLimit と同じく呼び出し側で待つ。False なら超過した呼び出しは 429 で失敗する
+        self.enableRateLimit = True
+        self.has = {"createOrders": True, "fetchPositions": True, "setLeverage": True, "fetchTickers": True}
+        self.options = {"defaultType": "swap"}
+        self.markets = None
+        self.currencies = {"USDT": {"id": "USDT", "code": "USDT", "precision": 1e-8}}
+        self.wallet = float(balance)  # 実現損益と手数料を反映した残高
+        self.positions = {}  # symbol -> {"contracts": 符号付き数量, "entry": 平均建値}
+        self.leverage = {}
+        self.orders = {}     # id -> order
+        self._by_client_id = {}
+        self._open = []      # 約定待ちの指値注文の id
+        self._ids = itertools.count(1)
+        self._buckets = {"public": _TokenBucket(rate_limit), "private": _TokenBucket(rate_limit),
+                         "order": _TokenBucket(order_rate)}
+        self._lock = threading.RLock()
+        self.stats = {"calls": 0, "rate_limited": 0, "throttled_sec": 0.0, "orders": 0, "fills": 0, "fees": 0.0}
+
+    # --- ccxt 互換の共通部分 ---
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+        if currencies:
+            self.currencies = currencies
+
+    def load_markets(self, reload=False, params=None):
+        if self.markets is None or reload:
+            self.markets = self.feed.markets()
+        return self.markets
+
+    def market(self, symbol):
+        markets = self.load_markets()
+        if symbol not in markets:
+            import ccxt
+            raise ccxt.BadSymbol(f"bitget does not have market symbol {symbol}")
+        return markets[symbol]
+
+    def milliseconds(self):
+        return self.feed.now_ms()
+
+    def close(self):
+        pass
+
+    def _wait(self, name, kind):
+        """この呼び出しの前に待つ秒数 (レート制限の待ち + 遅延)。enableRateLimit が無効で超過したら 429"""
+        import ccxt
+        with self._lock:
+            throttle = self._buckets[kind].reserve()
+            if throttle and not self.enableRateLimit:
+                self._buckets[kind].cancel()
+                self.stats["rate_limited"] += 1
+                raise ccxt.RateLimitExceeded(f"bitget {name}: 429 Too Many Requests (simulated)")
+            self.stats["throttled_sec"] += throttle
+        latency = 0.0
+        if self.latency_ms or self.jitter_ms:
+            latency = max(0.0, self.latency_ms + np.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        return throttle + latency
+
+    def _invoke(self, name, *args, **kwargs):
+        """本体 (_api_<name>) を呼ぶ。待ち時間は呼び出し側 (同期 / 非同期) が先に入れる"""
+        with self._lock:
+            self.stats["calls"] += 1
+            self._match_resting()
+            return getattr(self, f"_api_{name}")(*args, **kwargs)
+
+    # --- 市場データ ---
+    def _api_fetch_markets(self, params=None):
+        return list(self.load_markets().values())
+
+    def _api_fetch_ticker(self, symbol, params=None):
+        self.market(symbol)
+        if hasattr(self.feed, "ticker"):
+            return self.feed.ticker(symbol)
+        last = self.feed.last_price(symbol)
+        book = self.feed.order_book(symbol, 1)
+        now = self.feed.now_ms()
+        day = self.feed.ohlcv(symbol, "1h", now - 24 * _HOUR_MS, 25)
+        base_volume = sum(r[5] for r in day)
+        return {
+            "symbol": symbol, "timestamp": now, "datetime": None, "last": last, "close": last,
+            "bid": book["bids"][0][0] if book["bids"] else None, "ask": book["asks"][0][0] if book["asks"] else None,
+            "open": day[0][1] if day else None, "high": max((r[2] for r in day), default=None),
+            "low": min((r[3] for r in day), default=None), "baseVolume": base_volume,
+            "quoteVolume": self.feed.volume_usd(symbol), "percentage": (last / day[0][1] - 1) * 100 if day else None,
+            "info": {},
+        }
+
+    def _api_fetch_tickers(self, symbols=None, params=None):
+        return {s: self._api_fetch_ticker(s) for s in (symbols or self.feed.symbols())}
+
+    def _api_fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params=None):
+        self.market(symbol)
+        return self.feed.ohlcv(symbol, timeframe, since, limit or 100)
+
+    def _api_fetch_order_book(self, symbol, limit=None, params=None):
+        self.market(symbol)
+        return self.feed.order_book(symbol, limit or 50)
+
+    # --- 口座 ---
+    def _unrealized(self, symbol, pos):
+        return (self.feed.last_price(symbol) - pos["entry"]) * pos["contracts"]
+
+    def _used_margin(self):
+        return sum(abs(p["contracts"]) * p["entry"] / self.leverage.get(s, SIM_DEFAULT_LEVERAGE)
+                   for s, p in self.positions.items())
+
+    def _api_fetch_balance(self, params=None):
+        upnl = sum(self._unrealized(s, p) for s, p in self.positions.items())
+        used = self._used_margin()
+        total = self.wallet + upnl
+        usdt = {"free": total - used, "used": used, "total": total}
+        return {"USDT": usdt, "free": {"USDT": usdt["free"]}, "used": {"USDT": used}, "total": {"USDT": total},
+                "info": {"simulated": True}}
+
+    def _api_fetch_positions(self, symbols=None, params=None):
+        rows = []
+        for symbol, pos in self.positions.items():
+            if symbols and symbol not in symbols:
+                continue
+            mark = self.feed.last_price(symbol)
+            contracts = abs(pos["contracts"])
+            leverage = self.leverage.get(symbol, SIM_DEFAULT_LEVERAGE)
+            rows.append({
+                "symbol": symbol, "side": "long" if pos["contracts"] > 0 else "short", "contracts": contracts,
+                "contractSize": 1, "entryPrice": pos["entry"], "markPrice": mark, "notional": contracts * mark,
+                "leverage": leverage, "unrealizedPnl": (mark - pos["entry"]) * pos["contracts"],
+                "initialMargin": contracts * pos["entry"] / leverage, "marginMode": "cross",
+                "timestamp": self.feed.now_ms(), "info": {"simulated": True},
+            })
+        return rows
+
+    def _api_set_leverage(self, leverage, symbol=None, params=None):
+        self.market(symbol)
+        self.leverage[symbol] = float(leverage)
+        return {"symbol": symbol, "leverage": float(leverage)}
+
+    # --- 注文 ---
+    def _api_create_order(self, symbol, type, side, amount, price=None, params=None):
+        import ccxt
+        params = params or {}
+        self.market(symbol)
+        client_id = params.get("clientOrderId")
+        if client_id and client_id in self._by_client_id:
+            raise ccxt.DuplicateOrderId(f"bitget clientOid {client_id} duplicate")
+        amount = float(amount)
+        if amount <= 0:
+            raise ccxt.InvalidOrder(f"bitget amount must be positive, got {amount}")
+        reduce_only = bool(params.get("reduceOnly"))
+        sign = 1 if side == "buy" else -1
+        pos = self.positions.get(symbol)
+        if reduce_only:
+            held = pos["contracts"] if pos else 0.0
+            if held * sign >= 0:
+                raise ccxt.InvalidOrder(f"bitget reduceOnly order for {symbol} has no position to reduce")
+            amount = min(amount, abs(held))
+        else:
+            ref = price or self.feed.last_price(symbol)
+            required = amount * ref / self.leverage.get(symbol, SIM_DEFAULT_LEVERAGE) + amount * ref * self.fee_taker
+            free = self._api_fetch_balance()["USDT"]["free"]
+            if required > free:
+                raise ccxt.InsufficientFunds(f"bitget insufficient balance: need {required:.2f} USDT, free {free:.2f}")
+
+        now = self.feed.now_ms()
+        order = {
+            "id": str(next(self._ids)), "clientOrderId": client_id, "timestamp": now, "datetime": None,
+            "lastTradeTimestamp": None, "symbol": symbol, "type": type, "side": side, "price": price,
+            "amount": amount, "filled": 0.0, "remaining": amount, "cost": 0.0, "average": None, "status": "open",
+            "fee": {"cost": 0.0, "currency": "USDT"}, "reduceOnly": reduce_only, "trades": [], "info": {"simulated": True},
+        }
+        self.orders[order["id"]] = order
+        if client_id:
+            self._by_client_id[client_id] = order["id"]
+        self.stats["orders"] += 1
+
+        limit = price if type == "limit" else None
+        self._take(order, limit)
+        if order["remaining"] > 1e-12:
+            if type == "limit":
+                self._open.append(order["id"])
+            else:
+                order["status"] = "closed"  # 板が尽きた成行は残りを捨てる (部分約定)
+        return dict(order)
+
+    def _api_create_orders(self, orders, params=None):
+        results = []
+        for o in orders:
+            try:
+                results.append(self._api_create_order(o["symbol"], o.get("type", "market"), o["side"], o["amount"],
+                                                      o.get("price"), o.get("params")))
+            except Exception as e:
+                # Bitget の一括注文と同じく、弾かれた注文は id の無いエントリーとして返す
+                results.append({"id": None, "clientOrderId": (o.get("params") or {}).get("clientOrderId"),
+                                "status": "rejected", "info": {"error": str(e)}})
+        return results
+
+    def _api_fetch_order(self, id, symbol=None, params=None):
+        import ccxt
+        client_id = (params or {}).get("clientOrderId")
+        order_id = self._by_client_id.get(client_id) if client_id else id
+        if order_id not in self.orders:
+            raise ccxt.OrderNotFound(f"bitget order {id or client_id} not found")
+        return dict(self.orders[order_id])
+
+    def _api_fetch_open_orders(self, symbol=None, since=None, limit=None, params=None):
+        return [dict(self.orders[i]) for i in self._open if not symbol or self.orders[i]["symbol"] == symbol]
+
+    def _api_cancel_order(self, id, symbol=None, params=None):
+        import ccxt
+        if id not in self._open:
+            raise ccxt.OrderNotFound(f"bitget order {id} is not open")
+        self._open.remove(id)
+        self.orders[id]["status"] = "canceled"
+        return dict(self.orders[id])
+
+    # --- 約定 ---
+    def _take(self, order, limit_price=None):
+        """板を最良気配から食って約定させる (limit_price を超える段は食わない)"""
+        book = self.feed.order_book(order["symbol"], 50)
+        levels = book["asks"] if order["side"] == "buy" else book["bids"]
+        for price, size in levels:
+            if order["remaining"] <= 1e-12:
+                break
+            if limit_price is not None and (price > limit_price if order["side"] == "buy" else price < limit_price):
+                break
+            self._fill(order, price, min(size, order["remaining"]), self.fee_taker)
+
+    def _match_resting(self):
+        """約定待ちの指値を最新価格で約定させる (価格が届いたら指値で全量、maker 手数料)"""
+        for order_id in list(self._open):
+            order = self.orders[order_id]
+            last = self.feed.last_price(order["symbol"])
+            if (last <= order["price"]) if order["side"] == "buy" else (last >= order["price"]):
+                self._fill(order, order["price"], order["remaining"], self.fee_maker)
+                self._open.remove(order_id)
+
+    def _fill(self, order, price, qty, fee_rate):
+        symbol = order["symbol"]
+        if order["reduceOnly"]:
+            held = (self.positions.get(symbol) or {}).get("contracts", 0.0)
+            qty = min(qty, abs(held))
+            if qty <= 0:
+                order["remaining"] = 0.0
+                order["status"] = "closed"
+                return
+        fee = qty * price * fee_rate
+        order["filled"] += qty
+        order["remaining"] = max(0.0, order["amount"] - order["filled"])
+        order["cost"] += qty * price
+        order["average"] = order["cost"] / order["filled"]
+        order["fee"]["cost"] += fee
+        order["lastTradeTimestamp"] = self.feed.now_ms()
+        order["trades"].append({"price": price, "amount": qty, "fee": {"cost": fee, "currency": "USDT"}})
+        if order["remaining"] <= 1e-12:
+            order["status"] = "closed"
+        self.wallet -= fee
+        self.stats["fills"] += 1
+        self.stats["fees"] += fee
+        self._apply(symbol, qty if order["side"] == "buy" else -qty, price)
+
+    def _apply(self, symbol, delta, price):
+        """ネットポジションに約定を反映し、減った分の損益を残高に入れる"""
+        pos = self.positions.get(symbol)
+        held = pos["contracts"] if pos else 0.0
+        if held == 0 or held * delta > 0:
+            new = held + delta
+            entry = (held * (pos["entry"] if pos else 0) + delta * price) / new
+            self.positions[symbol] = {"contracts": new, "entry": entry}
+            return
+        closed = min(abs(delta), abs(held))
+        self.wallet += (price - pos["entry"]) * closed * (1 if held > 0 else -1)
+        new = held + delta
+        if abs(new) <= 1e-12:
+            del self.positions[symbol]
+        elif new * held > 0:
+            pos["contracts"] = new
+        else:
+            self.positions[symbol] = {"contracts": new, "entry": price}  # ドテン: 残りは約定価格で建て直し
+
+    # --- 便利メソッド ---
+    def restore_positions(self, positions):
+        """
+        建玉を外から戻す (口座はメモリにしか無いので、再起動後に呼び出し側の記録から復元する)。
+        positions は {symbol: (符号付き数量, 建値, レバレッジ)}。既に建玉のある銘柄は触らない。戻り値: 戻した銘柄
+        """
+        restored = []
+        with self._lock:
+            for symbol, (contracts, entry, leverage) in positions.items():
+                if symbol in self.positions or not contracts:
+                    continue
+                self.positions[symbol] = {"contracts": float(contracts), "entry": float(entry)}
+                if leverage:
+                    self.leverage[symbol] = float(leverage)
+                restored.append(symbol)
+        return restored
+
+    def summary(self):
+        balance = self._api_fetch_balance()["USDT"]
+        return {"wallet": self.wallet, "equity": balance["total"], "positions": len(self.positions),
+                "open_orders": len(self._open), **self.stats}
+
+
+def _sync_method(name, kind):
+    def method(self, *args, **kwargs):
+        delay = self._wait(name, kind)
+        if delay:
+            time.sleep(delay)
+        return self._invoke(name, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name, _kind in API_METHODS.items():
+    setattr(SimulatedExchange, _name, _sync_method(_name, _kind))
+
+
+class AsyncSimulatedExchange:
+    """同じシミュレーターを ccxt.async_support のクライアントとして見せる (遅延は asyncio.sleep で待つ)"""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.id = sim.id
+        self.has = sim.has
+        self.options = dict(sim.options)
+        self.precisionMode = sim.precisionMode
+
+    @property
+    def markets(self):
+        return self.sim.markets
+
+    def set_markets(self, markets, currencies=None):
+        self.sim.set_markets(markets, currencies)
+
+    async def load_markets(self, reload=False, params=None):
+        return self.sim.load_markets(reload)
+
+    async def close(self):
+        pass
+
+
+def _async_method(name, kind):
+    async def method(self, *args, **kwargs):
+        delay = self.sim._wait(name, kind)
+        if delay:
+            await asyncio.sleep(delay)
+        return self.sim._invoke(name, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name, _kind in API_METHODS.items():
+    setattr(AsyncSimulatedExchange, _name, _async_method(_name, _kind))
+
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+
+def get_simulator(feed_factory=None):
+    """プロセスで共有するシミュレーター。初回だけ feed_factory() でフィードを作る (既定は default_feed)"""
+    global _simulator
+    with _simulator_lock:
+        if _simulator is None:
+            feed = (feed_factory or default_feed)()
+            _simulator = SimulatedExchange(feed)
+            logging.info(f"Exchange simulator started ({type(feed).__name__}, balance {_simulator.wallet:.0f} USDT).")
+        return _simulator
@@ -1,7 +1,8 @@
 import pandas as pd
-import pandas_ta as ta
 import logging
 
+from utils import load_pandas_ta
+
 def calculate_technical_indicators(ohlcv_data_h1, ohlcv_data_d1):
     """
     1時間足と日足のデータからテクニカル指標を計算する
@@ -11,6 +12,7 @@ def calculate_technical_indicators(ohlcv_data_h1, ohlcv_data_d1):
         return indicators
 
     try:
+        ta = load_pandas_ta()
         # --- 1時間足の分析 (短期的な勢い) ---
         df_h1 = pd.DataFrame(ohlcv_data_h1)
         df_h1['timestamp'] = pd.to_datetime(df_h1['timestamp'], unit='s')
@@ -0,0 +1,219 @@
+# http_client.py
+# 外部 API 用の共有非同期 HTTP クライアント
+#  - 1つの aiohttp.ClientSession (keep-alive の接続プール) を1回のスキャン全体で使い回す
+#  - ホスト (またはパスの接頭辞) ごとに同時接続数のセマフォとトークンバケットで流量を制限する
+#  - 429/503 を受けたら Retry-After (無ければ指数バックオフ) だけ待ち、そのホストのレートを半分に下げる。
+#    成功が続くと設定値まで少しずつ戻す (AIMD)
+#  - トークンバケット (レートと 429 後の減速) はプロセスでホストごとに1つ持ち、クライアントをまたいで引き継ぐ
+#    (スキャンごとにクライアントを作り直しても、直前に絞られたホストへ全速で戻らない)
+#  - cache (response_cache.ResponseCache) を渡すと、鮮度内はネットワークに出ず、切れたら条件付き GET で再検証する
+import asyncio
+import email.utils
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from response_cache import cache_key
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_KEEPALIVE_SEC = float(os.getenv("HTTP_KEEPALIVE_SEC", "30"))
+HTTP_TIMEOUT_SEC = float(os.getenv("HTTP_TIMEOUT_SEC", "20"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+HTTP_BACKOFF_BASE_SEC = 1.0
+HTTP_BACKOFF_MAX_SEC = 60.0
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# (接頭辞) -> (毎秒リクエスト数, バースト, 同時接続数)。最も長く一致した接頭辞を使う
+HOST_LIMITS = {
+    "api.dexscreener.com/latest/dex/pairs": (5.0, 5, 5),       # 300 req/min
+    "api.dexscreener.com/latest/dex/search": (5.0, 5, 5),
+    "api.dexscreener.com": (1.0, 2, 2),                        # その他のエンドポイントは 60 req/min
+    "deep-index.moralis.io": (20.0, 20, 10),
+    "api.coingecko.com": (0.5, 10, 10),                        # 無料枠は約30 req/min
+}
+DEFAULT_LIMIT = (10.0, 10, 10)
+
+
+class TokenBucket:
+    """
+    非同期のトークンバケット。penalize() でレートを下げ、成功ごとに設定値へ戻していく。
+    状態はスレッドロックで守り、待つのは呼び出し側のイベントループで行うので、ループやクライアントをまたいで共有できる
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """トークンを1つ取れたら 0、取れなければ次に試すまでの秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def penalize(self, wait_sec):
+        """429 を受けたとき: wait_sec の間は全リクエストを止め、レートを半分にする"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + wait_sec)
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.tokens = 0.0
+
+    def reward(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+_buckets = {}  # (接頭辞, 毎秒リクエスト数, バースト) -> TokenBucket (プロセスで共有)
+_buckets_lock = threading.Lock()
+
+
+def shared_bucket(key, rate, burst):
+    """ホスト (接頭辞) ごとのトークンバケット。同じ設定のクライアントはすべて同じものを使う"""
+    with _buckets_lock:
+        bucket = _buckets.get((key, rate, burst))
+        if bucket is None:
+            bucket = _buckets[(key, rate, burst)] = TokenBucket(rate, burst)
+        return bucket
+
+
+class HostLimiter:
+    def __init__(self, key, rate, burst, concurrency):
+        self.bucket = shared_bucket(key, rate, burst)
+        self.semaphore = asyncio.Semaphore(concurrency)  # イベントループに結び付くのでクライアントごと
+
+
+def _retry_after(headers, attempt):
+    """Retry-After (秒数または HTTP-date)。無ければ指数バックオフ + ジッター"""
+    value = headers.get("Retry-After") if headers else None
+    if value:
+        try:
+            return min(HTTP_BACKOFF_MAX_SEC, max(0.0, float(value)))
+        except ValueError:
+            try:
+                return min(HTTP_BACKOFF_MAX_SEC, max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return min(HTTP_BACKOFF_MAX_SEC, HTTP_BACKOFF_BASE_SEC * 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def chunked(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class AsyncHttpClient:
+    """ホスト別に流量を制限し、429 で自動的に減速・再試行する JSON クライアント"""
+
+    def __init__(self, limits=None, proxy=None, cache=None):
+        self.limits = HOST_LIMITS if limits is None else limits
+        self.proxy = proxy or None
+        self.cache = cache
+        self._limiters = {}
+        self._session = None
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0}
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS, keepalive_timeout=HTTP_KEEPALIVE_SEC, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SEC))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def limiter(self, url):
+        parts = urlsplit(url)
+        target = f"{parts.netloc}{parts.path}"
+        key = max((p for p in self.limits if target.startswith(p)), key=len, default=parts.netloc)
+        if key not in self._limiters:
+            self._limiters[key] = HostLimiter(key, *self.limits.get(key, DEFAULT_LIMIT))
+        return self._limiters[key]
+
+    async def get_json(self, url, params=None, headers=None, timeout=None):
+        """GET して JSON を返す。429/5xx はそのホストを減速して再試行し、それ以外のエラーは例外にする"""
+        entry = None
+        if self.cache is not None:
+            full_url, key = cache_key(url, params)
+            entry = self.cache.get(key)
+            if entry is not None and entry.fresh():
+                self.cache.record("fresh", entry.size)
+                return json.loads(entry.body)
+            if entry is not None:
+                headers = {**(headers or {}), **entry.conditional_headers()}
+
+        limiter = self.limiter(url)
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            async with limiter.semaphore:
+                await limiter.bucket.acquire()
+                self.stats["requests"] += 1
+                try:
+                    async with self.session.get(url, params=params, headers=headers, proxy=self.proxy,
+                                                timeout=request_timeout) as response:
+                        if response.status == 304 and entry is not None:
+                            limiter.bucket.reward()
+                            self.cache.record("revalidated", entry.size)
+                            return json.loads(self.cache.refresh(entry, full_url, response.headers).body)
+                        if response.status not in RETRY_STATUSES:
+                            response.raise_for_status()
+                            body = await response.read()
+                            limiter.bucket.reward()
+                            if self.cache is not None:
+                                self.cache.record("miss", len(body))
+                                if response.status == 200:
+                                    self.cache.put(key, full_url, response.headers, body)
+                            return json.loads(body) if body else None
+                        wait = _retry_after(response.headers, attempt)
+                        if response.status == 429:
+                            self.stats["throttled"] += 1
+                            limiter.bucket.penalize(wait)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt == HTTP_MAX_RETRIES:
+                        self.stats["errors"] += 1
+                        raise
+                    wait = _retry_after(None, attempt)
+                    logging.debug(f"HTTP GET {url} failed ({e}), retrying in {wait:.1f}s.")
+                except aiohttp.ClientResponseError:
+                    self.stats["errors"] += 1
+                    raise
+            if attempt == HTTP_MAX_RETRIES:
+                break
+            self.stats["retries"] += 1
+            logging.info(f"HTTP GET {urlsplit(url).netloc} throttled/unavailable, retry {attempt + 1} in {wait:.1f}s.")
+            await asyncio.sleep(wait)
+        self.stats["errors"] += 1
+        raise aiohttp.ClientError(f"GET {url} still throttled after {HTTP_MAX_RETRIES} retries")
+
@@ -6,7 +6,6 @@ import math
 import threading
 import schedule
 import requests
-import ccxt
 
 # ===============================
 #  StateManager クラス  ← ここに追加
@@ -44,25 +43,7 @@ class StateManager:
 # ===============================
 #  Bitget 初期化
 # ===============================
-# --- Bitget SPOT ---
-bitget_spot = ccxt.bitget({
-    "apiKey": os.getenv("BITGET_API_KEY_SPOT"),
-    "secret": os.getenv("BITGET_API_SECRET_SPOT"),
-    "password": os.getenv("BITGET_API_PASSPHRASE_SPOT"),
-    "enableRateLimit": True,
-    "options": {"defaultType": "spot"}
-})
-logging.info("Initialized ccxt.bitget for spot.")
-
-# --- Bitget FUTURES ---
-bitget_futures = ccxt.bitget({
-    "apiKey": os.getenv("BITGET_API_KEY_FUTURES"),
-    "secret": os.getenv("BITGET_API_SECRET_FUTURES"),
-    "password": os.getenv("BITGET_API_PASSPHRASE_FUTURES"),
-    "enableRateLimit": True,
-    "options": {"defaultType": "swap"}  # ← 永続先物
-})
-logging.info("Initialized ccxt.bitget for futures.")
+# ccxt クライアントは起動時に作らず、exchange_registry が初回使用時に (アカウント, 市場タイプ) ごとに1つ作る
 
 
 # StateManager インスタンスを作成
@@ -72,14 +53,18 @@ state = StateManager()
 from datetime import datetime, timezone, timedelta
 from typing import Dict, Any, List, Tuple
 
-import ccxt
 import numpy as np
-import pandas as pd
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 
 from state_manager import StateManager
+from bars import BarCache
+from account_state import get_account_cache, get_fx_cache
+from exchange_registry import EXCHANGE_MODE, get_exchange
+import market_recorder
+from profiler import get_profiler, profile_cycles
 from trading_executor import TradingExecutor
+import retention
 
 load_dotenv()
 
@@ -108,18 +93,10 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 state = StateManager()
 executor = TradingExecutor(state)
 
-# ccxt client for market data (no API keys needed for public data)
-import ccxt
-import os
-
-ccxt_client = ccxt.bitget({
-    "apiKey": os.getenv("BITGET_API_KEY_FUTURES"),
-    "secret": os.getenv("BITGET_API_SECRET_FUTURES"),
-    "password": os.getenv("BITGET_API_PASSPHRASE_FUTURES"),  # Bitgetはpassphrase必須
-    "options": {
-        "defaultType": "swap"  # ← USDT-M 先物
-    }
-})
+# ccxt client for market data: the shared futures (USDT-M swap) client from exchange_registry,
+# created on first use so that importing main (gunicorn boot, /health) does not load ccxt
+def get_ccxt_client():
+    return get_exchange("futures", "swap")
 
 app = Flask(__name__)
 
@@ -140,6 +117,8 @@ def send_telegram_html(text: str):
 
 # fetch Fear & Greed
 def fetch_fear_and_greed() -> Dict[str, Any]:
+    if EXCHANGE_MODE == "sim":  # シミュレーターではネットワークに出ない (取得失敗時と同じ値)
+        return {"value": "N/A", "value_classification": "Unknown"}
     try:
         r = requests.get(FEAR_GREED_URL, timeout=8).json()
         return r.get("data", [{}])[0]
@@ -149,7 +128,7 @@ def fetch_fear_and_greed() -> Dict[str, Any]:
 # get top volume symbols from Bitget futures markets
 def fetch_top_symbols(limit: int = MONITORED_TOP_N) -> List[str]:
     try:
-        markets = ccxt_client.fetch_markets()
+        markets = get_ccxt_client().fetch_markets()
         # filter USDT perpetual / swap markets
         swaps = [m for m in markets if m.get("quote") == "USDT" and (m.get("type") in (None, "swap", "future") or "USDT" in (m.get("symbol","")))]
         # get by quoteVolume24h if available
@@ -176,16 +155,26 @@ def symbol_market_ccxt(symbol: str) -> str:
     return f"{symbol}/USDT:USDT"
 
 # OHLCV fetch via ccxt for futures/swap
-def fetch_ohlcv(symbol: str, timeframe: str = "1m", limit: int = 1000) -> List[List[Any]]:
+def fetch_ohlcv(symbol: str, timeframe: str = "1m", limit: int = 1000, since: int = None) -> List[List[Any]]:
     market_sym = symbol_market_ccxt(symbol)
     try:
         # ccxt expects timeframe like '1m','1h','1d'
-        ohlcv = ccxt_client.fetch_ohlcv(market_sym, timeframe=timeframe, limit=limit)
+        ohlcv = get_ccxt_client().fetch_ohlcv(market_sym, timeframe=timeframe, since=since, limit=limit)
         return ohlcv
     except Exception as e:
         logging.debug("fetch_ohlcv failed %s %s", symbol, e)
         return []
 
+# 1m/1h のベース足だけを差分で取得し、5m/15m/4h/6h/1d などはローカルで組み立てる
+bar_cache = BarCache(lambda sym, tf, since, limit: fetch_ohlcv(sym, timeframe=tf, limit=limit, since=since))
+
+def fetch_bars(symbol: str, timeframe: str = "1m", limit: int = 1000) -> List[List[Any]]:
+    try:
+        return bar_cache.ohlcv(symbol, timeframe, limit)
+    except Exception as e:
+        logging.debug("fetch_bars failed %s %s %s", symbol, timeframe, e)
+        return []
+
 def calc_atr_from_ohlcv(ohlcv: List[List[Any]], period: int = ATR_PERIOD) -> float:
     # ohlcv rows: [ts, open, high, low, close, volume]
     if not ohlcv or len(ohlcv) < period + 1:
@@ -200,7 +189,7 @@ def calc_atr_from_ohlcv(ohlcv: List[List[Any]], period: int = ATR_PERIOD) -> flo
 def fetch_orderbook(symbol: str, depth: int = 50) -> Dict[str, Any]:
     market_sym = symbol_market_ccxt(symbol)
     try:
-        ob = ccxt_client.fetch_order_book(market_sym, limit=depth)
+        ob = get_ccxt_client().fetch_order_book(market_sym, limit=depth)
         bids = ob.get("bids", [])
         asks = ob.get("asks", [])
         bid_vol = sum([b[1] for b in bids])
@@ -322,7 +311,8 @@ def run_backtest_for_symbol(symbol: str, timeframe: str = "1h", lookback: int =
     TP/SL by ATR. This is a simplified event-driven sim (no slippage by default, but we will include slippage & fee factors).
     Returns metrics (win_rate, pf, sharpe, trades, balance_curve).
     """
-    ohlcv = fetch_ohlcv(symbol, timeframe=timeframe, limit=lookback+50)
+    import pandas as pd  # loaded on first backtest, not at boot
+    ohlcv = fetch_bars(symbol, timeframe=timeframe, limit=lookback+50)
     if not ohlcv or len(ohlcv) < 50:
         return {"error":"no_ohlcv"}
     # convert to DataFrame
@@ -333,7 +323,7 @@ def run_backtest_for_symbol(symbol: str, timeframe: str = "1h", lookback: int =
     lows = df["low"].values
     closes = df["close"].values
     trs = np.maximum(highs[1:] - lows[1:], np.maximum(np.abs(highs[1:] - closes[:-1]), np.abs(lows[1:] - closes[:-1])))
-    atrs = pd.Series(np.concatenate([np.zeros(1), trs])).rolling(atr_period).mean().fillna(method="bfill").values
+    atrs = pd.Series(np.concatenate([np.zeros(1), trs])).rolling(atr_period).mean().bfill().values
 
     balance = 10000.0
     balance_curve = []
@@ -430,6 +420,7 @@ def run_backtest_for_symbol(symbol: str, timeframe: str = "1h", lookback: int =
     }
 
 # --------------- Main trading cycle ----------------
+@profile_cycles  # /profile/arm で有効にしたときだけ測る (解除中はそのまま呼ぶ)
 def run_cycle():
     logging.info("=== cycle start === %s", utcnow_jst_iso())
     fg = fetch_fear_and_greed()
@@ -449,19 +440,19 @@ def run_cycle():
         try:
             price = None
             try:
-                ticker = ccxt_client.fetch_ticker(symbol_market_ccxt(sym))
+                ticker = get_ccxt_client().fetch_ticker(symbol_market_ccxt(sym))
                 price = ticker.get("last") or ticker.get("close")
             except Exception:
                 # fallback to OHLCV last close
-                o = fetch_ohlcv(sym, timeframe="1m", limit=2)
+                o = fetch_bars(sym, timeframe="1m", limit=2)
                 if o:
                     price = o[-1][4]
             if price is None:
                 logging.debug("%s price missing", sym)
                 continue
 
-            ohlcv_m = fetch_ohlcv(sym, timeframe="1m", limit=200)
-            atr = calc_atr_from_ohlcv(fetch_ohlcv(sym, timeframe="1d", limit=ATR_PERIOD+5), period=ATR_PERIOD)
+            ohlcv_m = fetch_bars(sym, timeframe="1m", limit=200)
+            atr = calc_atr_from_ohlcv(fetch_bars(sym, timeframe="1d", limit=ATR_PERIOD+5), period=ATR_PERIOD)
             ob = fetch_orderbook(sym, depth=50)
             comment, score = generate_ai_comment(sym, price, atr, ob, fg, ohlcv_m)
             snapshot["symbols"][sym] = {"price": price, "atr": atr, "orderbook": {"bid_vol": ob["bid_vol"], "ask_vol": ob["ask_vol"]}, "score": score, "ai": comment}
@@ -490,6 +481,13 @@ def run_cycle():
                 size_usd = POSITION_USD
                 # check balance & sizing
                 balance = state.get_balance()
+                if balance is None and executor.exchange:
+                    # 起動直後のサイクルはまだ残高を保存していないので、その場で取得する
+                    state.sync_balance(executor.exchange)
+                    balance = state.get_balance()
+                if balance is None:
+                    logging.warning("Skipping %s entry: balance unknown", sym)
+                    continue
                 if size_usd > balance * 0.2:
                     # don't allocate more than 20% of balance
                     size_usd = balance * 0.2
@@ -502,6 +500,9 @@ def run_cycle():
                 # open position via executor
                 leverage = dynamic_leverage(balance, atr, last)
                 res = executor.open_position(sym, signal, size_usd, last, tp, sl, leverage=leverage)
+                if "error" in res:
+                    logging.warning("Entry for %s not opened: %s", sym, res["error"])
+                    continue
 
                 # send telegram
                 msg = f"<b>📥 新規ポジション {'(SIM)' if res.get('simulated') else ''}</b>\n"
@@ -518,20 +519,25 @@ def run_cycle():
     balance = executor.exchange.fetch_balance({'type': 'future'})
     positions = executor.exchange.fetch_positions()
     state.update_last_snapshot(snapshot, balance, positions)
+    # 通知はこの結果をキャッシュから描画する (通知ごとに残高・ポジションを取り直さない)
+    get_account_cache().update(balance, positions)
+    get_fx_cache().get()  # TTL 切れならここで裏で取り直しておく
+    market_recorder.flush()  # MARKET_RECORD_DIR 設定時はこのサイクルの市場データを1フレームとして書き出す
     logging.info("=== cycle finished === %s", utcnow_jst_iso())
 
 # ---------------- position checker for TP/SL (runs each minute) ----------------
 def check_positions_and_manage():
     logging.info("=== check positions ===")
     positions = state.get_positions()
+    exits = []  # (symbol, price, label)
     for sym, pos in list(positions.items()):
         try:
             price = None
             try:
-                t = ccxt_client.fetch_ticker(symbol_market_ccxt(sym))
+                t = get_ccxt_client().fetch_ticker(symbol_market_ccxt(sym))
                 price = t.get("last") or t.get("close")
             except Exception:
-                o = fetch_ohlcv(sym, timeframe="1m", limit=2)
+                o = fetch_bars(sym, timeframe="1m", limit=2)
                 if o:
                     price = o[-1][4]
             if price is None:
@@ -540,28 +546,24 @@ def check_positions_and_manage():
             tp = float(pos["take_profit"])
             sl = float(pos["stop_loss"])
             # handle multi-step partial closes: for simplicity close full when reach TP/SL
-            if side == "long":
-                if price >= tp:
-                    rec = executor.close_position(sym, portion=1.0)
-                    msg = f"<b>✅ TP executed</b>\n<b>{sym}</b>\nExit: <code>{price:.6f}</code>\nPnL: <code>{rec.get('pnl',0):.4f}</code>"
-                    send_telegram_html(msg)
-            else:
-                if price <= tp:
-                    rec = executor.close_position(sym, portion=1.0)
-                    msg = f"<b>✅ TP executed</b>\n<b>{sym}</b>\nExit: <code>{price:.6f}</code>\nPnL: <code>{rec.get('pnl',0):.4f}</code>"
-                    send_telegram_html(msg)
-            # stoploss
-            if side == "long" and price <= sl:
-                rec = executor.close_position(sym, portion=1.0)
-                msg = f"<b>❌ SL executed</b>\n<b>{sym}</b>\nExit: <code>{price:.6f}</code>\nPnL: <code>{rec.get('pnl',0):.4f}</code>"
-                send_telegram_html(msg)
-            if side == "short" and price >= sl:
-                rec = executor.close_position(sym, portion=1.0)
-                msg = f"<b>❌ SL executed</b>\n<b>{sym}</b>\nExit: <code>{price:.6f}</code>\nPnL: <code>{rec.get('pnl',0):.4f}</code>"
-                send_telegram_html(msg)
+            if (side == "long" and price >= tp) or (side != "long" and price <= tp):
+                exits.append((sym, price, "✅ TP executed"))
+            elif (side == "long" and price <= sl) or (side == "short" and price >= sl):
+                exits.append((sym, price, "❌ SL executed"))
         except Exception as e:
             logging.exception("check pos failed %s: %s", sym, e)
 
+    if not exits:
+        return
+    # all exits are sent together (concurrently through the order router) instead of one round trip each
+    results = executor.close_positions([(sym, price, 1.0) for sym, price, _ in exits])
+    for sym, price, label in exits:
+        rec = results.get(sym, {})
+        if "error" in rec:
+            continue
+        msg = f"<b>{label}</b>\n<b>{sym}</b>\nExit: <code>{price:.6f}</code>\nPnL: <code>{rec.get('pnl',0):.4f}</code>"
+        send_telegram_html(msg)
+
 # ---------------- Scheduler & Flask status ----------------
 @app.route("/health")
 def health():
@@ -580,11 +582,64 @@ def status():
     snap["executor_ok"] = (executor.exchange is not None)
     return jsonify(snap)
 
+# ---------------- on-demand profiler (profiler.py) ----------------
+# /profile/arm?key=...&mode=sampling|cprofile&cycles=N&seconds=T&interval_ms=10 で次の N サイクルか T 秒を測り、
+# 終わったら /profile/result?key=...&format=collapsed|pstats|prof|json で取り出す
+@app.route("/profile")
+def profile_status():
+    if request.args.get("key", "") != STATUS_KEY:
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(get_profiler().status())
+
+@app.route("/profile/arm", methods=["GET", "POST"])
+def profile_arm():
+    if request.args.get("key", "") != STATUS_KEY:
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        cycles = request.args.get("cycles", type=int)
+        seconds = request.args.get("seconds", type=float)
+        interval_ms = request.args.get("interval_ms", type=float)
+        return jsonify(get_profiler().arm(request.args.get("mode", "sampling"), cycles=cycles, seconds=seconds,
+                                          **({"interval_ms": interval_ms} if interval_ms else {})))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e), **get_profiler().status()}), 409
+
+@app.route("/profile/disarm", methods=["GET", "POST"])
+def profile_disarm():
+    if request.args.get("key", "") != STATUS_KEY:
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(get_profiler().disarm())
+
+@app.route("/profile/result")
+def profile_result():
+    if request.args.get("key", "") != STATUS_KEY:
+        return jsonify({"error": "unauthorized"}), 401
+    result = get_profiler().last_result()
+    if result is None:
+        return jsonify({"error": "no profile has finished yet"}), 404
+    fmt = request.args.get("format", "json")
+    if fmt == "json":
+        return jsonify({k: v for k, v in result.items() if k != "prof"})
+    if fmt in ("collapsed", "pstats"):
+        if not result.get(fmt):
+            return jsonify({"error": f"{fmt} output is not available for mode={result['mode']}"}), 404
+        return result[fmt], 200, {"Content-Type": "text/plain; charset=utf-8"}
+    if fmt == "prof":
+        if not result.get("prof"):
+            return jsonify({"error": "prof output is only available for mode=cprofile"}), 404
+        return result["prof"], 200, {"Content-Type": "application/octet-stream",
+                                     "Content-Disposition": "attachment; filename=run_cycle.prof"}
+    return jsonify({"error": "format must be one of json, collapsed, pstats, prof"}), 400
+
 def start_scheduler():
     # trading cycle every 1 minute
     schedule.every(1).minutes.do(run_cycle)
     # check positions every 1 minute
     schedule.every(1).minutes.do(check_positions_and_manage)
+    # market_data_history retention (rollup / archive / vacuum) once a day
+    schedule.every().day.at(retention.RETENTION_RUN_AT).do(retention.run_retention_job_in_background)
     # hourly report at JST minute==0
     while True:
         schedule.run_pending()
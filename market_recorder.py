@@ -0,0 +1,422 @@
+# market_recorder.py
+# 取引所の応答 (fetch_ticker(s) / fetch_ohlcv / fetch_order_book) をそのまま記録し、あとで再生できるようにする
+#  - RecordingExchange は ccxt クライアントを包み、応答を MarketRecorder に流してから呼び出し側へ返す
+#    (exchange_registry が MARKET_RECORD_DIR 設定時に全クライアントを包む)
+#  - 記録はメモリに溜め、サイクルの終わり (main.run_cycle) か MARKET_RECORD_FLUSH_RECORDS 件ごとに1フレームとして追記する
+#  - ファイル形式 (UTC の日ごとに market_YYYYMMDD.rec、追記のみ):
+#      フレーム = MAGIC(4) + 長さ(4, little endian) + zlib(ヘッダ長(4) + ヘッダ JSON + 列のバイト列)
+#    列は型ごとに符号化する: 時刻は差分の整数、価格・数量は 10^k 倍して整数にできれば差分の整数 (小数の桁は k で復元)、
+#    できなければ float64 のまま。整数は zigzag にして値域に合わせて uint8〜uint64 に詰め、
+#    多バイトの列はバイト位置ごとに並べ替えてから圧縮する。
+#    書き込み途中で落ちた最後のフレームは読み込み時に無視する
+#  - MarketLog は複数のファイルを読み、銘柄・時間足ごとの索引を作る (exchange_simulator.RecordedFeed が再生に使う)
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+MARKET_RECORD_DIR = os.getenv("MARKET_RECORD_DIR", "")  # 空なら記録しない
+MARKET_RECORD_FLUSH_RECORDS = int(os.getenv("MARKET_RECORD_FLUSH_RECORDS", "5000"))
+MAGIC = b"TSR1"
+FORMAT_VERSION = 1
+MAX_SCALE_DIGITS = 10  # 10^k 倍で整数にする小数の桁の上限
+TICKER_FIELDS = ("timestamp", "last", "bid", "ask", "open", "high", "low", "baseVolume", "quoteVolume", "percentage")
+KIND_TICKER, KIND_OHLCV, KIND_BOOK = 0, 1, 2
+
+_UINT_TYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+
+
+# ---------------------------
+# 列の符号化
+# ---------------------------
+def _shuffle(a):
+    """多バイトの値をバイト位置ごとに並べ替える (上位バイトの 0 が続いて zlib が速く・よく縮む)"""
+    return a.view(np.uint8).reshape(len(a), a.itemsize).T.tobytes() if a.itemsize > 1 else a.tobytes()
+
+
+def _unshuffle(buf, dtype, n):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(buf, dtype=np.uint8, count=n * dtype.itemsize)
+    return raw.reshape(dtype.itemsize, n).T.copy().view(dtype).ravel() if dtype.itemsize > 1 else raw.view(dtype)
+
+
+def _pack_ints(values):
+    """整数列を zigzag (小さな負数も小さな値に) にして値域に収まる最小の符号なし型に詰める"""
+    a = np.asarray(values, dtype=np.int64)
+    z = ((a << 1) ^ (a >> 63)).view(np.uint64)
+    hi = int(z.max()) if len(z) else 0
+    for dt in _UINT_TYPES:
+        if hi <= np.iinfo(dt).max:
+            return np.dtype(dt).str, _shuffle(z.astype(dt))
+
+
+def _unpack_ints(buf, dtype, n):
+    z = _unshuffle(buf, dtype, n).astype(np.uint64)
+    return (z >> np.uint64(1)).view(np.int64) ^ -(z & np.uint64(1)).view(np.int64)
+
+
+def _scale_digits(a):
+    """a のすべてを整数にする 10^k の最小の k (無ければ MAX_SCALE_DIGITS)"""
+    for k in range(MAX_SCALE_DIGITS + 1):
+        scaled = np.round(a * 10.0 ** k)
+        if np.array_equal(scaled / 10.0 ** k, a):
+            return k
+    return MAX_SCALE_DIGITS
+
+
+def encode_column(values, kind):
+    """
+    kind: "i" 整数 / "d" 整数の差分 / "f" 小数 (10^k 倍した整数の差分、できなければ float64)。
+    戻り値: (spec, bytes)。None/NaN はマスク付きで 0 として符号化する
+    """
+    if kind in ("i", "d"):
+        a = np.asarray(values, dtype=np.int64)
+        spec = {"n": len(a), "enc": kind}
+        spec["dtype"], data = _pack_ints(np.diff(a, prepend=0) if kind == "d" else a)
+        spec["len"] = len(data)
+        return spec, data
+
+    a = np.asarray([np.nan if v is None else v for v in values] if isinstance(values, list) else values, dtype=np.float64)
+    spec, prefix = {"n": len(a)}, b""
+    nan = np.isnan(a)
+    if nan.any():
+        prefix = np.packbits(nan).tobytes()
+        spec["mask"] = len(prefix)
+        a = np.where(nan, 0.0, a)
+    # 先頭の一部で必要な桁数の見当をつけてから全体を確かめる (大きな列で 11 通りを全部試さない)
+    for k in range(_scale_digits(a[:64]), MAX_SCALE_DIGITS + 1):
+        scale = 10.0 ** k
+        scaled = np.round(a * scale)
+        if np.all(np.abs(scaled) < 2 ** 53) and np.array_equal(scaled / scale, a):
+            spec.update(enc="x", k=k)
+            spec["dtype"], data = _pack_ints(np.diff(scaled.astype(np.int64), prepend=0))
+            break
+    else:
+        spec.update(enc="f", dtype="<f8")
+        data = _shuffle(a.astype("<f8"))
+    spec["len"] = len(prefix) + len(data)
+    return spec, prefix + data
+
+
+def decode_column(spec, buf):
+    n, mask = spec["n"], None
+    if spec.get("mask"):
+        mask = np.unpackbits(np.frombuffer(buf[:spec["mask"]], dtype=np.uint8), count=n).astype(bool)
+        buf = buf[spec["mask"]:]
+    enc = spec["enc"]
+    if enc == "f":
+        out = _unshuffle(buf, spec["dtype"], n).astype(np.float64)
+    else:
+        ints = _unpack_ints(buf, spec["dtype"], n)
+        if enc == "i":
+            return ints
+        ints = np.cumsum(ints, dtype=np.int64)
+        if enc == "d":
+            return ints
+        out = ints / 10.0 ** spec["k"]
+    if mask is not None:
+        out[mask] = np.nan
+    return out
+
+
+# ---------------------------
+# フレーム
+# ---------------------------
+def encode_frame(header, columns):
+    """columns: [(name, kind, values)] -> ファイルに追記するバイト列"""
+    specs, chunks = {}, []
+    for name, kind, values in columns:
+        specs[name], data = encode_column(values, kind)
+        chunks.append(data)
+    head = json.dumps({**header, "columns": specs}, separators=(",", ":"), default=str).encode()
+    body = zlib.compress(struct.pack("<I", len(head)) + head + b"".join(chunks), 6)
+    return MAGIC + struct.pack("<I", len(body)) + body
+
+
+def read_frames(path):
+    """ファイル内のフレームを (header, {列名: ndarray}) で順に返す。途中で切れたフレームは捨てる"""
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + 8 <= len(data):
+        if data[pos:pos + 4] != MAGIC:
+            logging.warning(f"{path}: bad frame marker at byte {pos}, ignoring the rest")
+            return
+        size = struct.unpack_from("<I", data, pos + 4)[0]
+        if pos + 8 + size > len(data):
+            logging.warning(f"{path}: truncated last frame ({len(data) - pos} bytes) ignored")
+            return
+        body = zlib.decompress(data[pos + 8:pos + 8 + size])
+        pos += 8 + size
+        head_len = struct.unpack_from("<I", body, 0)[0]
+        header = json.loads(body[4:4 + head_len])
+        offset, columns = 4 + head_len, {}
+        for name, spec in header["columns"].items():
+            columns[name] = decode_column(spec, body[offset:offset + spec["len"]])
+            offset += spec["len"]
+        yield header, columns
+
+
+# ---------------------------
+# 記録
+# ---------------------------
+class MarketRecorder:
+    """応答をメモリに溜め、flush() で1フレームとしてその日のファイルに追記する。スレッドセーフ"""
+
+    def __init__(self, directory=MARKET_RECORD_DIR, flush_records=MARKET_RECORD_FLUSH_RECORDS):
+        self.directory = directory
+        self.flush_records = flush_records
+        self.markets = None
+        self._markets_written = set()  # markets をヘッダに書いたファイル
+        self._lock = threading.Lock()
+        self._reset()
+        self.stats = {"records": 0, "frames": 0, "bytes": 0, "encode_ms": 0.0}
+
+    def _reset(self):
+        self._symbols, self._timeframes = {}, {}
+        self._calls = {"t": [], "kind": [], "sym": [], "tf": [], "n": [], "m": []}
+        self._tickers = {f: [] for f in TICKER_FIELDS}
+        self._bars, self._book_px, self._book_qty, self._book_ts = [], [], [], []
+
+    def _code(self, table, key):
+        code = table.get(key)
+        if code is None:
+            code = table[key] = len(table)
+        return code
+
+    def _call(self, kind, symbol, timeframe=None, n=0, m=0, t=None):
+        calls = self._calls
+        calls["t"].append(int(t if t is not None else time.time() * 1000))
+        calls["kind"].append(kind)
+        calls["sym"].append(self._code(self._symbols, symbol))
+        calls["tf"].append(self._code(self._timeframes, timeframe) if timeframe else -1)
+        calls["n"].append(n)
+        calls["m"].append(m)
+        self.stats["records"] += 1
+        return len(calls["t"]) >= self.flush_records
+
+    def record_ticker(self, symbol, ticker, t=None):
+        with self._lock:
+            for field in TICKER_FIELDS:
+                self._tickers[field].append(ticker.get(field))
+            full = self._call(KIND_TICKER, symbol, t=t)
+        if full:
+            self.flush()
+
+    def record_ohlcv(self, symbol, timeframe, rows, t=None):
+        with self._lock:
+            self._bars.extend(rows)
+            full = self._call(KIND_OHLCV, symbol, timeframe, n=len(rows), t=t)
+        if full:
+            self.flush()
+
+    def record_order_book(self, symbol, book, t=None):
+        bids, asks = book.get("bids") or [], book.get("asks") or []
+        with self._lock:
+            for level in bids + asks:
+                self._book_px.append(level[0])
+                self._book_qty.append(level[1])
+            self._book_ts.append(book.get("timestamp"))
+            full = self._call(KIND_BOOK, symbol, n=len(bids), m=len(asks), t=t)
+        if full:
+            self.flush()
+
+    def set_markets(self, markets):
+        """マーケット情報 (load_markets の結果) は日ごとのファイルの最初のフレームに1回だけ入れる"""
+        self.markets = markets
+
+    def path_for(self, t_ms):
+        return os.path.join(self.directory, time.strftime("market_%Y%m%d.rec", time.gmtime(t_ms / 1000)))
+
+    def flush(self):
+        """溜まった記録を1フレームとして追記する。戻り値: 書いたバイト数"""
+        with self._lock:
+            if not self._calls["t"]:
+                return 0
+            started = time.perf_counter()
+            calls, tickers = self._calls, self._tickers
+            bars = np.asarray(self._bars, dtype=np.float64).reshape(-1, 6)
+            header = {"v": FORMAT_VERSION, "symbols": list(self._symbols), "timeframes": list(self._timeframes)}
+            path = self.path_for(calls["t"][0])
+            if self.markets and path not in self._markets_written:
+                header["markets"] = self.markets
+            columns = [("call." + name, "d" if name == "t" else "i", values) for name, values in calls.items()]
+            columns += [("ticker." + field, "f", values) for field, values in tickers.items()]
+            columns += [("bar.ts", "d", bars[:, 0].astype(np.int64))]
+            columns += [(f"bar.{c}", "f", bars[:, i + 1]) for i, c in enumerate("ohlcv")]
+            columns += [("book.ts", "f", self._book_ts), ("book.px", "f", self._book_px), ("book.qty", "f", self._book_qty)]
+            frame = encode_frame(header, columns)
+            self._reset()
+            try:
+                os.makedirs(self.directory or ".", exist_ok=True)
+                with open(path, "ab") as f:
+                    f.write(frame)
+                if "markets" in header:
+                    self._markets_written.add(path)
+            except OSError as e:
+                logging.error(f"Failed to write market recording {path}: {e}")
+                return 0
+            self.stats["frames"] += 1
+            self.stats["bytes"] += len(frame)
+            self.stats["encode_ms"] += (time.perf_counter() - started) * 1000
+            return len(frame)
+
+
+class RecordingExchange:
+    """ccxt クライアントを包み、市場データの応答を recorder に記録する。それ以外の属性はそのまま委譲する"""
+
+    def __init__(self, client, recorder):
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def set_markets(self, markets, currencies=None):
+        self._recorder.set_markets(markets)
+        return self._client.set_markets(markets, currencies)
+
+    def fetch_ticker(self, symbol, params=None):
+        ticker = self._client.fetch_ticker(symbol, params or {})
+        self._recorder.record_ticker(symbol, ticker)
+        return ticker
+
+    def fetch_tickers(self, symbols=None, params=None):
+        tickers = self._client.fetch_tickers(symbols, params or {})
+        for symbol, ticker in tickers.items():
+            self._recorder.record_ticker(symbol, ticker)
+        return tickers
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params=None):
+        rows = self._client.fetch_ohlcv(symbol, timeframe, since, limit, params or {})
+        self._recorder.record_ohlcv(symbol, timeframe, rows)
+        return rows
+
+    def fetch_order_book(self, symbol, limit=None, params=None):
+        book = self._client.fetch_order_book(symbol, limit, params or {})
+        self._recorder.record_order_book(symbol, book)
+        return book
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """MARKET_RECORD_DIR が設定されていれば共有の MarketRecorder、無ければ None"""
+    global _recorder
+    if not MARKET_RECORD_DIR:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = MarketRecorder()
+            logging.info(f"Recording exchange responses to {MARKET_RECORD_DIR}/")
+        return _recorder
+
+
+def flush():
+    """サイクルの終わりに呼ぶ。記録していなければ何もしない"""
+    if _recorder is not None:
+        _recorder.flush()
+
+
+# ---------------------------
+# 再生用の読み込み
+# ---------------------------
+def record_files(paths):
+    """ファイルとディレクトリ (中の *.rec を日付順) の指定を、ファイルのリストにする"""
+    files = []
+    for path in [paths] if isinstance(paths, str) else paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, p) for p in os.listdir(path) if p.endswith(".rec"))
+        else:
+            files.append(path)
+    return files
+
+
+class MarketLog:
+    """
+    記録ファイルを読み込み、銘柄ごとに時刻順の索引を作る。
+    tickers[symbol] = (観測時刻, [ticker]) / bars[(symbol, tf)] = (観測時刻, 足 (n, 6)) /
+    books[symbol] = (観測時刻, [(bids, asks, timestamp)])
+    """
+
+    def __init__(self):
+        self.markets = None
+        self.tickers, self.bars, self.books = {}, {}, {}
+        self.start_ms = self.end_ms = None
+        self.calls = 0
+
+    @classmethod
+    def load(cls, paths):
+        """paths: 記録ファイルかディレクトリ (またはそのリスト)"""
+        log = cls()
+        tickers, bars, books = {}, {}, {}
+        for path in record_files(paths):
+            for header, cols in read_frames(path):
+                log._add_frame(header, cols, tickers, bars, books)
+        for symbol, items in tickers.items():
+            log.tickers[symbol] = (np.array([t for t, _ in items], dtype=np.int64), [v for _, v in items])
+        for key, chunks in bars.items():
+            log.bars[key] = (np.concatenate([np.full(len(r), t, dtype=np.int64) for t, r in chunks]),
+                             np.concatenate([r for _, r in chunks]))
+        for symbol, items in books.items():
+            log.books[symbol] = (np.array([t for t, _ in items], dtype=np.int64), [v for _, v in items])
+        return log
+
+    def _add_frame(self, header, cols, tickers, bars, books):
+        if header.get("markets"):
+            self.markets = header["markets"]
+        symbols, timeframes = header["symbols"], header["timeframes"]
+        t, kind, sym, tf = cols["call.t"], cols["call.kind"], cols["call.sym"], cols["call.tf"]
+        n, m = cols["call.n"], cols["call.m"]
+        bar_rows = np.column_stack([cols["bar.ts"]] + [cols[f"bar.{c}"] for c in "ohlcv"])
+        ti = bi = ki = li = 0
+        for j in range(len(t)):
+            symbol, at = symbols[sym[j]], int(t[j])
+            if kind[j] == KIND_TICKER:
+                ticker = {f: (None if np.isnan(cols["ticker." + f][ti]) else float(cols["ticker." + f][ti]))
+                          for f in TICKER_FIELDS}
+                ticker["symbol"] = symbol
+                tickers.setdefault(symbol, []).append((at, ticker))
+                ti += 1
+            elif kind[j] == KIND_OHLCV:
+                bars.setdefault((symbol, timeframes[tf[j]]), []).append((at, bar_rows[bi:bi + n[j]]))
+                bi += n[j]
+            else:
+                px, qty = cols["book.px"], cols["book.qty"]
+                bids = np.column_stack([px[li:li + n[j]], qty[li:li + n[j]]])
+                asks = np.column_stack([px[li + n[j]:li + n[j] + m[j]], qty[li + n[j]:li + n[j] + m[j]]])
+                ts = cols["book.ts"][ki]
+                books.setdefault(symbol, []).append((at, (bids, asks, None if np.isnan(ts) else int(ts))))
+                li += n[j] + m[j]
+                ki += 1
+            self.start_ms = at if self.start_ms is None else min(self.start_ms, at)
+            self.end_ms = at if self.end_ms is None else max(self.end_ms, at)
+        self.calls += len(t)
+
+    def symbols(self):
+        return sorted(set(self.tickers) | set(self.books) | {s for s, _ in self.bars})
+
+
+def _summary(paths):
+    paths = record_files(paths)
+    total = sum(os.path.getsize(p) for p in paths)
+    started = time.perf_counter()
+    log = MarketLog.load(paths)
+    elapsed = time.perf_counter() - started
+    span_h = (log.end_ms - log.start_ms) / 3_600_000 if log.calls else 0
+    print(f"{len(paths)} file(s), {total / 1e6:.2f} MB, {log.calls} responses over {span_h:.2f}h, "
+          f"{len(log.symbols())} symbols (loaded in {elapsed:.1f}s)")
+    print(f"  tickers: {sum(len(v[1]) for v in log.tickers.values())}  "
+          f"bars: {sum(len(v[1]) for v in log.bars.values())}  books: {sum(len(v[1]) for v in log.books.values())}")
+
+
+if __name__ == "__main__":
+    import sys
+    _summary(sys.argv[1:])
@@ -1,7 +1,8 @@
 # market_regime_detector.py
-import pandas_ta as ta
 import logging
 
+from utils import load_pandas_ta
+
 class MarketRegimeDetector:
     def get_market_regime(self, series):
         """
@@ -9,6 +10,7 @@ class MarketRegimeDetector:
         戻り値: 'TRENDING' or 'RANGING'
         """
         try:
+            load_pandas_ta()
             # ADXを計算 (14期間)
             adx = series.ta.adx()
             adx_value = adx['ADX_14'].iloc[-1]
@@ -1,26 +1,64 @@
 # ml_model.py
+import os
+import copy
+import time
+import numpy as np
 import pandas as pd
 import logging
 import pickle
+import threading
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, LargeBinary, DateTime, Float
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
-import pandas_ta as ta
-
-# --- データベースのテーブル定義 ---
-Base = declarative_base()
-class AIModel(Base):
-    __tablename__ = 'ai_models'
-    id = Column(Integer, primary_key=True)
-    model_data = Column(LargeBinary, nullable=False)
-    accuracy = Column(Float, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+from model_store import get_artifact_store
+from utils import load_pandas_ta
+
+# sqlalchemy / sklearn / pandas_ta は読み込みが重いので、使う関数の中で import する
+
+# --- データベースのテーブル定義 (sqlalchemy は初回使用時に読み込む) ---
+_tables = None
+_tables_lock = threading.Lock()
+
+def get_tables():
+    """(Base, AIModel) を返す。テーブル定義は初回呼び出し時に1回だけ作る"""
+    global _tables
+    if _tables is None:
+        with _tables_lock:
+            if _tables is None:
+                from sqlalchemy import Column, Integer, LargeBinary, DateTime, Float
+                from sqlalchemy.orm import declarative_base
+
+                Base = declarative_base()
+                class AIModel(Base):
+                    __tablename__ = 'ai_models'
+                    id = Column(Integer, primary_key=True)
+                    model_data = Column(LargeBinary, nullable=False)
+                    accuracy = Column(Float, nullable=True)
+                    created_at = Column(DateTime, default=datetime.utcnow)
+                _tables = (Base, AIModel)
+    return _tables
+
+def __getattr__(name):
+    # 従来どおり ml_model.Base / ml_model.AIModel で参照できるようにする
+    if name == "Base":
+        return get_tables()[0]
+    if name == "AIModel":
+        return get_tables()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+MODEL_DATABASE_URL = os.getenv("DATABASEURL") or "sqlite:///sentinel_data.db"
+# 再学習モード: full (全履歴から作り直し) / warm_start (新しい行で木を追加) / window (直近N行で作り直し)
+RETRAIN_MODE = os.getenv("RETRAIN_MODE", "warm_start")
+RETRAIN_WINDOW_ROWS = int(os.getenv("RETRAIN_WINDOW_ROWS", "20000"))
+RETRAIN_WARM_TREES = int(os.getenv("RETRAIN_WARM_TREES", "20"))
+RETRAIN_MAX_TREES = int(os.getenv("RETRAIN_MAX_TREES", "300"))
+FEATURE_CACHE_PATH = os.getenv("FEATURE_CACHE_PATH", "feature_cache.pkl")
+FEATURE_WARMUP_ROWS = 100  # 指標の計算に必要な重なり (BBANDS 20 / MACD 26+9 / RSI 14 に余裕を持たせる)
+MODEL_ARTIFACT_NAME = "ai_model"  # model_store 上の名前。バージョンは ai_models.id と揃える
+MODEL_FEATURES = ['Open', 'High', 'Low', 'Close', 'Volume', 'RSI_14', 'MACDh_12_26_9', 'BBL_20_2.0', 'BBM_20_2.0', 'BBU_20_2.0']
 
 # --- データベース操作 ---
 def save_model_to_db(model, engine, accuracy_score):
+    from sqlalchemy.orm import sessionmaker
+    _, AIModel = get_tables()
     Session = sessionmaker(bind=engine)
     session = Session()
     try:
@@ -29,12 +67,53 @@ def save_model_to_db(model, engine, accuracy_score):
         session.add(new_model)
         session.commit()
         logging.info(f"New AI model with accuracy {accuracy_score:.2f} saved to database.")
+        mapped = _export_artifact(new_model.id, model, accuracy_score, _artifact_identity(new_model))
+        # 同一プロセスのレジストリには再読込なしで即時反映する
+        if _registry is not None and _registry.engine is engine:
+            _registry.install(new_model.id, mapped or model)
     except Exception as e:
         session.rollback(); logging.error(f"Failed to save model to DB: {e}")
     finally:
         session.close()
 
+def _artifact_identity(record):
+    """成果物のマニフェストに残す、DBのどのモデルから書き出したかの印 (id だけではDBを作り直すと重なる)"""
+    if record is None:
+        return None
+    return {"db_id": record.id, "db_created_at": record.created_at.isoformat() if record.created_at else None}
+
+def _matching_artifact(store, model_id, identity):
+    """
+    バージョン model_id の成果物が identity のモデルから書き出したものなら読み込んで返す。
+    無ければ None。別のDB・別の学習の成果物 (DBの作り直しで id が重なった等) なら退避して None
+    """
+    if model_id not in store.versions(MODEL_ARTIFACT_NAME):
+        return None
+    metadata = (store.manifest(MODEL_ARTIFACT_NAME, model_id) or {}).get("metadata") or {}
+    if identity and all(metadata.get(k) == v for k, v in identity.items()):
+        return store.load(MODEL_ARTIFACT_NAME, model_id)
+    logging.warning(f"Model artifact v{model_id} was exported from a different model "
+                    f"({metadata.get('db_created_at')} != {(identity or {}).get('db_created_at')}), re-exporting it.")
+    store.retire(MODEL_ARTIFACT_NAME, model_id)
+    return None
+
+def _export_artifact(model_id, model, accuracy=None, identity=None):
+    """モデルを mmap 可能な成果物として書き出し、読み込んだものを返す (失敗時は None)"""
+    try:
+        store = get_artifact_store()
+        existing = _matching_artifact(store, model_id, identity)
+        if existing is not None:
+            return existing
+        # 直前と同一内容なら既存バージョンのマニフェストが返る
+        manifest = store.save(MODEL_ARTIFACT_NAME, model, version=model_id,
+                              metadata={"accuracy": accuracy, **(identity or {})})
+        return store.load(MODEL_ARTIFACT_NAME, manifest["version"])
+    except Exception as e:
+        logging.error(f"Failed to export model {model_id} to the artifact store: {e}"); return None
+
 def load_latest_model_from_db(engine):
+    from sqlalchemy.orm import sessionmaker
+    _, AIModel = get_tables()
     Session = sessionmaker(bind=engine)
     session = Session()
     try:
@@ -48,16 +127,191 @@ def load_latest_model_from_db(engine):
     finally:
         session.close()
 
+# --- モデルレジストリ (プロセス内キャッシュ) ---
+class ModelRegistry:
+    """
+    デシリアライズ済みモデルをメモリに保持する。
+    毎サイクルの確認は ai_models の MAX(id) (主キー索引) を引くだけで、
+    新しいモデルが保存されていた時だけ読み込んでアトミックに差し替える。
+    読み込みは model_store の mmap 成果物を優先し、無ければDBの pickle から作って書き出す
+    (以降のプロセスは unpickle せず同じページを共有する)。
+    1つ前のモデルはロールバック用に保持する。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._current = (None, None)   # (model_id, model)
+        self._previous = (None, None)
+        self._pinned_below = None      # rollback() で除外したモデルID
+
+    @property
+    def version(self):
+        return self._current[0]
+
+    def probe(self):
+        """最新モデルのIDを返す (主キーの最大値のみを参照)"""
+        from sqlalchemy import func, select
+        _, AIModel = get_tables()
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.max(AIModel.id))).scalar()
+
+    def get(self):
+        """最新モデルを返す。バージョンが変わっていなければDBから読み込まない"""
+        try:
+            latest_id = self.probe()
+        except Exception as e:
+            logging.error(f"Model version probe failed: {e}")
+            return self._current[1]
+
+        current_id, current_model = self._current
+        if latest_id is None or latest_id == current_id:
+            return current_model
+        if self._pinned_below is not None and latest_id <= self._pinned_below:
+            return current_model
+
+        model = self._load(latest_id)
+        if model is None:
+            return current_model
+        self.install(latest_id, model)
+        return model
+
+    def _identity(self, model_id):
+        """DBの model_id の行の印 (_artifact_identity)。モデル本体は読まない"""
+        from sqlalchemy.orm import load_only, sessionmaker
+        _, AIModel = get_tables()
+        session = sessionmaker(bind=self.engine)()
+        try:
+            record = session.query(AIModel).options(load_only(AIModel.id, AIModel.created_at)).filter_by(id=model_id).first()
+            return _artifact_identity(record)
+        finally:
+            session.close()
+
+    def _load(self, model_id):
+        identity = None
+        try:
+            identity = self._identity(model_id)
+            model = _matching_artifact(get_artifact_store(), model_id, identity)
+            if model is not None:
+                logging.info(f"Loaded AI model id={model_id} from the artifact store (memory-mapped).")
+                return model
+        except Exception as e:
+            logging.warning(f"Artifact store load failed for model {model_id}, falling back to DB: {e}")
+        model = self.load_from_db(model_id)
+        if model is None:
+            return None
+        return _export_artifact(model_id, model, identity=identity) or model
+
+    def load_from_db(self, model_id=None):
+        """DBの pickle から学習可能な (sklearn の) モデルを読み込む。model_id 省略時は現行バージョン"""
+        model_id = model_id or self.version
+        if model_id is None:
+            return None
+        from sqlalchemy.orm import sessionmaker
+        _, AIModel = get_tables()
+        Session = sessionmaker(bind=self.engine)
+        session = Session()
+        try:
+            record = session.get(AIModel, model_id)
+            if record is None:
+                return None
+            logging.info(f"Loading AI model id={record.id} (trained at {record.created_at}) from database.")
+            return pickle.loads(record.model_data)
+        except Exception as e:
+            logging.error(f"Failed to load model {model_id} from DB: {e}"); return None
+        finally:
+            session.close()
+
+    def install(self, model_id, model):
+        """モデルを差し替える (直前のモデルはロールバック用に残す)"""
+        with self._lock:
+            if model_id == self._current[0]:
+                return
+            self._previous = self._current
+            self._current = (model_id, model)
+            if self._pinned_below is not None and model_id > self._pinned_below:
+                self._pinned_below = None
+        logging.info(f"AI model hot-swapped to id={model_id}.")
+
+    def rollback(self):
+        """1つ前のモデルに戻す。戻したモデルより新しいモデルが保存されるまで固定する"""
+        with self._lock:
+            if self._previous[1] is None:
+                logging.warning("No previous model to roll back to.")
+                return False
+            bad_id = self._current[0]
+            self._current, self._previous = self._previous, (None, None)
+            self._pinned_below = bad_id
+        logging.warning(f"AI model rolled back from id={bad_id} to id={self._current[0]}.")
+        return True
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_model_registry(engine=None):
+    """プロセス共通のモデルレジストリを返す"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from sqlalchemy import create_engine
+                Base, _ = get_tables()
+                engine = engine or create_engine(MODEL_DATABASE_URL)
+                Base.metadata.create_all(engine)
+                _registry = ModelRegistry(engine)
+    return _registry
+
+def load_model():
+    """最新のAIモデルを返す (キャッシュ済みなら version probe のみ)"""
+    return get_model_registry().get()
+
+# --- 推論 ---
+_warned_missing_features = set()
+
+def build_feature_matrix(model, df):
+    """
+    モデルの学習時特徴量の順に DataFrame から float 行列を作る。
+    欠けている列・数値化できない値・NaN は一律 0.0 で埋める (単票・一括で同じ扱い)。
+    """
+    features = list(getattr(model, "feature_names_in_", MODEL_FEATURES))
+    missing = [f for f in features if f not in df.columns]
+    new_missing = set(missing) - _warned_missing_features
+    if new_missing:
+        _warned_missing_features.update(new_missing)
+        logging.warning(f"Features missing from inference input, filled with 0: {sorted(new_missing)}")
+    X = df.reindex(columns=features).apply(pd.to_numeric, errors="coerce")
+    return X.fillna(0.0).astype(np.float64)
+
+def predict_surge_probabilities(model, df):
+    """候補 DataFrame 全体を1回の predict_proba で推論し、急騰確率の配列を返す"""
+    if model is None or df is None or len(df) == 0:
+        return np.zeros(0 if df is None else len(df))
+    try:
+        X = build_feature_matrix(model, df)
+        proba = model.predict_proba(X)
+        classes = list(getattr(model, "classes_", [0, 1]))
+        if 1 not in classes:
+            return np.zeros(len(df))
+        return proba[:, classes.index(1)]
+    except Exception as e:
+        logging.error(f"Batch surge prediction failed: {e}")
+        return np.zeros(len(df))
+
+def predict_surge_probability(model, token):
+    """単一トークン (dict) の急騰確率。内部では一括推論と同じ経路を使う"""
+    return float(predict_surge_probabilities(model, pd.DataFrame([token]))[0]) if model is not None else 0.0
+
 # --- データ処理とモデル訓練 ---
 def preprocess_and_add_features(df):
     try:
+        load_pandas_ta()
         df.ta.rsi(append=True)
         df.ta.macd(append=True)
         df.ta.bbands(append=True)
         df['Price_Dir'] = (df['Close'].pct_change() > 0).astype(int)
         df = df.dropna()
-        features = ['Open', 'High', 'Low', 'Close', 'Volume', 'RSI_14', 'MACDh_12_26_9', 'BBL_20_2.0', 'BBM_20_2.0', 'BBU_20_2.0']
-        available_features = [f for f in features if f in df.columns]
+        available_features = [f for f in MODEL_FEATURES if f in df.columns]
         X = df[available_features]
         y = df['Price_Dir']
         return X, y, df
@@ -65,28 +319,143 @@ def preprocess_and_add_features(df):
         logging.error(f"Error during preprocessing: {e}")
         return pd.DataFrame(), pd.Series(), pd.DataFrame()
 
-def train_and_evaluate_model(all_data):
-    X, y, _ = preprocess_and_add_features(all_data)
-    if X.empty: return None, 0
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
-    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
-    model.fit(X_train, y_train)
-    predictions = model.predict(X_test)
-    accuracy = accuracy_score(y_test, predictions)
-    final_model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1)
-    final_model.fit(X, y)
-    return final_model, accuracy
-
-def run_daily_retraining(engine, data_aggregator):
+def _fit_forest(X, y):
+    """
+    全行で1回だけ学習し、精度は OOB (out-of-bag) で評価する。
+    評価用モデルと最終モデルを別々に学習しない。
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    model = RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=-1, oob_score=True)
+    model.fit(X, y)
+    return model, model.oob_score_
+
+def train_and_evaluate_model(dataset):
+    """
+    training_data.TrainingDataset の学習期間で学習し、後ろの検証期間で精度を測る。
+    検証期間が無い場合は OOB の精度を使う。
+    """
+    X_train, y_train, X_valid, y_valid = dataset.frames()
+    if X_train.empty: return None, 0
+    model, accuracy = _fit_forest(X_train, y_train)
+    if not X_valid.empty:
+        from sklearn.metrics import accuracy_score
+        accuracy = accuracy_score(y_valid, model.predict(X_valid))
+        logging.info(f"Time-split validation accuracy: {accuracy:.3f} on {len(X_valid)} rows (OOB {model.oob_score_:.3f}).")
+    return model, accuracy
+
+def grow_model(model, X_new, y_new):
+    """
+    既存モデルを新しい行で評価してから (test-then-train)、その行で木を追加する。
+    推論中のモデルを書き換えないようコピーに対して学習し、木の数は RETRAIN_MAX_TREES で打ち切る (古い木から捨てる)。
+    """
+    from sklearn.metrics import accuracy_score
+    X_new = X_new[list(model.feature_names_in_)]
+    accuracy = accuracy_score(y_new, model.predict(X_new))
+    model = copy.deepcopy(model)
+    model.set_params(warm_start=True, oob_score=False, n_estimators=len(model.estimators_) + RETRAIN_WARM_TREES)
+    model.fit(X_new, y_new)
+    if len(model.estimators_) > RETRAIN_MAX_TREES:
+        model.estimators_ = model.estimators_[-RETRAIN_MAX_TREES:]
+        model.n_estimators = RETRAIN_MAX_TREES
+    return model, accuracy
+
+
+class FeatureCache:
+    """
+    前回までに読み込んだ特徴量化済みの学習行を保持し、次回は last_ms より新しい行だけを読み込む。
+    (指標のウォームアップは training_data のローダーが前の行を重ねて計算する)
+    保持するのは直近 max_rows 行 (window モードの学習データ) のみ。
+    """
+
+    def __init__(self, path=FEATURE_CACHE_PATH, max_rows=RETRAIN_WINDOW_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self.X = pd.DataFrame()
+        self.y = pd.Series(dtype="int8")
+        self.last_ms = None
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+            self.X, self.y, self.last_ms = state["X"], state["y"], state["last_ms"]
+            logging.info(f"Loaded feature cache: {len(self.X)} rows up to {self.last_ms}.")
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable feature cache {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"X": self.X, "y": self.y, "last_ms": self.last_ms}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Failed to save feature cache: {e}")
+
+    def append(self, X_new, y_new, last_ms):
+        """新しく読み込んだ行をキャッシュに追加する"""
+        if last_ms is not None:
+            self.last_ms = last_ms
+        if X_new.empty:
+            return
+        self.X = pd.concat([self.X, X_new], ignore_index=True).iloc[-self.max_rows:]
+        self.y = pd.concat([self.y, y_new], ignore_index=True).iloc[-self.max_rows:]
+
+
+_feature_cache = None
+
+def run_daily_retraining(engine, data_aggregator, mode=None):
     """1日1回実行されるメインの学習プロセス"""
-    logging.info("🤖 Starting daily AI model retraining process...")
-    all_data = data_aggregator.get_historical_data_for_training()
-    if all_data.empty:
-        logging.error("No data for retraining. Aborting."); return
-    new_model, accuracy = train_and_evaluate_model(all_data)
+    global _feature_cache
+    mode = mode or RETRAIN_MODE
+    started = time.perf_counter()
+    logging.info(f"🤖 Starting daily AI model retraining process (mode={mode})...")
+
+    if mode == "full":
+        dataset = data_aggregator.get_historical_data_for_training()
+        if dataset.empty:
+            logging.error("No data for retraining. Aborting."); return
+        new_model, accuracy = train_and_evaluate_model(dataset)
+    else:
+        if _feature_cache is None:
+            _feature_cache = FeatureCache()
+        since = _feature_cache.last_ms + 1 if _feature_cache.last_ms is not None else None
+        dataset = data_aggregator.get_historical_data_for_training(
+            start_ms=since, validation_fraction=0, max_rows=RETRAIN_WINDOW_ROWS)
+        X_new, y_new, _, _ = dataset.frames()
+        _feature_cache.append(X_new, y_new, dataset.last_ms)
+        logging.info(f"Featurized {len(X_new)} new rows (cache holds {len(_feature_cache.X)}).")
+        if _feature_cache.X.empty:
+            logging.error("No data for retraining. Aborting."); return
+        if X_new.empty:
+            logging.info("No new rows since the last retraining. Keeping the current model."); return
+
+        # 推論用の mmap 版には木を追加できないため、DBの pickle から読み込む
+        from sklearn.ensemble import RandomForestClassifier
+        current = None
+        if mode == "warm_start":
+            registry = get_model_registry(engine)
+            registry.get()
+            current = registry.load_from_db()
+        can_grow = (
+            isinstance(current, RandomForestClassifier)
+            and set(getattr(current, "feature_names_in_", [])) <= set(X_new.columns)
+            and y_new.nunique() == len(current.classes_)
+        )
+        if can_grow:
+            new_model, accuracy = grow_model(current, X_new, y_new)
+        else:
+            new_model, accuracy = _fit_forest(_feature_cache.X, _feature_cache.y)
+        _feature_cache.save()
+
     if new_model:
         save_model_to_db(new_model, engine, accuracy)
-    logging.info("✅ Daily AI model retraining process finished.")
+    logging.info(f"✅ Daily AI model retraining process finished in {time.perf_counter() - started:.1f}s.")
 
 def check_performance_and_retrain_if_needed(engine, data_aggregator, state_manager):
     """現在のモデルのパフォーマンスを評価し, 閾値を下回っていたら再学習をトリガーする"""
@@ -0,0 +1,268 @@
+# model_store.py
+# モデル成果物のファイルストア (メモリマップで読み込む)
+#
+#   <MODEL_STORE_DIR>/<name>/v000012/manifest.json
+#                                    /*.npy          (layout=forest: 木の配列を平坦化したもの)
+#                                    /model.joblib   (layout=joblib: それ以外のモデル)
+#
+# forest レイアウトは RandomForest 等の決定木アンサンブルを全木連結のフラットな NumPy 配列として保存し、
+# np.load(mmap_mode="r") で開く。unpickle しないので起動が速く、同じファイルを開く複数プロセスは
+# 同じ物理ページ (ページキャッシュ) を共有する。推論は MappedForest がその配列上で直接行う。
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", "model_store")
+MANIFEST_FILE = "manifest.json"
+FOREST_ARRAYS = ("children_left", "children_right", "feature", "threshold", "value", "roots")
+PREDICT_CHUNK_ROWS = 2048
+
+
+class MappedForest:
+    """mmap した木の配列だけで predict_proba を行う、RandomForestClassifier 互換の推論器"""
+
+    def __init__(self, arrays, manifest):
+        for key in FOREST_ARRAYS:
+            setattr(self, key, arrays[key])
+        self.classes_ = np.asarray(manifest["classes"])
+        self.n_features_in_ = manifest["n_features"]
+        if manifest.get("feature_names"):
+            self.feature_names_in_ = np.asarray(manifest["feature_names"], dtype=object)
+        self.max_depth = manifest["max_depth"]
+        self.version = manifest["version"]
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def _as_array(self, X):
+        if hasattr(X, "columns") and hasattr(self, "feature_names_in_"):
+            X = X[list(self.feature_names_in_)]
+        # sklearn の木と同じく float32 に丸めてから閾値と比較する
+        return np.asarray(X, dtype=np.float32)
+
+    def _proba_chunk(self, X):
+        n_trees = len(self.roots)
+        node = np.tile(np.asarray(self.roots), len(X))           # (行, 木) を平坦化した現在ノード
+        row = np.repeat(np.arange(len(X)), n_trees)
+        active = np.arange(len(node))                             # まだ葉に達していない要素だけを進める
+        for _ in range(self.max_depth + 1):
+            cur = node[active]
+            left = self.children_left[cur]
+            inner = left != -1
+            active, cur, left = active[inner], cur[inner], left[inner]
+            if len(active) == 0:
+                break
+            go_left = X[row[active], self.feature[cur]] <= self.threshold[cur]
+            node[active] = np.where(go_left, left, self.children_right[cur])
+        return self.value[node].reshape(len(X), n_trees, -1).mean(axis=1)
+
+    def predict_proba(self, X):
+        X = self._as_array(X)
+        if len(X) <= PREDICT_CHUNK_ROWS:
+            return self._proba_chunk(X)
+        return np.vstack([self._proba_chunk(X[i:i + PREDICT_CHUNK_ROWS]) for i in range(0, len(X), PREDICT_CHUNK_ROWS)])
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def _flatten_forest(model):
+    """決定木アンサンブルを全木連結の配列にする。対応外のモデルなら None"""
+    estimators = getattr(model, "estimators_", None)
+    if not estimators or not all(hasattr(e, "tree_") for e in estimators):
+        return None
+    if getattr(model, "n_outputs_", 1) != 1 or not hasattr(model, "classes_"):
+        return None
+
+    left, right, feature, threshold, value, roots = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for est in estimators:
+        tree = est.tree_
+        is_leaf = tree.children_left == -1
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        v = tree.value[:, 0, :]
+        value.append(v / np.maximum(v.sum(axis=1, keepdims=True), 1e-300))
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    arrays = {
+        "children_left": np.concatenate(left).astype(np.int32),
+        "children_right": np.concatenate(right).astype(np.int32),
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "value": np.concatenate(value).astype(np.float64),
+        "roots": np.asarray(roots, dtype=np.int64),
+    }
+    meta = {
+        "classes": np.asarray(model.classes_).tolist(),
+        "n_features": int(model.n_features_in_),
+        "feature_names": [str(f) for f in getattr(model, "feature_names_in_", [])],
+        "max_depth": int(max_depth),
+        "n_estimators": len(estimators),
+        "n_nodes": int(offset),
+    }
+    return arrays, meta
+
+
+def _hash_files(directory, names):
+    digest = hashlib.sha256()
+    for name in sorted(names):
+        digest.update(name.encode())
+        with open(os.path.join(directory, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelArtifactStore:
+    """バージョン付きのモデル成果物を保存し、メモリマップで読み込む"""
+
+    def __init__(self, root=MODEL_STORE_DIR):
+        self.root = root
+        self._loaded = {}  # (name, version) -> model
+        self._lock = threading.Lock()
+
+    def _dir(self, name, version):
+        return os.path.join(self.root, name, f"v{version:06d}")
+
+    def versions(self, name):
+        base = os.path.join(self.root, name)
+        if not os.path.isdir(base):
+            return []
+        return sorted(int(d[1:]) for d in os.listdir(base)
+                      if d.startswith("v") and d[1:].isdigit() and os.path.exists(os.path.join(base, d, MANIFEST_FILE)))
+
+    def latest_version(self, name):
+        versions = self.versions(name)
+        return versions[-1] if versions else None
+
+    def manifest(self, name, version=None):
+        version = version or self.latest_version(name)
+        if version is None:
+            return None
+        path = os.path.join(self._dir(name, version), MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, name, model, version=None, metadata=None):
+        """
+        モデルを新しいバージョンとして書き出す (一時ディレクトリに書いてから rename)。
+        直前のバージョンと内容ハッシュが同じなら書かずにそのマニフェストを返す。
+        """
+        latest = self.latest_version(name)
+        version = version or (latest or 0) + 1
+        final_dir = self._dir(name, version)
+        if os.path.exists(final_dir):
+            raise FileExistsError(final_dir)
+        tmp_dir = f"{final_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            flat = _flatten_forest(model)
+            if flat is not None:
+                arrays, meta = flat
+                files = []
+                for key, arr in arrays.items():
+                    np.save(os.path.join(tmp_dir, f"{key}.npy"), arr)
+                    files.append(f"{key}.npy")
+                layout = "forest"
+            else:
+                import joblib
+                joblib.dump(model, os.path.join(tmp_dir, "model.joblib"))
+                files, meta, layout = ["model.joblib"], {}, "joblib"
+
+            content_hash = _hash_files(tmp_dir, files)
+            if latest is not None:
+                previous = self.manifest(name, latest)
+                if previous and previous.get("content_hash") == content_hash:
+                    shutil.rmtree(tmp_dir)
+                    logging.info(f"Model artifact {name} unchanged (v{latest}), not writing a new version.")
+                    return previous
+
+            manifest = {
+                "name": name,
+                "version": version,
+                "layout": layout,
+                "files": sorted(files),
+                "content_hash": content_hash,
+                "size_bytes": sum(os.path.getsize(os.path.join(tmp_dir, f)) for f in files),
+                "model_class": type(model).__name__,
+                "created_at": int(time.time() * 1000),
+                "metadata": metadata or {},
+                **meta,
+            }
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_dir, final_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logging.info(f"Saved model artifact {name} v{version} ({layout}, {manifest['size_bytes'] / 1e6:.1f}MB).")
+        return manifest
+
+    def verify(self, name, version=None):
+        """ファイル内容がマニフェストのハッシュと一致するか確認する (全ページを読む)"""
+        manifest = self.manifest(name, version)
+        if manifest is None:
+            return False
+        return _hash_files(self._dir(name, manifest["version"]), manifest["files"]) == manifest["content_hash"]
+
+    def retire(self, name, version):
+        """バージョンを使わないようにする。ディレクトリは消さずに退避する (開いている他プロセスの mmap はそのまま読める)"""
+        directory = self._dir(name, version)
+        with self._lock:
+            self._loaded.pop((name, version), None)
+            if os.path.exists(directory):
+                os.replace(directory, f"{directory}.retired-{int(time.time() * 1000)}")
+                logging.info(f"Retired model artifact {name} v{version}.")
+
+    def load(self, name, version=None, verify=False):
+        """成果物を読み込む。同じバージョンはプロセス内で1度だけ開く"""
+        version = version or self.latest_version(name)
+        if version is None:
+            return None
+        key = (name, version)
+        model = self._loaded.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._loaded.get(key)
+            if model is not None:
+                return model
+            manifest = self.manifest(name, version)
+            if manifest is None:
+                return None
+            if verify and not self.verify(name, version):
+                raise ValueError(f"Content hash mismatch for model artifact {name} v{version}")
+
+            directory = self._dir(name, version)
+            if manifest["layout"] == "forest":
+                arrays = {key_: np.load(os.path.join(directory, f"{key_}.npy"), mmap_mode="r") for key_ in FOREST_ARRAYS}
+                model = MappedForest(arrays, manifest)
+            else:
+                import joblib
+                model = joblib.load(os.path.join(directory, "model.joblib"), mmap_mode="r")
+            self._loaded[key] = model
+        return model
+
+
+_store = None
+
+def get_artifact_store():
+    global _store
+    if _store is None:
+        _store = ModelArtifactStore()
+    return _store
@@ -1,54 +1,215 @@
 import os
+import hashlib
 import logging
-import requests
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import feedparser
-from googletrans import Translator
 
-translator = Translator()
+import database
+from response_cache import cached_get, get_response_cache
 
-def get_latest_news():
-    """英語(NewsAPI) + 日本語(RSS) ニュースをまとめて取得"""
+NEWSAPI_URL = "https://newsapi.org/v2/everything?q=cryptocurrency&language=en&sortBy=publishedAt&pageSize=5&apiKey={api_key}"
+RSS_FEEDS = {
+    "CoinPost": "https://coinpost.jp/?feed=rss2",
+    "CryptoTimes": "https://crypto-times.jp/feed/"
+}
+ARTICLES_PER_SOURCE = 5
+TRANSLATION_SEPARATOR = "\n"  # 見出しを改行でつないで1回の翻訳リクエストにする
+
+# 同じ本文の RSS は解析し直さない (url -> (本文のハッシュ, entries))
+_parsed_feeds = {}
+_schema_ready = None  # None: 未実行 / True: 作成済み / False: 失敗 (このプロセスでは保存しない)
+_schema_lock = threading.Lock()
+_translator = None
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def get_translator():
+    """googletrans の Translator は初回の翻訳時に作る (import 時に作らない)"""
+    global _translator
+    if _translator is None:
+        from googletrans import Translator
+        _translator = Translator()
+    return _translator
+
+
+def _connect():
+    """
+    保存・翻訳キャッシュ用の接続。スキーマの作成 (旧スキーマの移行を含む) はプロセスで1回だけ行い、
+    失敗していれば None を返す (ニュースの取得自体は続ける)
+    """
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready is None:
+            try:
+                conn = sqlite3.connect(database.DB_FILE, timeout=30)
+                try:
+                    database.ensure_schema(conn)
+                finally:
+                    conn.close()
+                _schema_ready = True
+            except Exception as e:
+                logging.error(f"News storage disabled, could not prepare the database: {e}")
+                _schema_ready = False
+    if not _schema_ready:
+        return None
+    return sqlite3.connect(database.DB_FILE, timeout=30)
+
+
+def _fetch_newsapi(api_key):
+    resp = cached_get(NEWSAPI_URL.format(api_key=api_key), timeout=10)
+    resp.raise_for_status()
     articles = []
+    for a in resp.json().get("articles", []):
+        articles.append({
+            "lang": "en",
+            "title_en": a.get("title", ""),
+            "source": a.get("source", {}).get("name"),
+            "url": a.get("url"),
+            "publishedAt": a.get("publishedAt")
+        })
+    return articles
 
-    # --- 英語ニュース (NewsAPI) ---
-    api_key = os.getenv("NEWSAPI_KEY")
-    if api_key:
+
+def _fetch_rss(source, url):
+    # 条件付き GET (ETag/Last-Modified) で取得し、変化が無ければキャッシュした本文を解析する
+    resp = cached_get(url, timeout=10)
+    resp.raise_for_status()
+    digest = hashlib.sha1(resp.content).hexdigest()
+    cached = _parsed_feeds.get(url)
+    if cached is None or cached[0] != digest:
+        cached = _parsed_feeds[url] = (digest, feedparser.parse(resp.content).entries)
+    return [{
+        "lang": "ja",
+        "title": entry.title,
+        "source": source,
+        "url": entry.link,
+        "publishedAt": entry.get("published", "")
+    } for entry in cached[1][:ARTICLES_PER_SOURCE]]
+
+
+def translate_titles(conn, titles, src="en", dest="ja"):
+    """
+    見出しを翻訳する。translation_cache に無いものだけを改行でつないで1回で翻訳し、結果を保存する。
+    conn が None ならキャッシュを使わずに翻訳する。キャッシュの読み書きに失敗しても翻訳は返す。
+    """
+    keys = {t: _hash(f"{src}:{dest}:{t}") for t in set(titles) if t}
+    result = {}
+    if keys and conn is not None:
+        placeholders = ",".join("?" * len(keys))
         try:
-            url = f"https://newsapi.org/v2/everything?q=cryptocurrency&language=en&sortBy=publishedAt&pageSize=5&apiKey={api_key}"
-            resp = requests.get(url, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            for a in data.get("articles", []):
-                title_en = a.get("title", "")
-                translated = translator.translate(title_en, src="en", dest="ja").text if title_en else ""
-                articles.append({
-                    "lang": "en",
-                    "title_en": title_en,
-                    "title_ja": translated,
-                    "source": a.get("source", {}).get("name"),
-                    "url": a.get("url"),
-                    "publishedAt": a.get("publishedAt")
-                })
+            found = dict(conn.execute(
+                f"SELECT text_hash, translated FROM translation_cache WHERE text_hash IN ({placeholders})", list(keys.values())
+            ))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read translation cache: {e}")
+            found = {}
+        result = {t: found[k] for t, k in keys.items() if k in found}
+
+    unseen = [t for t in keys if t not in result]
+    if unseen:
+        lines = [" ".join(t.split()) for t in unseen]  # 改行を含む見出しは区切りと混ざらないよう1行にする
+        try:
+            translator = get_translator()
+            translated = translator.translate(TRANSLATION_SEPARATOR.join(lines), src=src, dest=dest).text.split(TRANSLATION_SEPARATOR)
+            if len(translated) != len(lines):
+                # 行数が合わない場合だけ1件ずつ翻訳する
+                translated = [r.text for r in translator.translate(lines, src=src, dest=dest)]
         except Exception as e:
-            logging.error(f"Failed to fetch NewsAPI news: {e}")
-
-    # --- 日本語ニュース (CoinPost, CryptoTimes RSS) ---
-    rss_feeds = {
-        "CoinPost": "https://coinpost.jp/?feed=rss2",
-        "CryptoTimes": "https://crypto-times.jp/feed/"
-    }
-    for source, url in rss_feeds.items():
+            logging.error(f"Failed to translate {len(unseen)} titles: {e}")
+            translated = None
+        if translated is not None:
+            now = database.now_ms()
+            new = {t: tr.strip() for t, tr in zip(unseen, translated)}
+            if conn is not None:
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO translation_cache (text_hash, translated, created_at) VALUES (?, ?, ?)",
+                            [(keys[t], tr, now) for t, tr in new.items()]
+                        )
+                except sqlite3.Error as e:
+                    logging.error(f"Failed to save {len(new)} translations: {e}")
+            result.update(new)
+    return result
+
+
+def _store_articles(conn, articles):
+    """未登録の記事だけを news_articles に保存する。新しい記事が無ければ書き込まない。戻り値: 新しく保存した件数"""
+    hashes = {_hash(a["url"]): a for a in articles}
+    if not hashes:
+        return 0
+    placeholders = ",".join("?" * len(hashes))
+    known = {row[0] for row in conn.execute(
+        f"SELECT url_hash FROM news_articles WHERE url_hash IN ({placeholders})", list(hashes)
+    )}
+    new = [(h, a) for h, a in hashes.items() if h not in known]
+    if not new:
+        return 0
+    now = database.now_ms()
+    with conn:
+        cursor = conn.executemany(
+            "INSERT OR IGNORE INTO news_articles (url_hash, url, source, lang, title, title_ja, published_at, first_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(h, a["url"], a["source"], a["lang"], a.get("title_en") or a.get("title"),
+              a.get("title_ja") if a["lang"] == "en" else a.get("title"), a["publishedAt"], now) for h, a in new]
+        )
+    return cursor.rowcount
+
+
+def get_latest_news():
+    """英語(NewsAPI) + 日本語(RSS) ニュースをまとめて取得"""
+    started = time.perf_counter()
+    api_key = os.getenv("NEWSAPI_KEY")
+    jobs = [("NewsAPI", _fetch_newsapi, (api_key,))] if api_key else []
+    jobs += [(source, _fetch_rss, (source, url)) for source, url in RSS_FEEDS.items()]
+
+    # --- 全ソースを並列に取得 (英語ニュース → 日本語ニュースの順に並べる) ---
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [(source, pool.submit(fetch, *args)) for source, fetch, args in jobs]
+    articles, seen = [], set()
+    for source, future in futures:
         try:
-            feed = feedparser.parse(url)
-            for entry in feed.entries[:5]:
-                articles.append({
-                    "lang": "ja",
-                    "title": entry.title,
-                    "source": source,
-                    "url": entry.link,
-                    "publishedAt": entry.get("published", "")
-                })
+            batch = future.result()
         except Exception as e:
-            logging.error(f"Failed to fetch RSS ({source}): {e}")
+            logging.error(f"Failed to fetch news ({source}): {e}")
+            continue
+        for article in batch:
+            key = _hash(article.get("url") or article.get("title_en") or article.get("title") or "")
+            if key not in seen:  # URL のハッシュで重複排除
+                seen.add(key)
+                articles.append(article)
+
+    english = [a for a in articles if a["lang"] == "en"]
+    # 保存と翻訳キャッシュは付加的なもの。DB で失敗しても取得した記事は返す
+    new_count = 0
+    conn = None
+    try:
+        conn = _connect()
+    except Exception as e:
+        logging.error(f"Failed to open news storage: {e}")
+    try:
+        if english:
+            translations = translate_titles(conn, [a["title_en"] for a in english])
+            for a in english:
+                a["title_ja"] = translations.get(a["title_en"], "")
+        # 見出しキーの順序は従来の出力と同じにする
+        articles = [{"lang": "en", "title_en": a["title_en"], "title_ja": a.get("title_ja", ""), "source": a["source"],
+                     "url": a["url"], "publishedAt": a["publishedAt"]} if a["lang"] == "en" else a for a in articles]
+        if conn is not None:
+            new_count = _store_articles(conn, [a for a in articles if a.get("url")])
+    except Exception as e:
+        logging.error(f"Failed to store news articles: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
 
+    logging.info(f"News: {len(articles)} articles ({new_count} new) in {(time.perf_counter() - started) * 1000:.0f}ms.")
+    get_response_cache().log_stats()
     return articles
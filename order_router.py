@@ -0,0 +1,219 @@
+# order_router.py
+# 非同期の注文ルーター
+#  - 専用スレッドの asyncio ループで ccxt.async_support のクライアントを動かし、複数の注文を同時に送る
+#    (一斉決済は銘柄ごとに並列、同じ銘柄の複数注文は取引所の一括注文 (createOrders) にまとめる)
+#  - 注文には決定的な clientOrderId を付ける。同じ意図の注文は再試行しても同じ ID になるので、
+#    タイムアウト後の再送で二重発注にならない (再送前に ID で照会し、重複エラーも既存の注文として扱う)
+#  - レバレッジは銘柄ごとに設定済みの値をキャッシュし、変わるときだけ set_leverage を呼ぶ
+#  - 呼び出し側は同期のまま: place() は全注文の結果がそろうまで待って返す
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from exchange_registry import get_exchange_registry
+
+ORDER_TIMEOUT_SEC = float(os.getenv("ORDER_TIMEOUT_SEC", "30"))
+ORDER_MAX_RETRIES = int(os.getenv("ORDER_MAX_RETRIES", "2"))
+ORDER_INTENT_WINDOW_SEC = 60  # 新規注文の ID はこの時間枠ごとに変わる (同じ枠内の再試行は同じ ID)
+# Bitget の先物注文は 10回/秒 (UID)。ccxt の place-order のコストは 2 なので、20 トークンで 10 件を一度に送れる
+ORDER_BURST_TOKENS = float(os.getenv("ORDER_BURST_TOKENS", "20"))
+CLIENT_ID_PREFIX = "ts"
+
+
+def client_order_id(symbol, action, side, key):
+    """同じ (銘柄, 新規/決済, 売買, 意図のキー) からは常に同じ ID を作る"""
+    digest = hashlib.sha1(f"{symbol}|{action}|{side}|{key}".encode()).hexdigest()
+    return f"{CLIENT_ID_PREFIX}{digest[:30]}"
+
+
+class OrderRequest:
+    """成行注文1件。reduce_only の注文は決済、leverage を指定すると送信前にそろえる"""
+
+    def __init__(self, symbol, side, amount, reduce_only=False, leverage=None, client_id=None, intent=None):
+        self.symbol = symbol
+        self.side = side  # "buy" / "sell"
+        self.amount = amount
+        self.reduce_only = reduce_only
+        self.leverage = leverage
+        action = "close" if reduce_only else "open"
+        if intent is None:
+            intent = int(time.time() // ORDER_INTENT_WINDOW_SEC)
+        self.client_id = client_id or client_order_id(symbol, action, side, intent)
+
+    @property
+    def params(self):
+        params = {"clientOrderId": self.client_id}
+        if self.reduce_only:
+            params["reduceOnly"] = True
+        return params
+
+
+def _is_retryable(error):
+    import ccxt
+    return isinstance(error, ccxt.NetworkError)  # RequestTimeout / ExchangeNotAvailable / DDoSProtection を含む
+
+
+def _is_duplicate(error):
+    """同じ clientOrderId の注文が既にある、というエラーか"""
+    text = str(error).lower()
+    return type(error).__name__ == "DuplicateOrderId" or (
+        "client" in text and any(w in text for w in ("duplicate", "exist", "repeat")))
+
+
+class OrderRouter:
+    """専用スレッドのイベントループで注文を送る。place() / submit() はどのスレッドからでも呼べる"""
+
+    def __init__(self, account="futures", market_type="swap"):
+        self.account = account
+        self.market_type = market_type
+        self._loop = None
+        self._thread = None
+        self._exchange = None
+        self._leverage = {}  # symbol -> 設定済みのレバレッジ
+        self._lock = threading.Lock()
+        self.stats = {"orders": 0, "batches": 0, "retries": 0, "deduplicated": 0, "leverage_calls": 0,
+                      "leverage_skipped": 0, "errors": 0}
+
+    # --- ワーカー ---
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="order-router", daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def _client(self):
+        # ループのスレッド内で作る (async クライアントは作成したループに結びつく)
+        if self._exchange is None:
+            self._exchange = get_exchange_registry().create_async_client(
+                self.account, self.market_type, tokenBucket={"capacity": ORDER_BURST_TOKENS, "tokens": ORDER_BURST_TOKENS})
+        return self._exchange
+
+    def submit(self, requests):
+        """注文をワーカーに渡し、concurrent.futures.Future (結果は requests と同じ順のリスト) を返す"""
+        return asyncio.run_coroutine_threadsafe(self._execute(list(requests)), self._ensure_started())
+
+    def place(self, requests, timeout=ORDER_TIMEOUT_SEC):
+        """全注文を同時に送り、結果のリストを返す。各要素は ccxt の order か {"error": ...}"""
+        requests = list(requests)
+        if not requests:
+            return []
+        return self.submit(requests).result(timeout=timeout + 5)
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._exchange is not None:
+            asyncio.run_coroutine_threadsafe(self._exchange.close(), self._loop).result(timeout=10)
+            self._exchange = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop = self._thread = None
+
+    # --- 注文の実行 (ワーカーのループ内) ---
+    async def _execute(self, requests):
+        exchange = self._client()
+        started = time.perf_counter()
+        by_symbol = {}
+        for i, req in enumerate(requests):
+            by_symbol.setdefault(req.symbol, []).append(i)
+
+        async def run_symbol(indices):
+            reqs = [requests[i] for i in indices]
+            try:
+                await self._ensure_leverage(exchange, reqs)
+            except Exception as e:
+                return [(i, {"error": f"set_leverage failed: {e}"}) for i in indices]
+            if len(reqs) > 1 and exchange.has.get("createOrders"):
+                results = await self._place_batch(exchange, reqs)
+            else:
+                results = await asyncio.gather(*(self._place_one(exchange, r) for r in reqs))
+            return list(zip(indices, results))
+
+        results = [None] * len(requests)
+        for group in await asyncio.gather(*(run_symbol(ix) for ix in by_symbol.values())):
+            for i, result in group:
+                results[i] = result
+        failed = sum(1 for r in results if "error" in r)
+        logging.info(f"Order router: {len(requests)} orders over {len(by_symbol)} symbols in "
+                     f"{(time.perf_counter() - started) * 1000:.0f}ms ({failed} failed).")
+        return results
+
+    async def _ensure_leverage(self, exchange, reqs):
+        leverage = next((r.leverage for r in reqs if r.leverage and not r.reduce_only), None)
+        if leverage is None:
+            return
+        symbol = reqs[0].symbol
+        if self._leverage.get(symbol) == leverage:
+            self.stats["leverage_skipped"] += 1
+            return
+        await exchange.set_leverage(leverage, symbol)
+        self.stats["leverage_calls"] += 1
+        self._leverage[symbol] = leverage
+
+    async def _find(self, exchange, req):
+        """clientOrderId で既存の注文を探す (無ければ None)"""
+        try:
+            return await exchange.fetch_order(None, req.symbol, {"clientOrderId": req.client_id})
+        except Exception:
+            return None
+
+    async def _place_one(self, exchange, req):
+        for attempt in range(ORDER_MAX_RETRIES + 1):
+            try:
+                if attempt:
+                    # 前回の送信が届いていたら再送しない
+                    existing = await self._find(exchange, req)
+                    if existing:
+                        self.stats["deduplicated"] += 1
+                        return existing
+                self.stats["orders"] += 1
+                return await exchange.create_order(req.symbol, "market", req.side, req.amount, None, req.params)
+            except Exception as e:
+                if _is_duplicate(e):
+                    self.stats["deduplicated"] += 1
+                    existing = await self._find(exchange, req)
+                    if existing:
+                        return existing
+                    return {"error": f"duplicate clientOrderId but order not found: {e}", "clientOrderId": req.client_id}
+                if not _is_retryable(e) or attempt == ORDER_MAX_RETRIES:
+                    self.stats["errors"] += 1
+                    logging.error(f"Order {req.side} {req.amount} {req.symbol} ({req.client_id}) failed: {e}")
+                    return {"error": str(e), "clientOrderId": req.client_id}
+                self.stats["retries"] += 1
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def _place_batch(self, exchange, reqs):
+        """同じ銘柄の注文を一括注文で送る。一括が失敗したら1件ずつの経路 (同じ ID) に切り替える"""
+        orders = [{"symbol": r.symbol, "type": "market", "side": r.side, "amount": r.amount, "params": r.params}
+                  for r in reqs]
+        try:
+            self.stats["batches"] += 1
+            self.stats["orders"] += len(reqs)
+            placed = await exchange.create_orders(orders)
+        except Exception as e:
+            logging.warning(f"Batch order for {reqs[0].symbol} failed ({e}), sending individually.")
+            return await asyncio.gather(*(self._place_one(exchange, r) for r in reqs))
+        results = []
+        for req, order in zip(reqs, placed):
+            if order.get("id") is None and order.get("status") != "closed":
+                results.append(await self._place_one(exchange, req))  # 一括の中で弾かれた注文だけ送り直す
+            else:
+                results.append(order)
+        return results
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_order_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = OrderRouter()
+        return _router
@@ -0,0 +1,297 @@
+# profiler.py
+# 稼働中のプロセスを再起動せずにプロファイルする (main.py の /profile エンドポイントから操作する)
+#  - arm() で次の N サイクルか T 秒だけ有効にする。終わると自動で解除され、結果は last_result() に残る
+#  - cprofile: run_cycle を cProfile で決定的に測る (サイクル中だけ有効、複数サイクルは合算)。
+#    Python 3.11 まではサイクルを回すスレッドだけ、3.12 以降 (sys.monitoring) は全スレッドが対象になる。
+#    結果は pstats の表と、snakeviz / flameprof などで読める .prof (marshal した stats)
+#  - sampling: 別スレッドが一定間隔で sys._current_frames() から全スレッドのスタックを取り、
+#    "スレッド;関数;関数 回数" の collapsed 形式 (flamegraph.pl / speedscope にそのまま渡せる) に数える。
+#    関数ごとの self / total のサンプル数の表も作る
+#  - 解除中のコストは run_cycle 1回につき属性を1回見るだけ (@profile_cycles)。
+#    有効中も時間・サイクル数・スタックの種類に上限があり、sampling は自分の消費時間を overhead として報告する
+#  - 状態はプロセスごと (gunicorn の複数ワーカーではワーカーごとに別)
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))
+PROFILE_MAX_CYCLES = int(os.getenv("PROFILE_MAX_CYCLES", "10"))
+PROFILE_MAX_STACKS = 20000  # これを超えた種類のスタックは "[other]" にまとめる
+PROFILE_TOP_N = 40          # 表に出す関数の数
+MODES = ("cprofile", "sampling")
+MIN_INTERVAL_MS = 1.0
+
+
+def _label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Sampler(threading.Thread):
+    """interval ごとに自分以外の全スレッドのスタックを数える。deadline を過ぎたら on_deadline を呼んで終わる"""
+
+    def __init__(self, interval, deadline=None, on_deadline=None):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval = interval
+        self.deadline = deadline
+        self.on_deadline = on_deadline
+        self.counts = Counter()  # (スレッド名, (code, ...) 外側から) -> 回数
+        self.samples = 0
+        self.busy_sec = 0.0
+        self.started = self.stopped = None
+        self._halt = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        self.started = next_at = time.perf_counter()
+        while not self._halt.is_set():
+            t0 = time.perf_counter()
+            if self.deadline is not None and t0 >= self.deadline:
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                key = (names.get(ident, f"thread-{ident}"), tuple(reversed(codes)))
+                if key in self.counts or len(self.counts) < PROFILE_MAX_STACKS:
+                    self.counts[key] += 1
+                else:
+                    self.counts[(key[0], ())] += 1
+            self.samples += 1
+            done = time.perf_counter()
+            self.busy_sec += done - t0
+            # 取りこぼした分は詰めて取り直さない (サンプリングが間に合わないときに負荷を上げない)
+            next_at = max(next_at + self.interval, done)
+            self._halt.wait(next_at - done)
+        self.stopped = time.perf_counter()
+        if not self._halt.is_set() and self.on_deadline:
+            self.on_deadline()
+
+    def stop(self):
+        self._halt.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout=5)
+
+    def collapsed(self):
+        lines = []
+        for (thread, codes), n in self.counts.most_common():
+            frames = [thread] + ([_label(c) for c in codes] if codes else ["[other]"])
+            lines.append(f"{';'.join(f.replace(';', ',') for f in frames)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=PROFILE_TOP_N):
+        """関数ごとの self (スタックの先頭) と total (スタックのどこかにある) のサンプル数の表"""
+        own, total = Counter(), Counter()
+        for (_, codes), n in self.counts.items():
+            if not codes:
+                continue
+            own[codes[-1]] += n
+            for code in set(codes):
+                total[code] += n
+        samples = max(sum(self.counts.values()), 1)
+        lines = [f"{self.samples} samples of {len({t for t, _ in self.counts})} threads, "
+                 f"{sum(self.counts.values())} stacks",
+                 f"{'self':>8}{'self%':>8}{'total':>8}{'total%':>8}  function"]
+        for code, n in total.most_common(top):
+            lines.append(f"{own[code]:>8}{own[code] / samples:>8.1%}{n:>8}{n / samples:>8.1%}  {_label(code)}")
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """プロファイルのセッションを1つだけ持つ。arm() / disarm() / status() はどのスレッドからでも呼べる"""
+
+    def __init__(self):
+        self.session = None  # 解除中は None (profile_cycles はここだけを見る)
+        self._last = None
+        self._lock = threading.Lock()
+
+    # --- 操作 ---
+    def arm(self, mode="sampling", cycles=None, seconds=None, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        """
+        次の cycles サイクルか seconds 秒 (両方なら先に来た方) だけ有効にする。どちらも無ければ1サイクル。
+        sampling で cycles を指定したときは次のサイクルの開始から測る (seconds だけならすぐに始める)。
+        cprofile はサイクル中だけ動くので、seconds はサイクルの終わりで判定する。
+        既に有効なら RuntimeError、引数がおかしければ ValueError
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if cycles is None and seconds is None:
+            cycles = 1
+        if cycles is not None and not 1 <= cycles <= PROFILE_MAX_CYCLES:
+            raise ValueError(f"cycles must be between 1 and {PROFILE_MAX_CYCLES}")
+        if seconds is not None and not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}")
+        if mode == "cprofile" and cycles is None:
+            cycles = PROFILE_MAX_CYCLES
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("profiler is already armed")
+            session = {
+                "mode": mode, "cycles": cycles, "seconds": seconds,
+                "interval_ms": max(float(interval_ms), MIN_INTERVAL_MS),
+                "armed_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "started": None, "cycles_done": 0, "in_cycle": False, "profile": None, "sampler": None,
+            }
+            self.session = session
+            if mode == "sampling" and cycles is None:
+                self._start(session)
+        logging.info(f"Profiler armed: mode={mode} cycles={cycles} seconds={seconds}")
+        return self.status()
+
+    def disarm(self):
+        """途中でも止めて、そこまでの結果を残す。cprofile でサイクルの途中なら、そのサイクルの終わりで止める"""
+        with self._lock:
+            session = self.session
+            if session is None:
+                return self.status()
+            if session["mode"] == "cprofile" and session["in_cycle"]:
+                # cProfile は有効にしたスレッド (サイクルを回しているスレッド) で止める
+                session["cycles"] = session["cycles_done"] + 1
+                session["outcome"] = "disarmed"
+                return self.status()
+            self.session = None
+        self._finish(session, "disarmed")
+        return self.status()
+
+    def status(self):
+        session = self.session
+        last = self._last
+        return {
+            "armed": session is not None,
+            "session": None if session is None else {
+                k: session[k] for k in ("mode", "cycles", "seconds", "interval_ms", "armed_at", "cycles_done")
+            } | {"running": session["started"] is not None},
+            "last": None if last is None else {k: v for k, v in last.items() if k not in ("collapsed", "pstats", "prof")},
+        }
+
+    def last_result(self):
+        return self._last
+
+    # --- サイクル (profile_cycles から呼ぶ) ---
+    def before_cycle(self):
+        """有効ならサイクルの計測を始めてセッションを返す (解除中は None)"""
+        with self._lock:
+            session = self.session
+            if session is None:
+                return None
+            if session["started"] is None:
+                self._start(session)
+            session["in_cycle"] = True
+        if session["mode"] == "cprofile":
+            try:
+                session["profile"].enable()
+            except ValueError as e:  # 別のプロファイラが動いている
+                logging.warning(f"Profiler could not start cProfile: {e}")
+                with self._lock:
+                    if self.session is not session:
+                        return None
+                    self.session = None
+                self._finish(session, f"error: {e}")
+                return None
+        return session
+
+    def after_cycle(self, session):
+        if session is None:
+            return
+        if session["mode"] == "cprofile":
+            session["profile"].disable()
+        with self._lock:
+            session["in_cycle"] = False
+            session["cycles_done"] += 1
+            if self.session is not session:
+                return
+            expired = session["seconds"] is not None and time.perf_counter() - session["started"] >= session["seconds"]
+            if not expired and session["cycles_done"] < (session["cycles"] or float("inf")):
+                return
+            self.session = None
+        self._finish(session, session.get("outcome", "completed"))
+
+    # --- 内部 ---
+    def _start(self, session):
+        session["started"] = time.perf_counter()
+        if session["mode"] == "cprofile":
+            import cProfile
+            session["profile"] = cProfile.Profile()
+        else:
+            deadline = session["started"] + (session["seconds"] or PROFILE_MAX_SECONDS)
+            sampler = _Sampler(session["interval_ms"] / 1000, deadline, lambda: self._on_deadline(session))
+            session["sampler"] = sampler
+            sampler.start()
+
+    def _on_deadline(self, session):
+        with self._lock:
+            if self.session is not session:
+                return
+            self.session = None
+        self._finish(session, "completed")
+
+    def _finish(self, session, outcome):
+        """session (既に self.session から外したもの) の結果を作って last_result() に残す"""
+        duration = time.perf_counter() - session["started"] if session["started"] is not None else 0.0
+        result = {
+            "mode": session["mode"], "outcome": outcome, "armed_at": session["armed_at"],
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "duration_sec": round(duration, 3), "cycles": session["cycles_done"],
+            "collapsed": None, "pstats": None, "prof": None,
+        }
+        if session["profile"] is not None:
+            import io
+            import marshal
+            import pstats
+            profile = session["profile"]
+            profile.create_stats()
+            # pstats.Stats(profile) は profile.stats を取り出して空にするので、先に .prof の形にしておく
+            result["prof"] = marshal.dumps(profile.stats)
+            out = io.StringIO()
+            if profile.stats:
+                pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+            result["pstats"] = out.getvalue()
+        elif session["sampler"] is not None:
+            sampler = session["sampler"]
+            sampler.stop()
+            wall = (sampler.stopped or time.perf_counter()) - (sampler.started or time.perf_counter())
+            result.update({
+                "samples": sampler.samples, "interval_ms": session["interval_ms"],
+                "overhead_pct": round(sampler.busy_sec / wall * 100, 2) if wall > 0 else 0.0,
+                "collapsed": sampler.collapsed(), "pstats": sampler.summary(),
+            })
+        self._last = result
+        logging.info(f"Profiler {outcome}: mode={result['mode']} {result['duration_sec']:.1f}s, {result['cycles']} cycles"
+                     + (f", {result['samples']} samples ({result['overhead_pct']}% overhead)" if "samples" in result else ""))
+        return result
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler()
+        return _profiler
+
+
+def profile_cycles(func):
+    """run_cycle に付けるデコレーター。解除中は属性を1回見るだけで func をそのまま呼ぶ"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None or profiler.session is None:
+            return func(*args, **kwargs)
+        session = profiler.before_cycle()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.after_cycle(session)
+    return wrapper
@@ -0,0 +1,284 @@
+# response_cache.py
+# 公開 API 用の HTTP レスポンスキャッシュ (条件付きリクエスト)
+#  - メモリの LRU (バイト数で上限) + SQLite のディスクストア。再起動後も ETag/Last-Modified を使い回す
+#  - 鮮度 = max(Cache-Control max-age (または Expires) - Age, エンドポイントごとの最小再取得間隔)
+#    鮮度内ならネットワークに出ない。切れたら If-None-Match / If-Modified-Since を付けて再検証し、304 なら本文を再利用する
+#  - no-store は保存しない。キーは URL + パラメータのハッシュ (API キーを含む URL をそのまま保存しない)
+#  - requests 用の cached_get() と、http_client.AsyncHttpClient(cache=...) の両方から使う
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+HTTP_CACHE_FILE = os.getenv("HTTP_CACHE_FILE", "http_cache.db")
+HTTP_CACHE_MEMORY_MB = float(os.getenv("HTTP_CACHE_MEMORY_MB", "32"))
+HTTP_CACHE_DISK_MB = float(os.getenv("HTTP_CACHE_DISK_MB", "256"))
+PRUNE_EVERY_STORES = 200
+
+# (ホスト + パスの接頭辞) -> 最小再取得間隔 (秒)。最も長く一致した接頭辞を使う
+MIN_REFRESH_SEC = {
+    "api.dexscreener.com/latest/dex/pairs": 30,
+    "api.dexscreener.com/latest/dex/ohlcv": 60,
+    "api.coingecko.com/api/v3/coins/": 300,          # market_chart
+    "api.coingecko.com/api/v3/search/trending": 600,
+    "api.alternative.me/fng": 3600,
+    "newsapi.org": 900,
+    "coinpost.jp": 300,
+    "crypto-times.jp": 300,
+}
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires")
+
+
+def cache_key(url, params=None):
+    if params:
+        url = f"{url}{'&' if '?' in url else '?'}{urlencode(sorted(params.items()))}"
+    return url, hashlib.sha256(url.encode()).hexdigest()
+
+
+def min_refresh_sec(url):
+    parts = urlsplit(url)
+    target = f"{parts.netloc}{parts.path}"
+    matches = [p for p in MIN_REFRESH_SEC if target.startswith(p)]
+    return MIN_REFRESH_SEC[max(matches, key=len)] if matches else 0
+
+
+def _cache_control(headers):
+    directives = {}
+    for part in (headers.get("Cache-Control") or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def freshness_sec(url, headers, now=None):
+    """レスポンスヘッダとエンドポイントの最小間隔から、再取得なしで使える秒数を決める"""
+    directives = _cache_control(headers)
+    lifetime = 0.0
+    if "no-cache" not in directives:
+        if directives.get("max-age", "").isdigit():
+            lifetime = float(directives["max-age"])
+        elif headers.get("Expires"):
+            try:
+                lifetime = parsedate_to_datetime(headers["Expires"]).timestamp() - (now or time.time())
+            except (TypeError, ValueError):
+                lifetime = 0.0
+        age = headers.get("Age")
+        lifetime -= float(age) if age and age.isdigit() else 0.0
+    return max(lifetime, float(min_refresh_sec(url)))
+
+
+class CacheEntry:
+    def __init__(self, key, headers, body, stored_at, expires_at):
+        self.key = key
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def conditional_headers(self):
+        headers = {}
+        if self.headers.get("ETag"):
+            headers["If-None-Match"] = self.headers["ETag"]
+        if self.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        elif not headers:
+            headers["If-Modified-Since"] = formatdate(self.stored_at, usegmt=True)
+        return headers
+
+
+class ResponseCache:
+    """メモリ LRU + SQLite の2段キャッシュ。ヒット率と節約したバイト数を集計する"""
+
+    def __init__(self, path=HTTP_CACHE_FILE, memory_mb=HTTP_CACHE_MEMORY_MB, disk_mb=HTTP_CACHE_DISK_MB):
+        self.path = path
+        self.memory_limit = int(memory_mb * 1e6)
+        self.disk_limit = int(disk_mb * 1e6)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self._conn = None
+        self._stores = 0
+        self.stats = {"fresh_hits": 0, "revalidated": 0, "misses": 0, "bytes_saved": 0, "bytes_downloaded": 0}
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, headers TEXT NOT NULL, body BLOB NOT NULL, "
+                "stored_at REAL NOT NULL, expires_at REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_stored_at ON responses (stored_at)")
+        return self._conn
+
+    def _remember(self, entry):
+        old = self._memory.pop(entry.key, None)
+        if old is not None:
+            self._memory_bytes -= old.size
+        if entry.size > self.memory_limit:
+            return
+        self._memory[entry.key] = entry
+        self._memory_bytes += entry.size
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+            row = self._db().execute(
+                "SELECT headers, body, stored_at, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = CacheEntry(key, CaseInsensitiveDict(json.loads(row[0])), bytes(row[1]), row[2], row[3])
+            self._remember(entry)
+            return entry
+
+    def put(self, key, url, headers, body):
+        """200 のレスポンスを保存する。no-store なら何もしない"""
+        if "no-store" in _cache_control(headers):
+            return None
+        now = time.time()
+        kept = CaseInsensitiveDict({h: headers[h] for h in STORED_HEADERS if headers.get(h)})
+        entry = CacheEntry(key, kept, bytes(body), now, now + freshness_sec(url, headers, now))
+        with self._lock:
+            self._remember(entry)
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, headers, body, stored_at, expires_at, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(dict(kept)), entry.body, entry.stored_at, entry.expires_at, entry.size),
+            )
+            db.commit()
+            self._stores += 1
+            if self._stores % PRUNE_EVERY_STORES == 0:
+                self.prune()
+        return entry
+
+    def refresh(self, entry, url, headers):
+        """304 を受けたとき: 新しいヘッダで鮮度を更新し、本文はそのまま使う"""
+        now = time.time()
+        for h in STORED_HEADERS:
+            if headers.get(h):
+                entry.headers[h] = headers[h]
+        entry.stored_at = now
+        entry.expires_at = now + freshness_sec(url, entry.headers, now)
+        with self._lock:
+            self._remember(entry)
+            db = self._db()
+            db.execute("UPDATE responses SET headers = ?, stored_at = ?, expires_at = ? WHERE key = ?",
+                       (json.dumps(dict(entry.headers)), entry.stored_at, entry.expires_at, entry.key))
+            db.commit()
+        return entry
+
+    def prune(self):
+        """ディスク上の合計が上限を超えたら古い順に消す"""
+        with self._lock:
+            db = self._db()
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.disk_limit:
+                return
+            excess, doomed = total - int(self.disk_limit * 0.8), []
+            for key, size in db.execute("SELECT key, size FROM responses ORDER BY stored_at"):
+                if excess <= 0:
+                    break
+                doomed.append((key,))
+                excess -= size
+            db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+            db.commit()
+            for (key,) in doomed:
+                entry = self._memory.pop(key, None)
+                if entry is not None:
+                    self._memory_bytes -= entry.size
+
+    def record(self, kind, size):
+        with self._lock:
+            if kind == "fresh":
+                self.stats["fresh_hits"] += 1
+                self.stats["bytes_saved"] += size
+            elif kind == "revalidated":
+                self.stats["revalidated"] += 1
+                self.stats["bytes_saved"] += size
+            else:
+                self.stats["misses"] += 1
+                self.stats["bytes_downloaded"] += size
+
+    def report(self):
+        s = dict(self.stats)
+        total = s["fresh_hits"] + s["revalidated"] + s["misses"]
+        s["hit_ratio"] = round((s["fresh_hits"] + s["revalidated"]) / total, 3) if total else 0.0
+        return s
+
+    def log_stats(self):
+        s = self.report()
+        logging.info(
+            f"HTTP cache: hit ratio {s['hit_ratio']:.1%} ({s['fresh_hits']} fresh, {s['revalidated']} revalidated, "
+            f"{s['misses']} misses), {s['bytes_saved'] / 1e6:.2f}MB saved, {s['bytes_downloaded'] / 1e6:.2f}MB downloaded."
+        )
+
+
+def _response_from_entry(entry, url):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = entry.body
+    response.headers = CaseInsensitiveDict(entry.headers)
+    response.url = url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+def cached_get(url, params=None, timeout=10, session=None, cache=None, **kwargs):
+    """
+    requests.get の代わりに使う。鮮度内ならキャッシュから、切れていれば条件付き GET で再検証する。
+    戻り値は requests.Response (キャッシュからの場合も .json() / .content / raise_for_status() が使える)。
+    """
+    cache = cache or get_response_cache()
+    full_url, key = cache_key(url, params)
+    entry = cache.get(key)
+    if entry is not None and entry.fresh():
+        cache.record("fresh", entry.size)
+        return _response_from_entry(entry, full_url)
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if entry is not None:
+        headers.update(entry.conditional_headers())
+    response = (session or requests).get(url, params=params, timeout=timeout, headers=headers, **kwargs)
+    if response.status_code == 304 and entry is not None:
+        cache.record("revalidated", entry.size)
+        return _response_from_entry(cache.refresh(entry, full_url, response.headers), full_url)
+    cache.record("miss", len(response.content))
+    if response.status_code == 200:
+        cache.put(key, full_url, response.headers, response.content)
+    return response
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,286 @@
+# retention.py
+# market_data_history の保持期間管理
+#  - RETENTION_DAYS を過ぎた生データを時間足/日足テーブルへロールアップ
+#  - 同じ行を月単位の gzip CSV (archive/market_data_history/YYYY-MM.csv.gz) へ退避してから削除
+#  - 空いたページは incremental vacuum で少しずつ返却
+# 1バッチ = 1トランザクション (最大 RETENTION_BATCH_ROWS 行) に区切り、ロック保持時間を抑える。
+import argparse
+import csv
+import glob
+import gzip
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import database
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+RETENTION_HOURLY_DAYS = int(os.getenv("RETENTION_HOURLY_DAYS", "180"))
+RETENTION_BATCH_ROWS = int(os.getenv("RETENTION_BATCH_ROWS", "5000"))
+RETENTION_BATCH_PAUSE_SEC = float(os.getenv("RETENTION_BATCH_PAUSE_SEC", "0.05"))
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "500"))
+RETENTION_RUN_AT = os.getenv("RETENTION_RUN_AT", "03:00")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_READ_CHUNK_ROWS = 200000
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+ARCHIVE_COLUMNS = [
+    "timestamp", "token_address", "price_usd", "volume_h24", "price_change_h1",
+    "price_change_h24", "social_mentions", "future_price_grew",
+]
+
+# 同じ (bucket_start, token_address) へ後から届いた行をマージする upsert
+_UPSERT_AGGREGATE = """
+    INSERT INTO {table} (
+        bucket_start, token_address, first_ts, last_ts, open, high, low, close,
+        volume_h24_avg, price_change_h1_avg, price_change_h24_avg, social_mentions_avg,
+        samples, labeled, grew
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(bucket_start, token_address) DO UPDATE SET
+        open = CASE WHEN excluded.first_ts < first_ts THEN excluded.open ELSE open END,
+        close = CASE WHEN excluded.last_ts > last_ts THEN excluded.close ELSE close END,
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_ts = MAX(last_ts, excluded.last_ts),
+        high = MAX(COALESCE(high, excluded.high), COALESCE(excluded.high, high)),
+        low = MIN(COALESCE(low, excluded.low), COALESCE(excluded.low, low)),
+        {averages},
+        samples = samples + excluded.samples,
+        labeled = labeled + excluded.labeled,
+        grew = grew + excluded.grew
+""".replace("{averages}", ",\n        ".join(
+    f"{c} = CASE WHEN {c} IS NULL THEN excluded.{c} WHEN excluded.{c} IS NULL THEN {c} "
+    f"ELSE ({c} * samples + excluded.{c} * excluded.samples) / (samples + excluded.samples) END"
+    for c in ("volume_h24_avg", "price_change_h1_avg", "price_change_h24_avg", "social_mentions_avg")
+))
+
+_job_lock = threading.Lock()
+
+
+def _avg(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _aggregate(rows, bucket_ms):
+    """生データ行を (bucket_start, token_address) 単位に集計する。rows は時刻昇順であること"""
+    buckets = {}
+    for row in rows:
+        ts, token = row[0], row[1]
+        key = (ts - ts % bucket_ms, token)
+        buckets.setdefault(key, []).append(row)
+
+    records = []
+    for (bucket_start, token), items in buckets.items():
+        prices = [r[2] for r in items if r[2] is not None]
+        labels = [r[7] for r in items if r[7] is not None]
+        records.append((
+            bucket_start, token, items[0][0], items[-1][0],
+            prices[0] if prices else None, max(prices) if prices else None,
+            min(prices) if prices else None, prices[-1] if prices else None,
+            _avg(r[3] for r in items), _avg(r[4] for r in items),
+            _avg(r[5] for r in items), _avg(r[6] for r in items),
+            len(items), len(labels), sum(labels),
+        ))
+    return records
+
+
+def _archive_path(month):
+    return os.path.join(ARCHIVE_DIR, "market_data_history", f"{month}.csv.gz")
+
+
+def _archive_rows(rows):
+    """行を月別の gzip CSV に追記する (gzip メンバーの連結として追記)"""
+    by_month = {}
+    for row in rows:
+        month = datetime.fromtimestamp(row[0] / 1000, tz=timezone.utc).strftime("%Y-%m")
+        by_month.setdefault(month, []).append(row)
+
+    for month, items in by_month.items():
+        path = _archive_path(month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        is_new = not os.path.exists(path)
+        with gzip.open(path, "at", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(ARCHIVE_COLUMNS)
+            writer.writerows(items)
+            f.flush()
+            os.fsync(f.fileno())
+    return sorted(by_month)
+
+
+def _process_batch(conn, cutoff_ms):
+    """期限切れの生データを1バッチ分アーカイブ・集計・削除する。戻り値: 処理行数"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(f"""
+            SELECT rowid, {', '.join(ARCHIVE_COLUMNS)} FROM market_data_history
+            WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+        """, (cutoff_ms, RETENTION_BATCH_ROWS)).fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+
+        rowids = [(r[0],) for r in rows]
+        data = [r[1:] for r in rows]
+
+        # アーカイブを先に書き出す (削除のコミット前に失敗すれば何も消えない)
+        _archive_rows(data)
+        conn.executemany(_UPSERT_AGGREGATE.format(table="market_data_hourly"), _aggregate(data, HOUR_MS))
+        conn.executemany(_UPSERT_AGGREGATE.format(table="market_data_daily"), _aggregate(data, DAY_MS))
+        conn.executemany("DELETE FROM market_data_history WHERE rowid = ?", rowids)
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def prune_hourly(conn, now_ms=None):
+    """RETENTION_HOURLY_DAYS を過ぎた時間足を削除する (日足は残す)"""
+    cutoff = (now_ms or database.now_ms()) - RETENTION_HOURLY_DAYS * DAY_MS
+    with conn:
+        return conn.execute("DELETE FROM market_data_hourly WHERE bucket_start < ?", (cutoff,)).rowcount
+
+
+def incremental_vacuum(conn, max_steps=1000):
+    """空きページを RETENTION_VACUUM_PAGES ずつ返却する。戻り値: 返却ページ数"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logging.warning("auto_vacuum is not INCREMENTAL; run `python retention.py --enable-incremental-vacuum` once.")
+        return 0
+    freed = 0
+    for _ in range(max_steps):
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free_pages == 0:
+            break
+        # execute() は1ステップ(1ページ)で止まるため、最後まで実行される executescript を使う
+        conn.executescript(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES});")
+        freed += free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        time.sleep(RETENTION_BATCH_PAUSE_SEC)
+    return freed
+
+
+def enable_incremental_vacuum(path=None):
+    """既存DBを auto_vacuum=INCREMENTAL に切り替える (VACUUM を1回実行するため長時間ロックする)"""
+    with sqlite3.connect(path or database.DB_FILE) as conn:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+
+def run_retention_job(path=None, now_ms=None):
+    """保持期間ジョブ本体。戻り値: 処理結果の dict"""
+    path = path or database.DB_FILE
+    if not os.path.exists(path):
+        logging.info("Retention: %s not found, skipping.", path)
+        return {}
+    if not _job_lock.acquire(blocking=False):
+        logging.info("Retention job already running, skipping.")
+        return {}
+
+    started = time.perf_counter()
+    try:
+        cutoff_ms = (now_ms or database.now_ms()) - RETENTION_DAYS * DAY_MS
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            database.ensure_schema(conn)
+            archived = 0
+            while True:
+                n = _process_batch(conn, cutoff_ms)
+                archived += n
+                if n < RETENTION_BATCH_ROWS:
+                    break
+                time.sleep(RETENTION_BATCH_PAUSE_SEC)
+            pruned = prune_hourly(conn, now_ms)
+            freed = incremental_vacuum(conn)
+        finally:
+            conn.close()
+
+        result = {"archived_rows": archived, "pruned_hourly": pruned, "freed_pages": freed,
+                  "elapsed_sec": round(time.perf_counter() - started, 3)}
+        logging.info(f"Retention job finished: {result}")
+        return result
+    finally:
+        _job_lock.release()
+
+
+def run_retention_job_in_background():
+    """スケジューラから呼ぶ用。取引サイクルを止めないよう別スレッドで実行する"""
+    threading.Thread(target=run_retention_job, name="retention", daemon=True).start()
+
+
+def _month_of(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m")
+
+
+def archive_months(start_ms=None, end_ms=None):
+    """[start_ms, end_ms) にかかる月のアーカイブ [(YYYY-MM, パス)] を古い順に返す"""
+    lo = _month_of(start_ms) if start_ms is not None else "0000-00"
+    hi = _month_of(end_ms - 1) if end_ms is not None else "9999-99"
+    months = [(os.path.basename(p)[:7], p) for p in sorted(glob.glob(_archive_path("*")))]
+    return [(month, p) for month, p in months if lo <= month <= hi]
+
+
+def read_archive_month(path):
+    """
+    1か月分のアーカイブを時刻順の DataFrame で返す。
+    追記途中で中断したバッチの重複は (timestamp, token_address) で除去する。
+    """
+    import pandas as pd
+
+    df = pd.read_csv(path, compression="gzip")
+    df = df.drop_duplicates(subset=["timestamp", "token_address"], keep="last")
+    return df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+
+def read_archive_labeled_timestamps(path, chunk_rows=ARCHIVE_READ_CHUNK_ROWS):
+    """1か月分のアーカイブのうちラベル付き行の timestamp (int64, ファイル順)。2列だけをチャンクで読む"""
+    import numpy as np
+    import pandas as pd
+
+    parts = []
+    for chunk in pd.read_csv(path, compression="gzip", usecols=["timestamp", "future_price_grew"], chunksize=chunk_rows):
+        parts.append(chunk.loc[chunk["future_price_grew"].notna(), "timestamp"].to_numpy(np.int64))
+    return np.concatenate(parts) if parts else np.empty(0, np.int64)
+
+
+def iter_archive(start_ms=None, end_ms=None):
+    """アーカイブ済みの生データを月ごとの DataFrame で返す (同時に読み込むのは1か月分だけ)"""
+    for _, path in archive_months(start_ms, end_ms):
+        df = read_archive_month(path)
+        if start_ms is not None:
+            df = df[df["timestamp"] >= start_ms]
+        if end_ms is not None:
+            df = df[df["timestamp"] < end_ms]
+        if not df.empty:
+            yield df.reset_index(drop=True)
+
+
+def read_archive(start_ms=None, end_ms=None):
+    """
+    アーカイブ済みの生データを1つの DataFrame で返す (範囲外の行は月ごとに落としてから連結する)。
+    学習データの読み込みは training_data.HistoryChunkLoader が月ごとに行う
+    """
+    import pandas as pd
+
+    frames = list(iter_archive(start_ms, end_ms))
+    if not frames:
+        return pd.DataFrame(columns=ARCHIVE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Roll up, archive and prune market_data_history.")
+    parser.add_argument("--db", default=database.DB_FILE)
+    parser.add_argument("--enable-incremental-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        logging.info("auto_vacuum mode is now %s", enable_incremental_vacuum(args.db))
+    run_retention_job(args.db)
@@ -1,7 +1,8 @@
 # scoring_engine.py
 import logging
 import pandas as pd
-import pandas_ta as ta
+
+from utils import load_pandas_ta
 
 class ScoringEngine:
     """
@@ -31,6 +32,7 @@ class ScoringEngine:
                 return 'RANGING', "データ不足のためレンジ相場と判断"
             
             # ADXを計算
+            load_pandas_ta()
             adx_df = series.ta.adx()
             adx_value = adx_df['ADX_14'].iloc[-1]
             
@@ -82,6 +84,7 @@ class ScoringEngine:
     def _score_momentum(self, token_data, series, max_score):
         """短期的な勢い（モメンタム）を評価する"""
         try:
+            load_pandas_ta()
             series.ta.rsi(append=True)
             series.ta.macd(append=True)
             series.columns = [col.lower() for col in series.columns]
@@ -106,6 +109,7 @@ class ScoringEngine:
         """長期的なトレンドの方向性を評価する"""
         try:
             if len(series) < 200: return 0, f"📊 *トレンド (0/{max_score}点)*\n長期データ不足。"
+            load_pandas_ta()
             sma50 = series.ta.sma(50).iloc[-1]
             sma200 = series.ta.sma(200).iloc[-1]
             if sma50 > sma200:
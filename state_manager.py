@@ -5,6 +5,8 @@ import logging
 from datetime import datetime, timezone, timedelta
 from typing import Any, Dict, Optional, List
 
+from account_state import get_account_cache, usdt_total
+
 JST = timezone(timedelta(hours=9))
 
 
@@ -18,6 +20,7 @@ class StateManager:
 
         # last snapshot of market / account / positions
         self.last_snapshot: Optional[Dict[str, Any]] = None
+        self.last_balance: Optional[Dict[str, Any]] = None  # 直近の fetch_balance() の結果
 
         # tokens already notified (for notifications throttling, optional)
         self.notified_tokens: Dict[str, Any] = {}
@@ -84,6 +87,8 @@ class StateManager:
             "positions": positions,
             "timestamp": int(time.time())
         }
+        if balance:
+            self.last_balance = balance
 
     def get_last_snapshot(self) -> Optional[Dict[str, Any]]:
         return self.last_snapshot
@@ -125,6 +130,44 @@ class StateManager:
     def get_all_positions(self) -> Dict[str, Dict[str, Any]]:
         return {t: v["details"] for t, v in self.positions.items() if v.get("in_position")}
 
+    def open_position(self, token_id: str, side: str, entry_price: float, amount: float,
+                      take_profit: float, stop_loss: float, leverage: float) -> None:
+        """約定したエントリーを記録する (check_positions_and_manage が TP/SL の判定に使う形)"""
+        self.positions[token_id] = {"in_position": True, "details": {
+            "side": side, "amount": float(amount), "entry_price": float(entry_price),
+            "take_profit": float(take_profit), "stop_loss": float(stop_loss), "leverage": leverage,
+            "opened_at": int(time.time()),
+        }}
+        self.entry_count += 1
+        self.save_state()
+        logging.info("Opened %s %s amount=%s @ %s", side, token_id, amount, entry_price)
+
+    def close_position(self, token_id: str, exit_price: float, portion: float = 1.0, reason: str = "") -> Dict[str, Any]:
+        """
+        決済を記録して実現損益を返す。portion < 1 なら数量を減らしてポジションを残す。
+        戻り値: {"token_id", "side", "amount", "entry_price", "exit_price", "pnl", "reason", "timestamp"}
+        """
+        details = self.get_position_details(token_id) or {}
+        side = details.get("side", "long")
+        entry = float(details.get("entry_price") or exit_price)
+        amount = float(details.get("amount") or 0) * portion
+        pnl = (float(exit_price) - entry) * amount * (1 if side == "long" else -1)
+        rec = {"token_id": token_id, "side": side, "amount": amount, "entry_price": entry,
+               "exit_price": float(exit_price), "pnl": pnl, "reason": reason, "timestamp": int(time.time())}
+
+        if portion < 1.0 and details:
+            details["amount"] = float(details.get("amount") or 0) - amount
+            details["closes"] = int(details.get("closes", 0)) + 1  # 決済注文の clientOrderId に使う
+        else:
+            self.positions.pop(token_id, None)
+        self.trade_history.append({"token_id": token_id, "result": "win" if pnl > 0 else "loss",
+                                   "timestamp": rec["timestamp"], "pnl": pnl, "reason": reason})
+        self.realized_pnl.append({"timestamp": datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S"), "pnl": pnl})
+        self.exit_count += 1
+        self.save_state()
+        logging.info("Closed %s %s amount=%s @ %s pnl=%.4f (%s)", side, token_id, amount, exit_price, pnl, reason)
+        return rec
+
     def get_open_tokens(self) -> List[str]:
         return [t for t, v in self.positions.items() if v.get("in_position")]
 
@@ -168,12 +211,33 @@ class StateManager:
         today = datetime.now(JST).strftime("%Y-%m-%d")
         return sum(r["pnl"] for r in self.realized_pnl if r["timestamp"].startswith(today))
 
+    def get_balance(self) -> Optional[float]:
+        """直近に取得した USDT 残高 (取引ループか通知用キャッシュの値)。まだ取得していなければ None"""
+        total = usdt_total(self.last_balance)
+        if total is None:
+            total = get_account_cache().balance
+        return float(total) if total is not None else None
+
+    def get_state_snapshot(self) -> Dict[str, Any]:
+        """/status 用の要約 (JSON にそのまま出せる形)"""
+        return {
+            "positions": self.get_all_positions(),
+            "balance_usdt": self.get_balance(),
+            "entry_count": self.entry_count,
+            "exit_count": self.exit_count,
+            "win_rate": self.get_win_rate(),
+            "daily_pnl": self.get_daily_pnl(),
+            "last_snapshot_at": (self.last_snapshot or {}).get("timestamp"),
+        }
+
     # ---------------------------
     # exchange sync helpers
     # ---------------------------
     def sync_balance(self, exchange) -> Optional[Dict[str, Any]]:
         try:
             bal = exchange.fetch_balance()
+            self.last_balance = bal
+            get_account_cache().update_balance(bal)
             logging.info("Synced balance")
             return bal
         except Exception as e:
@@ -185,6 +249,7 @@ class StateManager:
             positions_raw = []
             if hasattr(exchange, "fetch_positions"):
                 positions_raw = exchange.fetch_positions() or []
+                get_account_cache().update_positions(positions_raw)
             else:
                 positions_raw = []
 
@@ -3,9 +3,11 @@ import time
 import threading
 import schedule
 import requests
-import ccxt
 from datetime import datetime, timedelta, timezone
 
+from account_state import get_account_cache, get_fx_cache
+from exchange_registry import get_exchange
+
 # ==================
 # 基本設定
 # ==================
@@ -13,12 +15,10 @@ JST = timezone(timedelta(hours=9))
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
-bitget = ccxt.bitget({
-    "apiKey": os.getenv("BITGET_API_KEY"),
-    "secret": os.getenv("BITGET_API_SECRET"),
-    "password": os.getenv("BITGET_API_PASSWORD"),
-    "enableRateLimit": True,
-})
+def get_bitget():
+    """通知用アカウントの共有 ccxt クライアント (exchange_registry)。初回使用時に作る"""
+    return get_exchange("notifier", "spot")
+
 
 # ==================
 # 日次損益管理
@@ -48,12 +48,8 @@ pnl_tracker = DailyPnLTracker()
 # 為替レート取得 (USD/JPY)
 # ==================
 def get_usd_jpy():
-    try:
-        url = "https://query1.finance.yahoo.com/v7/finance/quote?symbols=USDJPY=X"
-        r = requests.get(url, timeout=5).json()
-        return float(r["quoteResponse"]["result"][0]["regularMarketPrice"])
-    except Exception:
-        return None
+    """USD/JPY。このプロセスでは誰も事前に取らないので、未取得・TTL 切れならその場で取り直す (失敗なら None)"""
+    return get_fx_cache().get_fresh()
 
 # ==================
 # Telegram送信関数
@@ -73,23 +69,28 @@ def send_message(text: str):
 # ==================
 # 残高/ポジション取得
 # ==================
+# この通知プロセスには取引ループ (main.run_cycle) が流し込まないので、キャッシュが空か TTL 切れなら
+# 描画の前にここの bitget で同期的に取り直す (ACCOUNT_STATE_SYNC_TIMEOUT_SEC まで待つ)
+account_cache = get_account_cache()
+account_cache.set_refresher(lambda: (get_bitget().fetch_balance(), get_bitget().fetch_positions()))
+
+
 def get_account_status():
-    balance = bitget.fetch_balance()
-    positions = bitget.fetch_positions()
+    """(残高, 含み損益, ポジション一覧) を返す。残高が取れなかったときは None (表示は「不明」)"""
+    if account_cache.stale() and not account_cache.refresh():
+        print("[WARN] 残高・ポジションの取得に失敗したため、手元の値で通知します")
+    balance, unrealized_pnl, pos_list, age = account_cache.snapshot()
+    if balance is not None and age is not None and age > account_cache.ttl_sec:
+        pos_list = pos_list + [f"(残高・ポジションは {age / 60:.0f} 分前の値)"]
+    return balance, unrealized_pnl, pos_list
 
-    usdt_balance = balance["total"]["USDT"]
 
-    unrealized_pnl = 0.0
-    pos_list = []
-    for pos in positions:
-        if float(pos["contracts"]) > 0:
-            symbol = pos["symbol"]
-            entry = float(pos["entryPrice"])
-            upnl = float(pos["unrealizedPnl"])
-            unrealized_pnl += upnl
-            pos_list.append(f"{symbol} | EP: {entry:.2f} | PnL: {upnl:+.2f} USDT")
+def format_usdt(balance):
+    return "不明" if balance is None else f"{balance:.2f} USDT"
 
-    return usdt_balance, unrealized_pnl, pos_list
+
+def format_jpy(balance, usd_jpy):
+    return "不明" if balance is None else f"{balance * usd_jpy:,.0f} 円"
 
 # ==================
 # 通知処理
@@ -103,13 +104,12 @@ def notify_summary():
     usd_jpy = get_usd_jpy()
     jpy_text = ""
     if usd_jpy:
-        balance_jpy = balance * usd_jpy
         realized_jpy = realized * usd_jpy
         unrealized_jpy = unrealized * usd_jpy
         total_jpy = total_pnl * usd_jpy
         jpy_text = f"""
 💴 JPY換算 (USDJPY={usd_jpy:.2f}):
-　- 残高: {balance_jpy:,.0f} 円
+　- 残高: {format_jpy(balance, usd_jpy)}
 　- 確定: {realized_jpy:+,.0f} 円
 　- 含み: {unrealized_jpy:+,.0f} 円
 　- 合計: {total_jpy:+,.0f} 円
@@ -119,7 +119,7 @@ def notify_summary():
 📊 サマリー通知
 ⏰ 現在時刻: {now}
 
-💰 残高: {balance:.2f} USDT
+💰 残高: {format_usdt(balance)}
 📈 日次損益:
 　- 確定: {realized:+.2f} USDT
 　- 含み: {unrealized:+.2f} USDT
@@ -138,8 +138,7 @@ def notify_new_entry(symbol, entry_price, size):
 
     jpy_text = ""
     if usd_jpy:
-        balance_jpy = balance * usd_jpy
-        jpy_text = f"💴 残高: {balance_jpy:,.0f} 円 (USDJPY={usd_jpy:.2f})"
+        jpy_text = f"💴 残高: {format_jpy(balance, usd_jpy)} (USDJPY={usd_jpy:.2f})"
 
     msg = f"""
 🟢 新規エントリー
@@ -149,7 +148,7 @@ def notify_new_entry(symbol, entry_price, size):
 エントリー価格: {entry_price:.2f}
 サイズ: {size}
 
-💰 残高: {balance:.2f} USDT
+💰 残高: {format_usdt(balance)}
 {jpy_text}
 """
     send_message(msg)
@@ -163,14 +162,13 @@ def notify_exit(symbol, exit_price, pnl_usd):
 
     jpy_text = ""
     if usd_jpy:
-        balance_jpy = balance * usd_jpy
         pnl_jpy = pnl_usd * usd_jpy
         realized_jpy = pnl_tracker.get_realized_pnl() * usd_jpy
         jpy_text = f"""
 💴 JPY換算 (USDJPY={usd_jpy:.2f}):
 　- 確定損益: {pnl_jpy:+,.0f} 円
 　- 累積損益: {realized_jpy:+,.0f} 円
-　- 残高: {balance_jpy:,.0f} 円
+　- 残高: {format_jpy(balance, usd_jpy)}
 """
 
     msg = f"""
@@ -181,7 +179,7 @@ def notify_exit(symbol, exit_price, pnl_usd):
 決済価格: {exit_price:.2f}
 確定損益: {pnl_usd:+.2f} USDT
 
-💰 残高: {balance:.2f} USDT
+💰 残高: {format_usdt(balance)}
 📈 日次累積損益: {pnl_tracker.get_realized_pnl():+.2f} USDT
 {jpy_text}
 """
@@ -201,4 +199,17 @@ def scheduler_loop():
         time.sleep(1)
 
 
-threading.Thread(target=scheduler_loop, daemon=True).start()
+_scheduler_thread = None
+
+
+def start_scheduler():
+    """毎時サマリーと日次リセットのスレッドを起動する (import しただけでは起動しない)。2回目以降は何もしない"""
+    global _scheduler_thread
+    if _scheduler_thread is None:
+        _scheduler_thread = threading.Thread(target=scheduler_loop, name="telegram-notifier", daemon=True)
+        _scheduler_thread.start()
+    return _scheduler_thread
+
+
+if __name__ == "__main__":
+    start_scheduler().join()
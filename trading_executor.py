@@ -1,49 +1,63 @@
 import logging
-import math
-import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
-import ccxt
+from exchange_registry import get_exchange_registry
+from order_router import OrderRequest, get_order_router
 from state_manager import StateManager
 
-PAPER_TRADING = os.getenv("PAPER_TRADING", "1") != "0"
-BITGET_API_KEY = os.getenv("BITGET_API_KEY_FUTURES")
-BITGET_API_SECRET = os.getenv("BITGET_API_SECRET_FUTURES")
-BITGET_API_PASSPHRASE = os.getenv("BITGET_API_PASSPHRASE_FUTURES")
 
 
 class TradingExecutor:
     """
-    Bitget Futures 注文実行（Paper / Live切替）
+    Bitget Futures 注文実行。Paper / Live の切り替えは exchange_registry (EXCHANGE_MODE) が行い、
+    ペーパートレードでもシミュレーターに同じ経路で注文を送る
     """
 
     def __init__(self, state_manager: StateManager):
         self.state = state_manager
-        self.exchange = None
-        try:
-            self.exchange = ccxt.bitget({
-                "apiKey": BITGET_API_KEY,
-                "secret": BITGET_API_SECRET,
-                "password": BITGET_API_PASSPHRASE,
-                "enableRateLimit": True,
-            })
-            self.exchange.options["defaultType"] = "swap"
-            logging.info("Initialized ccxt.bitget for futures.")
-        except Exception as e:
-            logging.warning("Could not initialize ccxt.bitget: %s", e)
-            self.exchange = None
+        self._exchange = None
+        self._exchange_failed = False
+
+    @property
+    def exchange(self):
+        """先物アカウントの共有 ccxt クライアント (exchange_registry)。初回使用時に作る"""
+        if self._exchange is None and not self._exchange_failed:
+            try:
+                self._exchange = get_exchange_registry().get("futures", "swap")
+            except Exception as e:
+                logging.warning("Could not initialize ccxt.bitget: %s", e)
+                self._exchange_failed = True
+            else:
+                if self.simulated:
+                    self._restore_simulated_positions(self._exchange)
+        return self._exchange
+
+    def _restore_simulated_positions(self, simulator) -> None:
+        """シミュレーターの建玉はプロセスと一緒に消えるので、state.json に残っているポジションを戻す (決済できるように)"""
+        positions = {}
+        for symbol, pos in self.state.get_all_positions().items():
+            if not pos or not pos.get("amount") or not pos.get("entry_price"):
+                continue
+            contracts = float(pos["amount"]) * (1 if pos.get("side", "long") == "long" else -1)
+            positions[self._market_symbol(symbol)] = (contracts, pos["entry_price"], pos.get("leverage"))
+        restored = simulator.restore_positions(positions)
+        if restored:
+            logging.info("Restored %d positions into the exchange simulator: %s", len(restored), ", ".join(restored))
+
+    @property
+    def simulated(self) -> bool:
+        """注文がシミュレーター (EXCHANGE_MODE=paper/sim) に送られるか"""
+        return get_exchange_registry().simulated("futures")
 
     def _market_symbol(self, symbol: str) -> str:
         return f"{symbol}/USDT:USDT"
 
     def _round_amount(self, symbol: str, amount: float) -> float:
+        # 前計算した刻みの表を引くだけ (注文ごとに load_markets しない)
         try:
-            markets = self.exchange.load_markets()
-            m = markets.get(symbol)
-            if m:
-                step = m.get("limits", {}).get("amount", {}).get("min")
-                if step:
-                    return math.floor(amount / step) * step
+            info = get_exchange_registry().market_info(symbol)
+            if info:
+                return info.round_amount(amount)
         except Exception:
             pass
         return round(amount, 6)
@@ -55,45 +69,63 @@ class TradingExecutor:
         amount = self._round_amount(symbol_pair, size_usd / entry_price)
         logging.info(f"OPEN {side} {symbol} amt={amount} entry={entry_price} tp={tp} sl={sl}")
 
-        if PAPER_TRADING or not self.exchange:
-            self.state.open_position(symbol, side, entry_price, amount, tp, sl, leverage)
-            return {"simulated": True}
+        if amount <= 0:
+            return {"error": f"order amount rounds to zero ({size_usd:.2f} USDT)"}
+        if not self.exchange:
+            return {"error": "exchange unavailable"}
 
         try:
-            self.exchange.set_leverage(leverage, symbol_pair)
-            if side == "long":
-                order = self.exchange.create_market_buy_order(symbol_pair, amount)
-            else:
-                order = self.exchange.create_market_sell_order(symbol_pair, amount)
+            # レバレッジは変わるときだけ設定し、注文には再送しても重複しない clientOrderId を付ける
+            req = OrderRequest(symbol_pair, "buy" if side == "long" else "sell", amount, leverage=leverage)
+            order = get_order_router().place([req])[0]
+            if "error" in order:
+                logging.error("Failed to open position: %s", order["error"])
+                return order
             executed_price = order.get("average") or entry_price
-            self.state.open_position(symbol, side, executed_price, amount, tp, sl, leverage)
-            return order
+            self.state.open_position(symbol, side, executed_price, order.get("filled") or amount, tp, sl, leverage)
+            return {**order, "simulated": self.simulated}
         except Exception as e:
             logging.exception("Failed to open position: %s", e)
             return {"error": str(e)}
 
     def close_position(self, symbol: str, exit_price: float = None,
                        portion: float = 1.0) -> Dict[str, Any]:
-        if not self.state.has_position(symbol):
-            return {"error": "no position"}
-        pos = self.state.positions[symbol]
-        side = pos["side"]
-        amt = pos["amount"] * portion
-        market_symbol = self._market_symbol(symbol)
-
-        if PAPER_TRADING or not self.exchange:
-            price = exit_price or pos["entry_price"]
-            rec = self.state.close_position(symbol, price, portion=portion, reason="PAPER")
-            return {"simulated": True, "pnl": rec["pnl"]}
+        return self.close_positions([(symbol, exit_price, portion)])[symbol]
 
-        try:
-            if side == "long":
-                order = self.exchange.create_market_sell_order(market_symbol, amt, {"reduceOnly": True})
-            else:
-                order = self.exchange.create_market_buy_order(market_symbol, amt, {"reduceOnly": True})
-            price = order.get("average")
-            rec = self.state.close_position(symbol, price, portion=portion, reason="LIVE")
-            return {"order": order, "pnl": rec["pnl"]}
-        except Exception as e:
-            logging.exception("Failed to close position: %s", e)
-            return {"error": str(e)}
+    def close_positions(self, exits: List[Tuple[str, float, float]]) -> Dict[str, Dict[str, Any]]:
+        """
+        複数ポジションをまとめて決済する。exits は (symbol, exit_price, portion) のリスト。
+        ライブでは全銘柄の決済注文を同時に送る (一斉決済が注文1往復分の時間で終わる)。
+        戻り値: {symbol: close_position と同じ形の結果}
+        """
+        results, orders = {}, []
+        for symbol, exit_price, portion in exits:
+            if not self.state.has_position(symbol):
+                results[symbol] = {"error": "no position"}
+                continue
+            pos = self.state.get_position_details(symbol) or {}
+            if not self.exchange:
+                results[symbol] = {"error": "exchange unavailable"}
+                continue
+            # 同じポジションの同じ決済は再送しても同じ clientOrderId になる。
+            # 部分決済が記録されるたびに closes が進むので、同じ割合の次の部分決済は別の ID になる
+            intent = f"{pos.get('opened_at') or pos.get('entry_price')}:{pos.get('closes', 0)}:{portion}"
+            req = OrderRequest(self._market_symbol(symbol), "sell" if pos["side"] == "long" else "buy",
+                               pos["amount"] * portion, reduce_only=True, intent=intent)
+            orders.append((symbol, exit_price, portion, req))
+
+        if orders:
+            try:
+                placed = get_order_router().place([req for _, _, _, req in orders])
+            except Exception as e:
+                logging.exception("Failed to close positions: %s", e)
+                placed = [{"error": str(e)}] * len(orders)
+            for (symbol, exit_price, portion, _), order in zip(orders, placed):
+                if "error" in order:
+                    logging.error("Failed to close position %s: %s", symbol, order["error"])
+                    results[symbol] = order
+                    continue
+                price = order.get("average") or exit_price
+                rec = self.state.close_position(symbol, price, portion=portion, reason="PAPER" if self.simulated else "LIVE")
+                results[symbol] = {"order": order, "pnl": rec["pnl"], "simulated": self.simulated}
+        return results
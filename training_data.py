@@ -0,0 +1,364 @@
+# training_data.py
+# market_data_history からの学習データ読み込み (ストリーミング)
+#  - retention.py が退避した月別アーカイブも、テーブルより前の期間として同じチャンクで読む (同時に読むのは1か月分)
+#  - 整数の時刻範囲 (epoch ms) ごとにチャンクで読み、全テーブルを一度に DataFrame にしない
+#  - 型を固定して読む (価格以外の数値は float32、ラベルは int8)
+#  - トークンごとに直前 FEATURE_WARMUP_ROWS 行を次のチャンクへ持ち越し、指標の計算を途切れさせない
+#  - 特徴量は float32 の NumPy 配列としてだけ蓄積する (sklearn の木は内部で float32 を使うので精度は変わらない)
+#  - 時刻で学習/検証を分割する (検証 = 期間の末尾)
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import database
+import retention
+from ml_model import FEATURE_WARMUP_ROWS, MODEL_FEATURES, preprocess_and_add_features
+
+TRAINING_CHUNK_HOURS = float(os.getenv("TRAINING_CHUNK_HOURS", "6"))
+TRAINING_WARMUP_HOURS = float(os.getenv("TRAINING_WARMUP_HOURS", "24"))
+TRAINING_MAX_ROWS = int(os.getenv("TRAINING_MAX_ROWS", "2000000"))  # 10特徴量 x float32 で約80MB
+TRAINING_VALIDATION_FRACTION = float(os.getenv("TRAINING_VALIDATION_FRACTION", "0.2"))
+TRAINING_INCLUDE_ARCHIVE = os.getenv("TRAINING_INCLUDE_ARCHIVE", "true").lower() in ("1", "true", "yes")
+
+HOUR_MS = 3600 * 1000
+
+# 価格は桁の小さいトークンがあるため float64 のまま、それ以外は float32 で十分
+HISTORY_DTYPES = {
+    "timestamp": "int64",
+    "price_usd": "float64",
+    "volume_h24": "float32",
+    "price_change_h1": "float32",
+    "price_change_h24": "float32",
+    "social_mentions": "float32",
+    "future_price_grew": "float32",  # NULL (未ラベル) を NaN で持つため読み込み時は float
+}
+HISTORY_COLUMNS = ["timestamp", "token_address"] + [c for c in HISTORY_DTYPES if c != "timestamp"]
+
+
+def featurize_history(rows):
+    """
+    1トークン分の行 (時刻昇順) を特徴量化する。スナップショットの価格を OHLC、24h出来高を Volume として
+    ml_model と同じ指標を計算し、ラベルは future_price_grew を使う。
+    戻り値: (X: float32 DataFrame, y: int8 Series) — index は timestamp
+    """
+    frame = pd.DataFrame({
+        "Open": rows["price_usd"].to_numpy(),
+        "High": rows["price_usd"].to_numpy(),
+        "Low": rows["price_usd"].to_numpy(),
+        "Close": rows["price_usd"].to_numpy(),
+        "Volume": rows["volume_h24"].to_numpy(),
+    }, index=rows["timestamp"].to_numpy())
+    X, _, _ = preprocess_and_add_features(frame)
+    if X.empty:
+        return X, pd.Series(dtype="int8")
+    X = X.reindex(columns=MODEL_FEATURES, fill_value=0.0)
+    labels = rows.set_index("timestamp")["future_price_grew"].reindex(X.index)
+    labeled = labels.notna().to_numpy()
+    return X[labeled].astype(np.float32), labels[labeled].astype(np.int8)
+
+
+class HistoryChunkLoader:
+    """market_data_history (と退避済みのアーカイブ) を時刻範囲のチャンクで読み、特徴量化して返す"""
+
+    def __init__(self, path=None, chunk_hours=TRAINING_CHUNK_HOURS, warmup_hours=TRAINING_WARMUP_HOURS,
+                 warmup_rows=FEATURE_WARMUP_ROWS, featurize=featurize_history, include_archive=TRAINING_INCLUDE_ARCHIVE):
+        self.path = path or database.DB_FILE
+        self.chunk_ms = int(chunk_hours * HOUR_MS)
+        self.warmup_ms = int(warmup_hours * HOUR_MS)
+        self.warmup_rows = warmup_rows
+        self.featurize = featurize
+        self.include_archive = include_archive
+        self._conn = None  # snapshot() の中だけ設定される
+        self._window = (None, None, None)  # snapshot() に渡された (start_ms, end_ms, max_rows)
+        self._archive_ts = None  # アーカイブのラベル付き行の timestamp (昇順)
+        self._archive_cache = None  # (YYYY-MM, DataFrame) 直近に読んだ1か月分
+
+    def _connect(self):
+        # 読み取り専用で開き、取引サイクルの書き込みを妨げない
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+
+    @contextmanager
+    def _reading(self):
+        if self._conn is not None:
+            yield self._conn
+            return
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def snapshot(self, start_ms=None, end_ms=None, max_rows=None):
+        """
+        この中の読み込みをすべて1つの読み取りトランザクションで行う。
+        WAL なので書き込みは妨げず、途中で増えたラベルは見えない (件数と読み込み結果が食い違わない)。
+        start_ms / end_ms / max_rows を渡すと、アーカイブはその範囲 (新しい側の max_rows 行まで) の月だけを読む
+        """
+        conn = self._connect()
+        self._archive_ts = self._archive_cache = None
+        self._window = (start_ms, end_ms, max_rows)
+        try:
+            conn.execute("BEGIN")
+            conn.execute("SELECT 1 FROM market_data_history LIMIT 1").fetchall()  # ここでスナップショットが決まる
+            self._conn = conn
+            yield self
+        finally:
+            self._conn = None
+            self._archive_ts = self._archive_cache = None
+            self._window = (None, None, None)
+            conn.rollback()
+            conn.close()
+
+    def _archive_month(self, month, path):
+        if self._archive_cache is None or self._archive_cache[0] != month:
+            try:
+                df = retention.read_archive_month(path)[HISTORY_COLUMNS]
+            except (OSError, EOFError, ValueError, KeyError) as e:  # 追記中の gzip や壊れたファイル
+                logging.warning(f"Skipping unreadable archive {path}: {e}")
+                df = pd.DataFrame(columns=HISTORY_COLUMNS)
+            self._archive_cache = (month, df)
+        return self._archive_cache[1]
+
+    def _archive_labeled(self):
+        """
+        アーカイブのラベル付き行の timestamp (昇順)。初回に snapshot() の範囲にかかる月を新しい順に、
+        timestamp とラベルの2列だけチャンクで読んで作る。テーブルと合わせて max_rows 行に達したら、それより古い月は読まない
+        """
+        if not self.include_archive:
+            return np.empty(0, np.int64)
+        if self._archive_ts is None:
+            start_ms, end_ms, max_rows = self._window
+            parts, total = [], 0
+            if max_rows:
+                # アーカイブはテーブルより古いので、テーブルだけで足りるなら読まなくてよい
+                with self._reading() as conn:
+                    total = conn.execute(
+                        "SELECT COUNT(*) FROM market_data_history WHERE future_price_grew IS NOT NULL "
+                        "AND timestamp >= ? AND timestamp < ?",
+                        (int(start_ms) if start_ms is not None else -2**63, int(end_ms) if end_ms is not None else 2**63 - 1)
+                    ).fetchone()[0]
+            months = retention.archive_months(start_ms, end_ms) if not max_rows or total < max_rows else []
+            for _, path in reversed(months):
+                try:
+                    ts = retention.read_archive_labeled_timestamps(path)
+                except (OSError, EOFError, ValueError) as e:  # 追記中の gzip や壊れたファイル
+                    logging.warning(f"Skipping unreadable archive {path}: {e}")
+                    continue
+                if start_ms is not None:
+                    ts = ts[ts >= start_ms]
+                if end_ms is not None:
+                    ts = ts[ts < end_ms]
+                parts.append(ts)
+                total += len(ts)
+                if max_rows and total >= max_rows:
+                    break
+            self._archive_ts = np.sort(np.concatenate(parts)) if parts else np.empty(0, np.int64)
+        return self._archive_ts
+
+    def _read(self, conn, start_ms, end_ms):
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(HISTORY_COLUMNS)} FROM market_data_history "
+            "WHERE timestamp >= ? AND timestamp < ? ORDER BY token_address, timestamp",
+            conn, params=(int(start_ms), int(end_ms)),
+        )
+        if self.include_archive:
+            parts = []
+            for month, path in retention.archive_months(start_ms, end_ms):
+                archived = self._archive_month(month, path)
+                archived = archived[(archived["timestamp"] >= start_ms) & (archived["timestamp"] < end_ms)]
+                if not archived.empty:
+                    parts.append(archived)
+            if parts:
+                # 退避のコミット前に止まったバッチはテーブルにも残っているので、テーブル側を使う
+                df = pd.concat(parts + ([df] if not df.empty else []), ignore_index=True)
+                df = df.drop_duplicates(subset=["timestamp", "token_address"], keep="last")
+                df = df.sort_values(["token_address", "timestamp"], kind="stable").reset_index(drop=True)
+        return df.astype(HISTORY_DTYPES)
+
+    def labeled_bounds(self):
+        """ラベル付き行の (最小, 最大) timestamp。無ければ (None, None)"""
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT MIN(timestamp), MAX(timestamp) FROM market_data_history WHERE future_price_grew IS NOT NULL"
+            ).fetchone()
+        lo, hi = row if row else (None, None)
+        archived = self._archive_labeled()
+        if len(archived):
+            lo = int(archived[0]) if lo is None else min(lo, int(archived[0]))
+            hi = int(archived[-1]) if hi is None else max(hi, int(archived[-1]))
+        return lo, hi
+
+    def start_for_max_rows(self, end_ms, max_rows):
+        """end_ms より前のラベル付き行が max_rows 行に収まる開始時刻 (新しい側を残す)"""
+        archived = self._archive_labeled()
+        archived = archived[:np.searchsorted(archived, end_ms)]
+        with self._reading() as conn:
+            live = 0
+            if len(archived):
+                live = conn.execute(
+                    "SELECT COUNT(*) FROM market_data_history WHERE future_price_grew IS NOT NULL AND timestamp < ?",
+                    (int(end_ms),)
+                ).fetchone()[0]
+            if live < max_rows and len(archived):
+                # テーブルだけでは足りないので、残りはアーカイブ (テーブルより古い) から数える
+                remaining = int(max_rows) - live
+                return int(archived[-remaining]) if len(archived) >= remaining else None
+            row = conn.execute(
+                "SELECT timestamp FROM market_data_history WHERE future_price_grew IS NOT NULL AND timestamp < ? "
+                "ORDER BY timestamp DESC LIMIT 1 OFFSET ?", (int(end_ms), int(max_rows) - 1)
+            ).fetchone()
+        return row[0] if row else None
+
+    def count_labeled(self, start_ms, end_ms):
+        """[start_ms, end_ms) のラベル付き行数 (特徴量化後の行数の上限)"""
+        archived = self._archive_labeled()
+        in_archive = int(np.searchsorted(archived, end_ms) - np.searchsorted(archived, start_ms))
+        with self._reading() as conn:
+            return in_archive + conn.execute(
+                "SELECT COUNT(*) FROM market_data_history WHERE timestamp >= ? AND timestamp < ? AND future_price_grew IS NOT NULL",
+                (int(start_ms), int(end_ms))
+            ).fetchone()[0]
+
+    def iter_features(self, start_ms, end_ms):
+        """
+        [start_ms, end_ms) のラベル付き行を (timestamps, X, y) のチャンクで返す。
+        各チャンクの計算には、トークンごとに前の行 (最大 warmup_rows 行、warmup_ms 以内) を前置し、結果からは除く。
+        開始時刻より前の warmup_ms も同じチャンク幅で読むため、同時に保持する生データは1チャンク分に収まる。
+        """
+        with self._reading() as conn:
+            tails = {}
+            # 開始前の warmup_ms も同じ大きさのチャンクで読み、トークンごとの末尾だけを残す
+            lo = start_ms - self.warmup_ms if self.warmup_rows else start_ms
+            while lo < end_ms:
+                hi = min(lo + self.chunk_ms, start_ms if lo < start_ms else end_ms)
+                chunk = self._read(conn, lo, hi)
+                warming = lo < start_ms
+                lo = hi
+                if chunk.empty:
+                    continue
+                if warming:
+                    for token, rows in chunk.groupby("token_address", sort=False):
+                        tail = tails.get(token)
+                        source = rows if tail is None else pd.concat([tail, rows], ignore_index=True)
+                        tails[token] = source.tail(self.warmup_rows)
+                    continue
+
+                parts_X, parts_y = [], []
+                for token, rows in chunk.groupby("token_address", sort=False):
+                    tail = tails.get(token)
+                    source = rows if tail is None else pd.concat([tail, rows], ignore_index=True)
+                    X, y = self.featurize(source)
+                    keep = X.index >= rows["timestamp"].iloc[0]
+                    if keep.any():
+                        parts_X.append(X[keep])
+                        parts_y.append(y[keep])
+                    if self.warmup_rows:
+                        tails[token] = source.tail(self.warmup_rows)
+                # 長く出現しないトークンの持ち越し分は捨て、保持量を一定に保つ
+                tails = {t: r for t, r in tails.items() if r["timestamp"].iloc[-1] >= hi - self.warmup_ms}
+
+                if parts_X:
+                    X = pd.concat(parts_X)
+                    y = pd.concat(parts_y)
+                    order = np.argsort(X.index.to_numpy(), kind="stable")
+                    yield X.index.to_numpy()[order], X.to_numpy(np.float32)[order], y.to_numpy(np.int8)[order]
+
+
+class _Buffer:
+    """行数の上限で確保した配列に追記する (最後の concatenate で一時的に2倍のメモリを使わない)"""
+
+    def __init__(self, rows, width):
+        self.X = np.empty((rows, width), dtype=np.float32)
+        self.y = np.empty(rows, dtype=np.int8)
+        self.n = 0
+
+    def extend(self, X, y):
+        end = self.n + len(y)
+        if end > len(self.y):
+            # snapshot() を使わないローダーでは数えた後に増えた行が来ることがある
+            logging.warning(f"Training buffer sized for {len(self.y)} rows received {end}; growing it.")
+            rows = max(end, len(self.y) * 5 // 4)
+            X_grown, y_grown = np.empty((rows, self.X.shape[1]), dtype=np.float32), np.empty(rows, dtype=np.int8)
+            X_grown[:self.n], y_grown[:self.n] = self.X[:self.n], self.y[:self.n]
+            self.X, self.y = X_grown, y_grown
+        self.X[self.n:end] = X
+        self.y[self.n:end] = y
+        self.n = end
+
+    def arrays(self):
+        return self.X[:self.n], self.y[:self.n]
+
+
+class TrainingDataset:
+    """時刻で分割した学習/検証データ (float32 行列)"""
+
+    def __init__(self, features, X_train, y_train, X_valid, y_valid, split_ms, last_ms):
+        self.features = features
+        self.X_train, self.y_train = X_train, y_train
+        self.X_valid, self.y_valid = X_valid, y_valid
+        self.split_ms = split_ms
+        self.last_ms = last_ms
+
+    def __len__(self):
+        return len(self.y_train) + len(self.y_valid)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def frames(self):
+        """(X_train, y_train, X_valid, y_valid) を特徴量名付きの DataFrame/Series で返す"""
+        to_frame = lambda X: pd.DataFrame(X, columns=self.features)
+        return to_frame(self.X_train), pd.Series(self.y_train), to_frame(self.X_valid), pd.Series(self.y_valid)
+
+
+def load_training_dataset(path=None, start_ms=None, end_ms=None, validation_fraction=TRAINING_VALIDATION_FRACTION,
+                          max_rows=TRAINING_MAX_ROWS, loader=None):
+    """
+    ラベル付き履歴をチャンクで読み、学習/検証に分けた TrainingDataset を返す。
+    max_rows を超える場合は新しい側の max_rows 行に絞る。検証は期間末尾の validation_fraction。
+    """
+    loader = loader or HistoryChunkLoader(path)
+    with loader.snapshot(start_ms, end_ms, max_rows):
+        return _load_training_dataset(loader, start_ms, end_ms, validation_fraction, max_rows)
+
+
+def _load_training_dataset(loader, start_ms, end_ms, validation_fraction, max_rows):
+    # 件数での配列確保と読み込みを同じスナップショットで行う (load_training_dataset から呼ぶ)
+    started = time.perf_counter()
+    first_ms, last_ms = loader.labeled_bounds()
+    features = list(MODEL_FEATURES)
+    if first_ms is None:
+        no_X, no_y = np.empty((0, len(features)), np.float32), np.empty(0, np.int8)
+        return TrainingDataset(features, no_X, no_y, no_X, no_y, None, None)
+
+    end_ms = last_ms + 1 if end_ms is None else end_ms
+    start_ms = first_ms if start_ms is None else max(start_ms, first_ms)
+    if max_rows:
+        bounded = loader.start_for_max_rows(end_ms, max_rows)
+        if bounded is not None and bounded > start_ms:
+            logging.info(f"Training rows capped at {max_rows}; starting from {bounded} instead of {start_ms}.")
+            start_ms = bounded
+    split_ms = end_ms - int((end_ms - start_ms) * validation_fraction) if validation_fraction else end_ms
+
+    train = _Buffer(loader.count_labeled(start_ms, split_ms), len(features))
+    valid = _Buffer(loader.count_labeled(split_ms, end_ms), len(features))
+    chunks = 0
+    for ts, X, y in loader.iter_features(start_ms, end_ms):
+        chunks += 1
+        cut = np.searchsorted(ts, split_ms)
+        train.extend(X[:cut], y[:cut])
+        valid.extend(X[cut:], y[cut:])
+
+    dataset = TrainingDataset(features, *train.arrays(), *valid.arrays(), split_ms, end_ms - 1)
+    logging.info(
+        f"Loaded {len(dataset.y_train)} train / {len(dataset.y_valid)} validation rows in {chunks} chunks "
+        f"({(dataset.X_train.nbytes + dataset.X_valid.nbytes) / 1e6:.1f}MB) in {time.perf_counter() - started:.1f}s."
+    )
+    return dataset
@@ -3,6 +3,17 @@ import time
 import logging
 from functools import wraps
 
+import numpy as np
+
+
+def load_pandas_ta():
+    """
+    pandas_ta を初回使用時に読み込んで返す。読み込むと DataFrame.ta アクセサが登録される。
+    (読み込みが重いので、指標を計算する関数の中から呼ぶ)
+    """
+    import pandas_ta
+    return pandas_ta
+
 def api_retry_decorator(retries=3, delay=5):
     """
     API呼び出しが失敗した場合に、指定回数リトライするデコレータ。
@@ -20,3 +31,19 @@ def api_retry_decorator(retries=3, delay=5):
             return None # or return pd.DataFrame() for pandas functions
         return wrapper
     return decorator
+
+def top_k_positions(positions, key, k):
+    """
+    key の昇順で先頭 k 件の positions を返す。argpartition で k 番目の値を求めて候補を絞り、
+    同値は元の順に並べる (sorted() の安定ソートと同じ結果)。降順にしたいときは key に -値 を渡す。
+    """
+    positions, key = np.asarray(positions), np.asarray(key)
+    if k <= 0:
+        return positions[:0]
+    if len(positions) > k:
+        kth = key[np.argpartition(key, k - 1)[k - 1]]
+        better = np.flatnonzero(key < kth)
+        ties = np.flatnonzero(key == kth)[:k - len(better)]
+        keep = np.sort(np.concatenate([better, ties]))
+        positions, key = positions[keep], key[keep]
+    return positions[np.argsort(key, kind="stable")]